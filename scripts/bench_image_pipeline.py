@@ -0,0 +1,168 @@
+"""
+Benchmarks the upload image pipeline used by process_cover_image (catalog-service) and
+process_profile_picture (user-service): the original full-resolution path against the current
+reduced-scale path.
+
+  full:   reference only - the image is decoded at full resolution (img.load()) and then resized,
+          i.e. what the pipeline costs without any draft/reduced decoding.
+  before: the original code: the upload is saved to disk, re-opened, thumbnailed with LANCZOS and
+          saved in place. Note that Image.thumbnail() in Pillow >= 7 already drafts JPEGs itself.
+  after:  decoded straight from the upload stream after a header-only pixel check; JPEGs are drafted
+          to a reduced DCT scale and the resize uses reducing_gap=2.0 (as in the services).
+
+Every (image, pipeline, target) case runs in a fresh process, which reports its CPU time and its
+peak RSS growth while processing. Needs only Pillow, and Linux (/proc/self/status).
+
+Usage:
+  python scripts/bench_image_pipeline.py                  # generates a synthetic corpus in a temp dir
+  python scripts/bench_image_pipeline.py --corpus DIR     # uses the .jpg/.jpeg/.png/.gif files in DIR
+  python scripts/bench_image_pipeline.py --repeat 5
+"""
+import os
+import io
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import multiprocessing
+from PIL import Image
+
+TARGETS = {'cover': (400, 600), 'profile': (200, 200)} # TARGET_COVER_IMAGE_SIZE / TARGET_PROFILE_PIC_SIZE
+REDUCING_GAP = 2.0 # IMAGE_REDUCING_GAP in both services
+MAX_IMAGE_PIXELS = 50_000_000 # Default MAX_IMAGE_PIXELS in both services
+
+# Synthetic corpus: (file name, size, format); roughly phone photo, camera, screenshot and web sizes
+SYNTHETIC_CORPUS = [
+    ('phone_40mp.jpg', (7728, 5152), 'JPEG'),
+    ('phone_12mp.jpg', (4032, 3024), 'JPEG'),
+    ('web_2mp.jpg', (1920, 1080), 'JPEG'),
+    ('scan_6mp.png', (3000, 2000), 'PNG'),
+    ('banner.gif', (1200, 800), 'GIF'),
+]
+
+
+def make_synthetic_corpus(folder):
+    """Writes noisy gradient images (so JPEG/PNG sizes are realistic, not trivially compressible)."""
+    for name, size, image_format in SYNTHETIC_CORPUS:
+        noise = Image.effect_noise(size, 48)
+        gradient = Image.linear_gradient('L').resize(size)
+        img = Image.merge('RGB', (noise, gradient, Image.blend(noise, gradient, 0.5)))
+        if image_format == 'GIF':
+            img = img.convert('P', palette=Image.Palette.ADAPTIVE)
+        img.save(os.path.join(folder, name), image_format, **({'quality': 90} if image_format == 'JPEG' else {}))
+
+
+def process_full(data, target, workdir):
+    """Full-resolution decode before resizing (no draft), for reference."""
+    with Image.open(io.BytesIO(data)) as img:
+        image_format = img.format
+        img.load()
+        img = img.resize(target, Image.Resampling.LANCZOS)
+        img.save(os.path.join(workdir, 'full'), image_format)
+
+
+def process_before(data, target, workdir):
+    """The original pipeline: file.save(), then Image.open(path), thumbnail and save in place."""
+    path = os.path.join(workdir, 'upload')
+    with open(path, 'wb') as f:
+        f.write(data)
+    img = Image.open(path)
+    image_format = img.format
+    img.thumbnail(target, Image.Resampling.LANCZOS)
+    img.save(path, image_format)
+
+
+def process_after(data, target, workdir):
+    """The current pipeline, as in process_cover_image / process_profile_picture."""
+    stream = io.BytesIO(data) # Stands in for the upload's file.stream
+    with Image.open(stream) as img:
+        image_format = img.format
+        width, height = img.size
+        if width * height > MAX_IMAGE_PIXELS:
+            raise ValueError("Image is too large")
+        img.draft(img.mode, (int(target[0] * REDUCING_GAP), int(target[1] * REDUCING_GAP)))
+        img.thumbnail(target, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+        buffer = io.BytesIO()
+        img.save(buffer, image_format)
+    with open(os.path.join(workdir, 'processed'), 'wb') as f:
+        f.write(buffer.getvalue())
+
+
+PIPELINES = {'full': process_full, 'before': process_before, 'after': process_after}
+
+
+def _peak_rss_kib():
+    """
+    This process's peak RSS (VmHWM, Linux). Unlike getrusage's ru_maxrss, which survives exec and so
+    starts at the parent's peak, VmHWM belongs to the process's own address space.
+    """
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+    raise RuntimeError("VmHWM is not available on this platform")
+
+
+def _run_case(path, pipeline, target, workdir, results):
+    with open(path, 'rb') as f:
+        data = f.read()
+    baseline_rss = _peak_rss_kib()
+    cpu_start = time.process_time()
+    PIPELINES[pipeline](data, target, workdir)
+    cpu = time.process_time() - cpu_start
+    results.put((cpu, max(0, _peak_rss_kib() - baseline_rss) / 1024))
+
+
+def run_case(path, pipeline, target, workdir):
+    """Runs one case in a fresh process. Returns (cpu seconds, peak RSS growth in MiB)."""
+    context = multiprocessing.get_context('spawn') # A forked child would share this process's pages and peak RSS
+    results = context.Queue()
+    process = context.Process(target=_run_case, args=(path, pipeline, target, workdir, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', help='Folder of sample images (default: generate a synthetic corpus)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per case; the median is reported')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_image_')
+    try:
+        corpus = args.corpus
+        if not corpus:
+            corpus = os.path.join(workdir, 'corpus')
+            os.makedirs(corpus)
+            make_synthetic_corpus(corpus)
+        files = sorted(name for name in os.listdir(corpus)
+                       if name.lower().rsplit('.', 1)[-1] in ('jpg', 'jpeg', 'png', 'gif'))
+        if not files:
+            sys.exit(f"No images found in {corpus}")
+
+        print(f"{'image':<18} {'pixels':>8} {'target':<8} {'full cpu':>9} {'before cpu':>11} {'after cpu':>10} "
+              f"{'full MiB':>9} {'before MiB':>11} {'after MiB':>10}")
+        for name in files:
+            path = os.path.join(corpus, name)
+            with Image.open(path) as img:
+                megapixels = img.size[0] * img.size[1] / 1e6
+            for target_name, target in TARGETS.items():
+                measured = {}
+                for pipeline in PIPELINES:
+                    runs = [run_case(path, pipeline, target, workdir) for _ in range(args.repeat)]
+                    measured[pipeline] = (statistics.median(run[0] for run in runs),
+                                          statistics.median(run[1] for run in runs))
+                print(f"{name:<18} {megapixels:>6.1f}MP {target_name:<8} "
+                      f"{measured['full'][0] * 1000:>7.0f}ms {measured['before'][0] * 1000:>9.0f}ms "
+                      f"{measured['after'][0] * 1000:>8.0f}ms {measured['full'][1]:>9.1f} "
+                      f"{measured['before'][1]:>11.1f} {measured['after'][1]:>10.1f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""
+Benchmarks the catalog, user, order and payment list paths: ORM objects + to_dict() (before) against
+plain column tuples + the compiled row encoder (after), in rows per second.
+
+  orm:      Model.query over the rows, to_dict() per object, serialized (the original list code;
+            for orders with their items, loaded with selectin)
+  lean:     select(*COLUMNS) tuples, compile_row_encoder() dict per row, dumps() (the current code)
+  endpoint: the whole GET request through the Flask test client
+            (catalog: cold = fragment cache emptied before every request, warm = all cached;
+            orders and payments are paginated, so every page is fetched with the next-page cursor:
+            orders 'summary' = view=summary, 'full' = stored order documents with nested items)
+
+Each service runs in its own process, on a copy of its directory with a fresh SQLite database,
+since every service has its own app/models/config modules. Needs the services' requirements.
+
+Usage:
+  python scripts/bench_list_endpoints.py                 # 5000 rows, 5 runs each
+  python scripts/bench_list_endpoints.py --rows 20000 --runs 3
+"""
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'server')
+
+COMMON = '''
+import sys, time, datetime, statistics
+from flask import jsonify
+ROWS, RUNS = int(sys.argv[1]), int(sys.argv[2])
+
+def rate(label, func):
+    timings = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+        db.session.remove() # Fresh session (empty identity map) for every run
+    print(f"{SERVICE:<8} {label:<16} {ROWS / statistics.median(timings):>12,.0f} rows/s")
+'''
+
+CATALOG = COMMON + '''
+SERVICE = 'catalog'
+import app as appmod
+from app import app, db, dumps, _serialize_catalog_item, _serialize_catalog_row
+from models import Catalog, CATALOG_COLUMNS
+from read_cache import FragmentCache
+
+with app.app_context():
+    db.create_all()
+    now = datetime.datetime.now()
+    db.session.execute(db.insert(Catalog), [{
+        'title': f'Title {i}', 'author': f'Author {i % 500}', 'isbn': f'{9780000000000 + i}', 'price': 9.99 + i % 40,
+        'stock_quantity': i % 100, 'description': 'A book. ' * 20, 'publisher': 'Publisher', 'cover_image_filename': None,
+        'created_at': now, 'updated_at': now, 'change_seq': i + 1} for i in range(ROWS)])
+    db.session.commit()
+
+    def cold_cache():
+        appmod.catalog_cache = FragmentCache(app.config['CATALOG_READ_CACHE_MAX_BYTES'])
+
+    def orm():
+        cold_cache()
+        b'[' + b','.join(_serialize_catalog_item(item) for item in Catalog.query.order_by(Catalog.id)) + b']'
+
+    def lean():
+        cold_cache()
+        b'[' + b','.join(_serialize_catalog_row(row)
+                         for row in db.session.execute(db.select(*CATALOG_COLUMNS).order_by(Catalog.id))) + b']'
+
+    rate('orm', orm)
+    rate('lean', lean)
+
+client = app.test_client()
+def endpoint():
+    response = client.get('/catalog')
+    assert response.status_code == 200
+with app.app_context():
+    def endpoint_cold():
+        cold_cache()
+        endpoint()
+    rate('endpoint cold', endpoint_cold)
+    endpoint()
+    rate('endpoint warm', endpoint)
+'''
+
+USERS = COMMON + '''
+SERVICE = 'users'
+from app import app, db, dumps, encode_user_row
+from models import User, USER_COLUMNS
+
+with app.app_context():
+    db.create_all()
+    now = datetime.datetime.now()
+    db.session.execute(db.insert(User), [{
+        'username': f'user{i}', 'email': f'user{i}@example.com', 'password_hash': 'x' * 162, 'first_name': 'First',
+        'last_name': 'Last', 'role': 'customer', 'is_verified': bool(i % 2), 'created_at': now, 'updated_at': now}
+        for i in range(ROWS)])
+    db.session.commit()
+
+    def orm():
+        with app.test_request_context():
+            jsonify([user.to_dict() for user in User.query.all()])
+
+    def lean():
+        dumps([encode_user_row(row) for row in db.session.execute(db.select(*USER_COLUMNS).order_by(User.id))])
+
+    rate('orm', orm)
+    rate('lean', lean)
+
+client = app.test_client()
+def endpoint():
+    response = client.get('/users')
+    assert response.status_code == 200
+with app.app_context():
+    rate('endpoint', endpoint)
+'''
+
+PAGED = '''
+def page_through(client, url):
+    # Fetches every page of a keyset-paginated listing, following X-Next-Cursor
+    cursor = None
+    while True:
+        response = client.get(url + (f'&before={cursor}' if cursor else ''))
+        assert response.status_code == 200
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            return
+'''
+
+ORDERS = COMMON + PAGED + '''
+SERVICE = 'orders'
+from app import app, db, dumps, encode_order_summary_row
+from models import Order, OrderItem, ORDER_SUMMARY_COLUMNS
+import documents
+
+ITEMS_PER_ORDER = 3
+with app.app_context():
+    db.create_all()
+    now = datetime.datetime.now()
+    db.session.execute(db.insert(Order), [{
+        'id': i + 1, 'user_id': f'user{i % 200}', 'order_date': now - datetime.timedelta(seconds=i),
+        'total_amount': 29.5, 'status': 'pending', 'shipping_address': '1 Test Street', 'created_at': now,
+        'updated_at': now} for i in range(ROWS)])
+    db.session.execute(db.insert(OrderItem), [{
+        'id': i * ITEMS_PER_ORDER + n + 1, 'order_id': i + 1, 'book_id': str(n + 1), 'quantity': 1,
+        'price_at_purchase': 9.5 + n, 'created_at': now, 'updated_at': now}
+        for i in range(ROWS) for n in range(ITEMS_PER_ORDER)])
+    for start in range(0, ROWS, 500):
+        documents.refresh(range(start + 1, min(start + 500, ROWS) + 1))
+    db.session.commit()
+
+    def orm():
+        with app.test_request_context():
+            jsonify([order.to_dict() for order in Order.query.order_by(Order.order_date.desc(), Order.id.desc())])
+
+    def lean():
+        dumps([encode_order_summary_row(row) for row in db.session.execute(
+            db.select(*ORDER_SUMMARY_COLUMNS).order_by(Order.order_date.desc(), Order.id.desc()))])
+
+    rate('orm (items)', orm)
+    rate('lean (summary)', lean)
+
+client = app.test_client()
+with app.app_context():
+    rate('endpoint summary', lambda: page_through(client, '/orders?view=summary&limit=500'))
+    rate('endpoint full', lambda: page_through(client, '/orders?limit=500'))
+'''
+
+PAYMENTS = COMMON + PAGED + '''
+SERVICE = 'payments'
+from app import app, db, dumps, encode_payment_row
+from models import Payment, PAYMENT_COLUMNS
+
+with app.app_context():
+    db.create_all()
+    now = datetime.datetime.now()
+    db.session.execute(db.insert(Payment), [{
+        'order_id': str(i), 'user_id': f'user{i % 200}', 'amount': 29.5, 'currency': 'USD',
+        'payment_method': 'credit_card', 'transaction_id': f'txn-{i}', 'status': 'completed',
+        'payment_date': now - datetime.timedelta(seconds=i), 'settled_at': now, 'settlement_attempts': 1,
+        'created_at': now, 'updated_at': now} for i in range(ROWS)])
+    db.session.commit()
+
+    def orm():
+        with app.test_request_context():
+            jsonify([payment.to_dict() for payment in
+                     Payment.query.order_by(Payment.payment_date.desc(), Payment.id.desc())])
+
+    def lean():
+        dumps([encode_payment_row(row) for row in db.session.execute(
+            db.select(*PAYMENT_COLUMNS).order_by(Payment.payment_date.desc(), Payment.id.desc()))])
+
+    rate('orm', orm)
+    rate('lean', lean)
+
+client = app.test_client()
+with app.app_context():
+    rate('endpoint', lambda: page_through(client, '/payments?limit=500'))
+'''
+
+BENCHMARKS = [('catalog-service', CATALOG), ('user-service', USERS), ('order-service', ORDERS),
+              ('payment-service', PAYMENTS)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--runs', type=int, default=5, help='Runs per measurement; the median is reported')
+    args = parser.parse_args()
+
+    env = dict(os.environ, MEDIA_SWEEP_INTERVAL='0', PASSWORD_HASH_WORKERS='0', OUTBOX_DISPATCH_INTERVAL='0',
+               SETTLEMENT_WORKERS='0', CATALOG_TOMBSTONE_PURGE_INTERVAL='0', PYTHONPATH='.')
+    workdir = tempfile.mkdtemp(prefix='bench_lists_')
+    try:
+        for service, code in BENCHMARKS:
+            copy = os.path.join(workdir, service)
+            shutil.copytree(os.path.join(SERVER_DIR, service), copy,
+                            ignore=shutil.ignore_patterns('*.db', '__pycache__', 'static', 'tests'))
+            subprocess.run([sys.executable, '-c', code, str(args.rows), str(args.runs)], cwd=copy, env=env, check=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Benchmarks POST /login under a burst of concurrent logins, with password hashing inline on the
+request threads (PASSWORD_HASH_WORKERS=0, the original behaviour) against the process pool.
+
+For each case a copy of user-service is started as a threaded Flask server on a fresh SQLite database.
+--clients threads then log in --logins times in total, while a prober requests the light GET / route
+every 20 ms. Reported: logins per second, login p50/p99, GET / p99 (how much the login burst stalls
+every other route) and how many logins were shed with 503.
+
+Usage:
+  python scripts/bench_login.py                           # inline, 1 and 2 workers
+  python scripts/bench_login.py --workers 0 4 --clients 32 --logins 384
+  python scripts/bench_login.py --max-pending 4           # shows load shedding
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+import urllib.error
+import urllib.request
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'server')
+USERNAME, PASSWORD = 'bench', 'bench-password'
+PROBE_INTERVAL = 0.02
+
+SERVER = '''
+import sys
+from app import app, db
+from models import User
+
+if __name__ == '__main__':
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(username=%r, email='bench@example.com', password=%r))
+        db.session.commit()
+    app.run(port=int(sys.argv[1]), threaded=True)
+''' % (USERNAME, PASSWORD)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _request(url, body=None):
+    """Returns (status code, seconds taken)."""
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'} if data else {})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=120) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return status, time.perf_counter() - start
+
+
+def _wait_until_up(base_url, process):
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit("The user service exited during startup")
+        try:
+            _request(base_url + '/')
+            return
+        except OSError:
+            time.sleep(0.2)
+    sys.exit("The user service did not start within 60 s")
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else float('nan')
+
+
+def run_case(workdir, workers, args):
+    copy = os.path.join(workdir, f'user-service-{workers}')
+    shutil.copytree(os.path.join(SERVER_DIR, 'user-service'), copy,
+                    ignore=shutil.ignore_patterns('*.db', '__pycache__', 'static'))
+    port = _free_port()
+    env = dict(os.environ, PYTHONPATH='.', PASSWORD_HASH_WORKERS=str(workers),
+               PASSWORD_HASH_MAX_PENDING=str(args.max_pending), MEDIA_SWEEP_INTERVAL='0')
+    process = subprocess.Popen([sys.executable, '-c', SERVER, str(port)], cwd=copy, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        _wait_until_up(base_url, process)
+        _request(base_url + '/login', {'username_or_email': USERNAME, 'password': PASSWORD}) # Warm the pool
+
+        logins, probes = [], []
+        remaining = iter(range(args.logins))
+        lock = threading.Lock()
+        done = threading.Event()
+
+        def client():
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        return
+                logins.append(_request(base_url + '/login', {'username_or_email': USERNAME, 'password': PASSWORD}))
+
+        def prober():
+            while not done.is_set():
+                probes.append(_request(base_url + '/')[1])
+                time.sleep(PROBE_INTERVAL)
+
+        probe_thread = threading.Thread(target=prober)
+        probe_thread.start()
+        start = time.perf_counter()
+        clients = [threading.Thread(target=client) for _ in range(args.clients)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        done.set()
+        probe_thread.join()
+    finally:
+        process.terminate()
+        process.wait()
+
+    ok = [seconds for status, seconds in logins if status == 200]
+    shed = [seconds for status, seconds in logins if status == 503]
+    label = 'inline' if workers == 0 else f'{workers} worker(s)'
+    print(f"{label:<12} {len(ok) / elapsed:>9.1f} {_percentile(ok, 0.5) * 1000:>9.0f}ms "
+          f"{_percentile(ok, 0.99) * 1000:>9.0f}ms {_percentile(probes, 0.99) * 1000:>10.0f}ms "
+          f"{len(shed):>6} {statistics.median(shed) * 1000 if shed else 0:>8.0f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2],
+                        help='PASSWORD_HASH_WORKERS values to compare (0 = inline)')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--logins', type=int, default=192)
+    parser.add_argument('--max-pending', type=int, default=64, help='PASSWORD_HASH_MAX_PENDING')
+    args = parser.parse_args()
+
+    print(f"{'hashing':<12} {'logins/s':>9} {'login p50':>11} {'login p99':>11} {'GET / p99':>12} "
+          f"{'503s':>6} {'503 p50':>10}")
+    workdir = tempfile.mkdtemp(prefix='bench_login_')
+    try:
+        for workers in args.workers:
+            run_case(workdir, workers, args)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Benchmarks order creation (POST /orders) against ORDER_SHARD_COUNT = 1, 2, 4, ... with several
+concurrent writer processes, to show what spreading orders over several SQLite files buys.
+
+Every SQLite database has a single write lock, so with one shard all writers queue for it; with N
+shards, writers for customers on different shards commit in parallel. Each writer process runs the
+real create_order view through the Flask test client (order, items, rollups, outbox and document in
+one transaction), for random customers. Only the catalog price lookup is answered in-process,
+so the catalog service is not needed and its HTTP round trip is not measured.
+
+Reported per shard count: orders/s over all writers, commit latency p50/p99, and failed orders
+(e.g. "database is locked" after SQLite's busy timeout).
+
+Write-lock contention is only the bottleneck when a commit's critical section, mostly fsync, is
+long compared with the CPU work around it, and the writers have their own cores. On a single CPU, or
+on storage where fsync is nearly free (tmpfs), writers are CPU-bound and extra shards do not add
+throughput. Use --dir to put the databases on the disk the service really uses.
+
+Usage:
+  python scripts/bench_shards.py                          # 1, 2 and 4 shards, 8 writers, 1600 orders
+  python scripts/bench_shards.py --shards 1 8 --writers 16 --orders 4000 --dir /var/lib/orders-bench
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'server')
+
+SETUP = '''
+import shards
+from app import app, db
+from models import SHARDED_TABLES
+
+with app.app_context():
+    db.create_all()
+    shards.create_shard_tables(db, SHARDED_TABLES, app.config['ORDER_SHARD_COUNT'])
+'''
+
+WRITER = '''
+import sys, json, time, random
+import app as appmod
+from app import app
+
+ORDERS, START_AT, SEED = int(sys.argv[1]), float(sys.argv[2]), int(sys.argv[3])
+BOOKS = {book_id: {'price': 5.0 + book_id, 'stock_quantity': 10 ** 9} for book_id in range(1, 51)}
+appmod.catalog_client.get_items = lambda book_ids: {book_id: BOOKS[book_id] for book_id in set(book_ids) if book_id in BOOKS}
+
+client = app.test_client()
+rng = random.Random(SEED)
+latencies, failed = [], 0
+late = time.time() > START_AT
+time.sleep(max(0.0, START_AT - time.time())) # All writers start together, after their imports
+for _ in range(ORDERS):
+    body = {'user_id': f'customer-{rng.randrange(100000)}', 'shipping_address': '1 Bench Street',
+            'items': [{'book_id': rng.randint(1, 50), 'quantity': 1} for _ in range(rng.randint(1, 4))]}
+    start = time.perf_counter()
+    response = client.post('/orders', json=body)
+    latencies.append(time.perf_counter() - start)
+    if response.status_code != 201:
+        failed += 1
+print(json.dumps({'latencies': latencies, 'failed': failed, 'late': late, 'finished_at': time.time()}))
+'''
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else float('nan')
+
+
+def run_case(service_dir, db_dir, shard_count, args):
+    env = dict(os.environ, PYTHONPATH='.', ORDER_SHARD_COUNT=str(shard_count), OUTBOX_DISPATCH_INTERVAL='0',
+               ORDER_DATABASE_URI='sqlite:///' + os.path.join(db_dir, 'orders.db'),
+               ORDER_ARCHIVE_DATABASE_URI='sqlite:///' + os.path.join(db_dir, 'orders_archive.db'))
+    for index in range(1, shard_count):
+        env[f'ORDER_SHARD_{index}_DATABASE_URI'] = 'sqlite:///' + os.path.join(db_dir, f'orders_shard_{index}.db')
+    subprocess.run([sys.executable, '-c', SETUP], cwd=service_dir, env=env, check=True)
+
+    per_writer = args.orders // args.writers
+    start_at = time.time() + args.startup_seconds
+    writers = [subprocess.Popen([sys.executable, '-c', WRITER, str(per_writer), str(start_at), str(seed)],
+                                cwd=service_dir, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+               for seed in range(args.writers)]
+    results = []
+    for writer in writers:
+        output, _ = writer.communicate()
+        if writer.returncode != 0:
+            sys.exit(f"A writer process failed with exit code {writer.returncode}")
+        results.append(json.loads(output.decode().strip().splitlines()[-1]))
+
+    if any(result['late'] for result in results):
+        sys.exit("A writer was still importing the service at the start time: raise --startup-seconds")
+    elapsed = max(result['finished_at'] for result in results) - start_at
+    latencies = [latency for result in results for latency in result['latencies']]
+    failed = sum(result['failed'] for result in results)
+    print(f"{shard_count:>6} {args.writers:>7} {(len(latencies) - failed) / elapsed:>9.1f} "
+          f"{_percentile(latencies, 0.5) * 1000:>9.1f}ms {_percentile(latencies, 0.99) * 1000:>9.1f}ms {failed:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4], help='ORDER_SHARD_COUNT values')
+    parser.add_argument('--writers', type=int, default=8, help='Concurrent writer processes')
+    parser.add_argument('--orders', type=int, default=1600, help='Orders in total, split over the writers')
+    parser.add_argument('--dir', help='Where to create the databases (default: a temp dir)')
+    parser.add_argument('--startup-seconds', type=float, default=10.0,
+                        help='Head start for the writers to import the service before the clock starts')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_shards_', dir=args.dir)
+    try:
+        service_dir = os.path.join(workdir, 'order-service')
+        shutil.copytree(os.path.join(SERVER_DIR, 'order-service'), service_dir,
+                        ignore=shutil.ignore_patterns('*.db', '__pycache__', 'tests'))
+        print(f"{'shards':>6} {'writers':>7} {'orders/s':>9} {'p50':>11} {'p99':>11} {'failed':>7}")
+        for shard_count in args.shards:
+            db_dir = os.path.join(workdir, f'shards_{shard_count}')
+            os.makedirs(db_dir)
+            run_case(service_dir, db_dir, shard_count, args)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
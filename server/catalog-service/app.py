@@ -1,47 +1,194 @@
-from flask import Flask, request, jsonify, send_from_directory # Added send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context # Added send_from_directory
 from flask_cors import CORS
-from models import Catalog # MODIFIED: from Book to Catalog
+from models import Catalog, CatalogTombstone, CATALOG_COLUMNS, tombstone_horizon, purge_tombstones, backfill_change_sequence # MODIFIED: from Book to Catalog
 from database import db, init_db
 from config import Config
 import os
+import io
+import re
+import csv
+import json
+import time
+import datetime
+import threading
 from werkzeug.utils import secure_filename # NEW: For file uploads
-import uuid # NEW: For unique filenames
 from PIL import Image # NEW: For image processing
+from cover_cache import CoverDerivativeCache, COVER_SIZES, DEFAULT_COVER_SIZE
+from media_store import MediaStore
+from read_cache import FragmentCache
+from row_encoder import compile_row_encoder, dumps
+from sqlalchemy.exc import OperationalError
 
 app = Flask(__name__)
 app.config.from_object(Config)
 init_db(app)
 
+
+def _backfill_change_sequence():
+    """
+    Numbers catalog items that have no change_seq yet, so GET /catalog/changes from since=0
+    returns every current item. A database whose tables do not exist yet has nothing to number.
+    """
+    with app.app_context():
+        try:
+            stamped = backfill_change_sequence(db.session)
+        except OperationalError:
+            db.session.rollback()
+            return
+    if stamped:
+        app.logger.info(f"Assigned change feed positions to {stamped} catalog item(s)")
+
+
+_backfill_change_sequence()
+
 # NEW: Constants for file uploads and image processing (from Config)
 UPLOAD_FOLDER = Config.UPLOAD_FOLDER
 os.makedirs(UPLOAD_FOLDER, exist_ok=True) # Ensure upload directory exists
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 TARGET_COVER_IMAGE_SIZE = (400, 600) # Example size for book covers (width, height) - adjust as needed
+MAX_IMAGE_PIXELS = Config.MAX_IMAGE_PIXELS
+IMAGE_REDUCING_GAP = 2.0 # Final LANCZOS pass only ever shrinks by at most this factor
+IMAGE_FORMAT_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif'} # Decoded format -> stored extension
+
+# Stored covers are named after the SHA-256 of the uploaded bytes, so a name never changes content
+CONTENT_HASHED_NAME = re.compile(r'^([0-9a-f]{64})\.')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Let Pillow's own decompression-bomb guard agree with our limit
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# Content-addressed cover storage; orphaned files are removed by the background sweeper
+media_store = MediaStore(UPLOAD_FOLDER, IMAGE_FORMAT_EXTENSIONS.values(), Config.MEDIA_SWEEP_GRACE_SECONDS)
+
+# Resized and WebP variants of stored covers, served via ?size= and Accept negotiation
+cover_cache = CoverDerivativeCache(UPLOAD_FOLDER, Config.COVER_CACHE_FOLDER, Config.COVER_CACHE_MAX_BYTES)
+
+# Pre-serialized JSON per catalog item, reused by the read endpoints while updated_at is unchanged
+catalog_cache = FragmentCache(Config.CATALOG_READ_CACHE_MAX_BYTES)
+READ_CACHE_LOAD_CHUNK = 500 # Keeps IN (...) lists under SQLite's bound-parameter limit
+
+encode_catalog_row = compile_row_encoder(CATALOG_COLUMNS)
+
+CHANGE_FEED_DEFAULT_LIMIT = 100
+CHANGE_FEED_MAX_LIMIT = 1000
+
+LOOKUP_MAX_IDS = 1000
+
+EXPORT_CHUNK_SIZE = 1000 # Rows fetched per round trip by the streaming export
+EXPORT_CSV_FIELDS = ['id', 'title', 'author', 'isbn', 'price', 'stock_quantity', 'description', 'publisher',
+                     'cover_image_filename', 'cover_image_url', 'created_at', 'updated_at']
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def process_cover_image(filepath):
+def process_cover_image(file):
     """
-    Resizes an image saved at filepath to TARGET_COVER_IMAGE_SIZE.
-    Saves the resized image, overwriting the original.
-    Returns the original filepath (as the file is processed in place).
+    Decodes an uploaded cover image directly from the upload stream, shrinks it to fit
+    TARGET_COVER_IMAGE_SIZE (aspect ratio preserved) and stores it in the media store
+    under the SHA-256 of the uploaded bytes. An upload that is already stored is not
+    decoded again.
+    The pixel count is checked from the image header before anything is decoded,
+    and JPEGs are decoded at a reduced DCT scale so a large photo never has to
+    be held in memory at full resolution.
+    Raises ValueError if the upload is not a readable, supported image or is too large.
+    Returns the stored filename.
     """
+    digest = media_store.digest(file.stream)
+    existing = media_store.find(digest)
+    if existing:
+        return existing
+
     try:
-        img = Image.open(filepath)
+        img = Image.open(file.stream)
+    except (Image.UnidentifiedImageError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Invalid or oversized image: {e}")
 
-        # Resize image: maintain aspect ratio
-        img.thumbnail(TARGET_COVER_IMAGE_SIZE, Image.Resampling.LANCZOS) 
+    with img:
+        image_format = img.format
+        if image_format not in IMAGE_FORMAT_EXTENSIONS:
+            raise ValueError(f"Unsupported image format: {image_format}")
 
-        # Save the processed image back to the original path, preserving original format
-        # If original was PNG, it will be saved back as PNG, etc.
-        img.save(filepath) 
-        return filepath
+        width, height = img.size # Read from the header only, nothing is decoded yet
+        if width * height > MAX_IMAGE_PIXELS:
+            raise ValueError(f"Image is too large ({width}x{height}), limit is {MAX_IMAGE_PIXELS} pixels")
 
-    except Exception as e:
-        app.logger.error(f"Error processing cover image {filepath}: {e}")
-        return filepath # Return original path, indicating processing failed.
+        # JPEG only: ask libjpeg to decode at 1/2, 1/4 or 1/8 scale, keeping at least
+        # IMAGE_REDUCING_GAP times the target size for the final resampling pass
+        img.draft(img.mode, (int(TARGET_COVER_IMAGE_SIZE[0] * IMAGE_REDUCING_GAP),
+                             int(TARGET_COVER_IMAGE_SIZE[1] * IMAGE_REDUCING_GAP)))
+
+        try:
+            # Resize image: maintain aspect ratio
+            img.thumbnail(TARGET_COVER_IMAGE_SIZE, Image.Resampling.LANCZOS, reducing_gap=IMAGE_REDUCING_GAP)
+
+            # Encode in the original format; the resized result is small enough to keep in memory
+            buffer = io.BytesIO()
+            img.save(buffer, image_format)
+        except (OSError, SyntaxError) as e: # Truncated or corrupt image data
+            raise ValueError(f"Invalid image data: {e}")
+
+    filename = media_store.put(digest, IMAGE_FORMAT_EXTENSIONS[image_format], buffer.getvalue())
+
+    if Config.COVER_DERIVATIVES_ON_UPLOAD:
+        try:
+            cover_cache.warm(filename)
+        except Exception as e: # Derivatives are regenerated lazily, so this must not fail the upload
+            app.logger.error(f"Error generating cover derivatives for {filename}: {e}")
+    return filename
+
+
+def cover_reference_counts():
+    """Returns stored cover filename -> number of catalog items using it (for the media sweeper)."""
+    rows = db.session.query(Catalog.cover_image_filename, db.func.count(Catalog.id)) \
+        .filter(Catalog.cover_image_filename.isnot(None)) \
+        .group_by(Catalog.cover_image_filename).all()
+    return dict(rows)
+
+
+if Config.MEDIA_SWEEP_INTERVAL > 0:
+    media_store.start_sweeper(app, cover_reference_counts, Config.MEDIA_SWEEP_INTERVAL, on_remove=cover_cache.invalidate)
+
+
+def purge_expired_tombstones():
+    """Deletes change feed tombstones older than CATALOG_TOMBSTONE_RETENTION_SECONDS."""
+    cutoff = datetime.datetime.now() - datetime.timedelta(seconds=Config.CATALOG_TOMBSTONE_RETENTION_SECONDS)
+    return purge_tombstones(db.session, cutoff)
+
+
+def start_tombstone_purger(interval_seconds):
+    """Runs purge_expired_tombstones() every interval_seconds in a daemon thread."""
+    def run():
+        while True:
+            time.sleep(interval_seconds)
+            try:
+                with app.app_context():
+                    removed = purge_expired_tombstones()
+                if removed:
+                    app.logger.info(f"Purged {removed} expired change feed tombstone(s)")
+            except Exception as e:
+                app.logger.error(f"Tombstone purge failed: {e}")
+
+    thread = threading.Thread(target=run, name='tombstone-purger', daemon=True)
+    thread.start()
+    return thread
+
+
+if Config.CATALOG_TOMBSTONE_PURGE_INTERVAL > 0:
+    start_tombstone_purger(Config.CATALOG_TOMBSTONE_PURGE_INTERVAL)
+
+
+@app.cli.command('purge-tombstones')
+def purge_tombstones_command():
+    """Deletes change feed tombstones older than the retention window."""
+    print(f"Purged {purge_expired_tombstones()} expired tombstone(s)")
+
+
+@app.cli.command('sweep-media')
+def sweep_media_command():
+    """Removes stored cover images that no catalog item references any more."""
+    removed = media_store.sweep(cover_reference_counts(), on_remove=cover_cache.invalidate)
+    print(f"Removed {len(removed)} orphaned cover image(s)")
 
 
 CORS(app, resources={r"/*": {"origins": Config.CORS_ORIGINS}})
@@ -86,13 +233,10 @@ def create_catalog_item(): # MODIFIED: from create_book to create_catalog_item
     if 'cover_image' in request.files and request.files['cover_image'].filename != '':
         file = request.files['cover_image']
         if file and allowed_file(file.filename):
-            filename_orig = secure_filename(file.filename)
-            unique_filename = str(uuid.uuid4()) + '_' + filename_orig
-            file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
             try:
-                file.save(file_path)
-                processed_file_path = process_cover_image(file_path) # Process the saved image
-                cover_image_filename = os.path.basename(processed_file_path) # Store just the filename
+                cover_image_filename = process_cover_image(file) # Process straight from the upload
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
             except Exception as e:
                 app.logger.error(f"Error during cover image save/process for create_catalog_item: {e}")
                 return jsonify({"error": "Failed to save or process cover image"}), 500
@@ -121,33 +265,222 @@ def create_catalog_item(): # MODIFIED: from create_book to create_catalog_item
         return jsonify({"error": "Failed to create catalog item", "details": str(e)}), 500
     
 
+def _not_modified(etag):
+    """
+    Returns an empty 304 response if the request's If-None-Match already matches the weak etag,
+    otherwise None. Lets read endpoints skip loading and serializing rows the client already has.
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+    return None
+
+
+def _with_etag(response, etag):
+    response.set_etag(etag, weak=True)
+    return response
+
+
+def _timestamp_tag(value):
+    return value.isoformat() if value else 'none'
+
+
+def _add_cover_image_url(item_dict):
+    if item_dict['cover_image_filename']:
+        item_dict['cover_image_url'] = f"/static/cover_images/{item_dict['cover_image_filename']}"
+    else:
+        item_dict['cover_image_url'] = None # Ensure a clear URL if no image
+    return item_dict
+
+
+def _serialize_catalog_item(catalog_item):
+    """Serializes an item (with its cover_image_url) to JSON bytes and caches the fragment."""
+    fragment = dumps(_add_cover_image_url(catalog_item.to_dict()))
+    catalog_cache.put(catalog_item.id, catalog_item.updated_at, fragment)
+    return fragment
+
+
+def _serialize_catalog_row(row):
+    """Same as _serialize_catalog_item, for a plain CATALOG_COLUMNS row tuple."""
+    fragment = dumps(_add_cover_image_url(encode_catalog_row(row)))
+    catalog_cache.put(row.id, row.updated_at, fragment)
+    return fragment
+
+
 @app.route('/catalog', methods=['GET'])
 def get_all_catalog_items(): # MODIFIED: from get_all_books to get_all_catalog_items
-    catalog_items = Catalog.query.all() # MODIFIED: Catalog.query
-    # Construct full image URLs for response
-    items_with_urls = []
-    for item in catalog_items:
-        item_dict = item.to_dict()
-        if item_dict['cover_image_filename']:
-            item_dict['cover_image_url'] = f"/static/cover_images/{item_dict['cover_image_filename']}"
+    # The list only changes when a row is created, updated or deleted, which always moves
+    # the newest updated_at or the row count
+    latest_update, item_count = db.session.query(db.func.max(Catalog.updated_at), db.func.count(Catalog.id)).one()
+    etag = f"catalog-{item_count}-{_timestamp_tag(latest_update)}"
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+
+    # Only (id, updated_at) is read for every row; full rows are loaded just for cache misses
+    versions = db.session.query(Catalog.id, Catalog.updated_at).order_by(Catalog.id).all()
+    fragments = {}
+    missing_ids = []
+    for item_id, updated_at in versions:
+        fragment = catalog_cache.get(item_id, updated_at)
+        if fragment is None:
+            missing_ids.append(item_id)
         else:
-            item_dict['cover_image_url'] = None # Ensure a clear URL if no image
-        items_with_urls.append(item_dict)
-    return jsonify(items_with_urls), 200
+            fragments[item_id] = fragment
+
+    # Misses are read as plain column tuples: no ORM instances, no identity map
+    for start in range(0, len(missing_ids), READ_CACHE_LOAD_CHUNK):
+        chunk = missing_ids[start:start + READ_CACHE_LOAD_CHUNK]
+        for row in db.session.execute(db.select(*CATALOG_COLUMNS).where(Catalog.id.in_(chunk))):
+            fragments[row.id] = _serialize_catalog_row(row)
+
+    # Rows deleted between the two queries simply drop out
+    body = b'[' + b','.join(fragments[item_id] for item_id, _ in versions if item_id in fragments) + b']'
+    return _with_etag(Response(body, status=200, mimetype='application/json'), etag)
 
 
 @app.route('/catalog/<int:item_id>', methods=['GET'])
 def get_catalog_item(item_id): # MODIFIED: from get_book to get_catalog_item
-    catalog_item = Catalog.query.get(item_id) # MODIFIED: Catalog.query
-    if not catalog_item:
+    # Check the client's ETag against updated_at alone before loading the whole row
+    updated_at_row = db.session.query(Catalog.updated_at).filter(Catalog.id == item_id).first()
+    if not updated_at_row:
         return jsonify({"error": "Catalog item not found"}), 404
-    
-    item_dict = catalog_item.to_dict()
-    if item_dict['cover_image_filename']:
-        item_dict['cover_image_url'] = f"/static/cover_images/{item_dict['cover_image_filename']}"
+    etag = f"catalog-item-{item_id}-{_timestamp_tag(updated_at_row[0])}"
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+
+    fragment = catalog_cache.get(item_id, updated_at_row[0])
+    if fragment is None:
+        catalog_item = Catalog.query.get(item_id) # MODIFIED: Catalog.query
+        if not catalog_item:
+            return jsonify({"error": "Catalog item not found"}), 404
+        fragment = _serialize_catalog_item(catalog_item)
+    return _with_etag(Response(fragment, status=200, mimetype='application/json'), etag)
+
+
+@app.route('/catalog/changes', methods=['GET'])
+def get_catalog_changes():
+    """
+    Incremental change feed. Returns items created or updated and tombstones for items
+    deleted after the given cursor, oldest first.
+    Query parameters: since (cursor from a previous page, default 0), limit (default 100, max 1000).
+    Keep calling with since=next_cursor until has_more is false; the cursor stays valid,
+    so an interrupted sync resumes where it stopped.
+    Tombstones are kept for CATALOG_TOMBSTONE_RETENTION_SECONDS only. A cursor older than the
+    newest purged tombstone could have missed deletions, so it gets 410 with
+    {"resync_required": true, "oldest_cursor": N}: the client must discard its copy and sync
+    again from since=0, which returns every current item.
+    """
+    try:
+        since = int(request.args.get('since', 0))
+        limit = int(request.args.get('limit', CHANGE_FEED_DEFAULT_LIMIT))
+    except ValueError:
+        return jsonify({"error": "since and limit must be integers"}), 400
+    if since < 0 or limit <= 0:
+        return jsonify({"error": "since must be non-negative and limit positive"}), 400
+    limit = min(limit, CHANGE_FEED_MAX_LIMIT)
+
+    if since > 0:
+        horizon = tombstone_horizon(db.session)
+        if since < horizon:
+            return jsonify({"error": "Cursor has expired, resync from since=0",
+                            "resync_required": True, "oldest_cursor": horizon}), 410
+
+    # Fetch one extra row from each source to know whether another page follows
+    items = Catalog.query.filter(Catalog.change_seq > since) \
+        .order_by(Catalog.change_seq).limit(limit + 1).all()
+    tombstones = CatalogTombstone.query.filter(CatalogTombstone.change_seq > since) \
+        .order_by(CatalogTombstone.change_seq).limit(limit + 1).all()
+
+    changes = [(item.change_seq, 'upsert', item) for item in items]
+    changes += [(tombstone.change_seq, 'delete', tombstone) for tombstone in tombstones]
+    changes.sort(key=lambda change: change[0])
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+
+    payload = []
+    for seq, change_type, record in changes:
+        if change_type == 'upsert':
+            payload.append({'seq': seq, 'type': 'upsert', 'item': json.loads(_serialize_catalog_item(record))})
+        else:
+            payload.append({'seq': seq, 'type': 'delete', 'item': record.to_dict()})
+
+    return jsonify({
+        'changes': payload,
+        'next_cursor': changes[-1][0] if changes else since,
+        'has_more': has_more
+    }), 200
+
+
+@app.route('/catalog/lookup', methods=['POST'])
+def lookup_catalog_items():
+    """
+    Batch price and stock lookup for other services (e.g. order creation).
+    Expects JSON: {"ids": [1, 2, ...]}. Returns {"items": {"<id>": {...}}} for the ids that exist;
+    unknown ids are simply absent.
+    """
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get('ids'), list):
+        return jsonify({"error": "Expected JSON body with an 'ids' list"}), 400
+    try:
+        item_ids = sorted({int(item_id) for item_id in data['ids']})
+    except (ValueError, TypeError):
+        return jsonify({"error": "All ids must be integers"}), 400
+    if len(item_ids) > LOOKUP_MAX_IDS:
+        return jsonify({"error": f"At most {LOOKUP_MAX_IDS} ids can be looked up at once"}), 400
+
+    items = {}
+    for start in range(0, len(item_ids), READ_CACHE_LOAD_CHUNK):
+        chunk = item_ids[start:start + READ_CACHE_LOAD_CHUNK]
+        rows = db.session.execute(db.select(Catalog.id, Catalog.title, Catalog.price, Catalog.stock_quantity)
+                                  .where(Catalog.id.in_(chunk)))
+        for item_id, title, price, stock_quantity in rows:
+            items[str(item_id)] = {'id': item_id, 'title': title, 'price': price, 'stock_quantity': stock_quantity}
+    return jsonify({"items": items}), 200
+
+
+@app.route('/catalog/export', methods=['GET'])
+def export_catalog():
+    """
+    Streams the whole catalog as NDJSON (default) or CSV (?format=csv).
+    Rows are read from the database in chunks of EXPORT_CHUNK_SIZE and written out one by one,
+    so memory use stays flat however large the catalog is.
+    """
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({"error": "Invalid format. Allowed formats are: ndjson, csv"}), 400
+
+    def generate_ndjson():
+        rows = db.session.execute(db.select(*CATALOG_COLUMNS).order_by(Catalog.id).execution_options(yield_per=EXPORT_CHUNK_SIZE))
+        for row in rows:
+            yield dumps(_add_cover_image_url(encode_catalog_row(row))) + b'\n'
+
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_CSV_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        rows = db.session.execute(db.select(*CATALOG_COLUMNS).order_by(Catalog.id).execution_options(yield_per=EXPORT_CHUNK_SIZE))
+        for row in rows:
+            writer.writerow(_add_cover_image_url(encode_catalog_row(row)))
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    if export_format == 'csv':
+        response = Response(stream_with_context(generate_csv()), mimetype='text/csv')
+        response.headers['Content-Disposition'] = 'attachment; filename=catalog.csv'
     else:
-        item_dict['cover_image_url'] = None
-    return jsonify(item_dict), 200
+        response = Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+    return response
+
+
+@app.route('/catalog/cache/stats', methods=['GET'])
+def get_catalog_cache_stats():
+    """Hit rate and memory use of the serialized read cache."""
+    return jsonify(catalog_cache.stats()), 200
 
 
 @app.route('/catalog/<int:item_id>', methods=['PUT'])
@@ -190,22 +523,15 @@ def update_catalog_item(item_id): # MODIFIED: from update_book to update_catalog
         if 'publisher' in data: # NEW
             catalog_item.publisher = data['publisher']
         
-        # Handle cover image upload
+        # Handle cover image upload (the replaced file is left to the media sweeper)
         if 'cover_image' in request.files and request.files['cover_image'].filename != '':
             file = request.files['cover_image']
             if file and allowed_file(file.filename):
-                filename_orig = secure_filename(file.filename)
-                unique_filename = str(uuid.uuid4()) + '_' + filename_orig
-                file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
                 try:
-                    # Delete old cover image if it exists
-                    if catalog_item.cover_image_filename and \
-                       os.path.exists(os.path.join(UPLOAD_FOLDER, catalog_item.cover_image_filename)):
-                        os.remove(os.path.join(UPLOAD_FOLDER, catalog_item.cover_image_filename))
-
-                    file.save(file_path)
-                    processed_file_path = process_cover_image(file_path) # Process the saved image
-                    catalog_item.cover_image_filename = os.path.basename(processed_file_path) # Store just the filename
+                    catalog_item.cover_image_filename = process_cover_image(file) # Process straight from the upload
+                except ValueError as e:
+                    db.session.rollback()
+                    return jsonify({"error": str(e)}), 400
                 except Exception as e:
                     app.logger.error(f"Error during cover image save/process for update_catalog_item: {e}")
                     return jsonify({"error": "Failed to save or process cover image"}), 500
@@ -215,6 +541,7 @@ def update_catalog_item(item_id): # MODIFIED: from update_book to update_catalog
             catalog_item.cover_image_filename = data.get('cover_image_filename')
         
         db.session.commit()
+        catalog_cache.invalidate(item_id)
         
         # Construct full image URL for response
         item_dict = catalog_item.to_dict()
@@ -240,13 +567,11 @@ def delete_catalog_item(item_id): # MODIFIED: from delete_book to delete_catalog
         return jsonify({"error": "Catalog item not found"}), 404
 
     try:
-        # Delete associated cover image file if it exists
-        if catalog_item.cover_image_filename and \
-           os.path.exists(os.path.join(UPLOAD_FOLDER, catalog_item.cover_image_filename)):
-            os.remove(os.path.join(UPLOAD_FOLDER, catalog_item.cover_image_filename))
-
+        # The cover image file is shared by content, so it is removed by the media sweeper
+        # once no catalog item references it any more
         db.session.delete(catalog_item) # MODIFIED: catalog_item
         db.session.commit()
+        catalog_cache.invalidate(item_id)
         return jsonify({"message": f"Catalog item {item_id} deleted successfully"}), 200
     except Exception as e:
         db.session.rollback()
@@ -256,10 +581,73 @@ def delete_catalog_item(item_id): # MODIFIED: from delete_book to delete_catalog
 
 
 
+def _client_accepts_webp():
+    # Only an explicit image/webp entry counts; browsers send */* to every image request
+    return any(mimetype == 'image/webp' and quality > 0 for mimetype, quality in request.accept_mimetypes)
+
+
+def _send_image(directory, filename, internal_prefix):
+    """
+    Sends an image with caching headers.
+    Content-hashed files (and their derivatives) get a strong ETag equal to their name and an
+    immutable one-year max-age, so browsers and CDNs never ask again. Range requests and
+    If-None-Match/If-Modified-Since 304s are handled by send_from_directory.
+    With STATIC_FILE_OFFLOAD = 'x-accel' the body is left to nginx via X-Accel-Redirect;
+    with 'sendfile' Flask's USE_X_SENDFILE hands the path to the front server instead.
+    """
+    content_hashed = CONTENT_HASHED_NAME.match(filename) is not None
+    if Config.STATIC_FILE_OFFLOAD == 'x-accel':
+        if not os.path.isfile(os.path.join(directory, filename)):
+            response = jsonify({"error": "Image not found"})
+            response.status_code = 404
+            return response
+        response = Response(status=200)
+        response.headers['X-Accel-Redirect'] = f"{internal_prefix}/{filename}"
+        del response.headers['Content-Type'] # Let nginx pick it from the file extension
+        if content_hashed:
+            response.set_etag(filename)
+            response.make_conditional(request)
+    else:
+        response = send_from_directory(directory, filename, etag=filename if content_hashed else True,
+                                       max_age=IMMUTABLE_MAX_AGE if content_hashed else None)
+    if content_hashed:
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+
 # NEW ROUTE: To serve static cover images
 @app.route('/static/cover_images/<filename>')
 def serve_cover_image(filename):
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    """
+    Serves a cover image. Optional query parameters:
+      size   - one of COVER_SIZES ('thumb', 'card', 'full'), defaults to 'full'
+      format - 'webp' or 'original'; when omitted, WebP is served if the Accept header lists it
+    """
+    size = request.args.get('size', DEFAULT_COVER_SIZE)
+    if size not in COVER_SIZES:
+        return jsonify({"error": f"Invalid size. Allowed sizes are: {', '.join(COVER_SIZES)}"}), 400
+
+    requested_format = request.args.get('format')
+    if requested_format not in (None, 'webp', 'original'):
+        return jsonify({"error": "Invalid format. Allowed formats are: webp, original"}), 400
+    webp = requested_format == 'webp' or (requested_format is None and _client_accepts_webp())
+
+    try:
+        variant = cover_cache.get(secure_filename(filename), size, webp)
+    except Exception as e:
+        app.logger.error(f"Error generating {size} cover derivative for {filename}: {e}")
+        variant = (UPLOAD_FOLDER, filename) # Fall back to the stored cover
+    if variant is None:
+        return jsonify({"error": "Cover image not found"}), 404
+
+    directory, variant_name = variant
+    internal_prefix = Config.STATIC_FILE_OFFLOAD_PREFIX + ('/cover_images' if directory == UPLOAD_FOLDER else '/cover_cache')
+    response = _send_image(directory, variant_name, internal_prefix)
+    if requested_format is None:
+        response.vary.add('Accept')
+    return response
 
 
 if __name__ == '__main__':
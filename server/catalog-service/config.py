@@ -2,10 +2,40 @@ import os
 
 class Config:
     BASEDIR = os.path.abspath(os.path.dirname(__file__))
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(BASEDIR, 'books.db')
+    SQLALCHEMY_DATABASE_URI = os.environ.get('CATALOG_DATABASE_URI') or 'sqlite:///' + os.path.join(BASEDIR, 'books.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'thisisanothersecretkeythatididnotwanttouse'
     CORS_ORIGINS = ["http://localhost:3000"]
 
     # Upload folder for book covers
-    UPLOAD_FOLDER = os.path.join(BASEDIR, 'static', 'cover_images')
\ No newline at end of file
+    UPLOAD_FOLDER = os.path.join(BASEDIR, 'static', 'cover_images')
+
+    # Uploads whose header declares more pixels than this are rejected before any decoding
+    MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS') or 50_000_000)
+
+    # Disk cache for resized/WebP cover derivatives (thumb, card, full)
+    COVER_CACHE_FOLDER = os.path.join(BASEDIR, 'static', 'cover_cache')
+    COVER_CACHE_MAX_BYTES = int(os.environ.get('COVER_CACHE_MAX_BYTES') or 256 * 1024 * 1024)
+    # Generate every derivative when a cover is uploaded instead of on first request
+    COVER_DERIVATIVES_ON_UPLOAD = os.environ.get('COVER_DERIVATIVES_ON_UPLOAD', 'true').lower() == 'true'
+
+    # Hand image bodies to the front web server instead of streaming them from Python:
+    # '' (serve directly), 'x-accel' (nginx X-Accel-Redirect) or 'sendfile' (X-Sendfile)
+    STATIC_FILE_OFFLOAD = os.environ.get('STATIC_FILE_OFFLOAD', '')
+    # nginx `internal` location mapped onto the static folder, used in x-accel mode
+    STATIC_FILE_OFFLOAD_PREFIX = os.environ.get('STATIC_FILE_OFFLOAD_PREFIX', '/protected')
+    USE_X_SENDFILE = STATIC_FILE_OFFLOAD == 'sendfile'
+
+    # Background removal of cover images no catalog item references (0 disables the sweeper)
+    MEDIA_SWEEP_INTERVAL = int(os.environ.get('MEDIA_SWEEP_INTERVAL') or 3600)
+    # Unreferenced files younger than this are kept, so in-flight uploads can still claim them
+    MEDIA_SWEEP_GRACE_SECONDS = int(os.environ.get('MEDIA_SWEEP_GRACE_SECONDS') or 3600)
+
+    # Change feed tombstones older than this are purged; cursors from before the oldest purged
+    # tombstone get 410 with resync_required (see GET /catalog/changes)
+    CATALOG_TOMBSTONE_RETENTION_SECONDS = int(os.environ.get('CATALOG_TOMBSTONE_RETENTION_SECONDS') or 30 * 24 * 3600)
+    # How often the background purge runs (0 disables it; `flask purge-tombstones` still works)
+    CATALOG_TOMBSTONE_PURGE_INTERVAL = int(os.environ.get('CATALOG_TOMBSTONE_PURGE_INTERVAL') or 3600)
+
+    # Memory cap for the in-process cache of serialized catalog items
+    CATALOG_READ_CACHE_MAX_BYTES = int(os.environ.get('CATALOG_READ_CACHE_MAX_BYTES') or 32 * 1024 * 1024)
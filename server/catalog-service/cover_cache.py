@@ -0,0 +1,136 @@
+import os
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+# Named derivative sizes (width, height). 'full' matches the size covers are stored at.
+COVER_SIZES = {
+    'thumb': (100, 150),
+    'card': (200, 300),
+    'full': (400, 600),
+}
+DEFAULT_COVER_SIZE = 'full'
+
+WEBP_QUALITY = 80
+
+
+class CoverDerivativeCache:
+    """
+    Disk cache of resized (and optionally WebP-encoded) variants of stored cover images.
+    Derivatives are created from the stored cover on first request (or eagerly via warm())
+    and evicted least-recently-used once the cache grows past max_bytes.
+    Every worker process keeps its own LRU index over the shared folder, so the index is only a hint:
+    a hit is checked against the disk (another worker may have evicted the file) and a file another
+    worker generated is adopted into the index instead of being generated again.
+    """
+
+    def __init__(self, source_folder, cache_folder, max_bytes):
+        self.source_folder = source_folder
+        self.cache_folder = cache_folder
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # derivative filename -> size in bytes, oldest first
+        self._total_bytes = 0
+        os.makedirs(cache_folder, exist_ok=True)
+        self._load_existing()
+
+    def _load_existing(self):
+        """Seeds the LRU order from files already on disk, least recently modified first."""
+        existing = []
+        for name in os.listdir(self.cache_folder):
+            path = os.path.join(self.cache_folder, name)
+            if os.path.isfile(path) and not name.endswith('.tmp'):
+                stat = os.stat(path)
+                existing.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(existing):
+            self._entries[name] = size
+            self._total_bytes += size
+
+    @staticmethod
+    def derivative_name(filename, size, webp=False):
+        stem, ext = os.path.splitext(filename)
+        return f"{stem}.{size}{'.webp' if webp else ext}"
+
+    def get(self, filename, size=DEFAULT_COVER_SIZE, webp=False):
+        """
+        Returns (directory, filename) of the requested variant of a stored cover,
+        generating it if needed. Returns None if the source cover does not exist.
+        Raises ValueError for an unknown size name.
+        """
+        if size not in COVER_SIZES:
+            raise ValueError(f"Invalid size. Allowed sizes are: {', '.join(COVER_SIZES)}")
+
+        source_path = os.path.join(self.source_folder, filename)
+        if not os.path.isfile(source_path):
+            return None
+
+        # The stored cover already is the full size in its original format
+        if size == DEFAULT_COVER_SIZE and not webp:
+            return self.source_folder, filename
+
+        name = self.derivative_name(filename, size, webp)
+        path = os.path.join(self.cache_folder, name)
+        with self._lock:
+            if name in self._entries:
+                if os.path.isfile(path):
+                    self._entries.move_to_end(name)
+                    return self.cache_folder, name
+                self._total_bytes -= self._entries.pop(name) # Evicted by another worker process
+
+        try:
+            self._add(name, os.path.getsize(path)) # Generated by another worker process
+        except FileNotFoundError:
+            self._generate(source_path, name, COVER_SIZES[size], webp)
+        return self.cache_folder, name
+
+    def warm(self, filename):
+        """Pre-generates every size in both the original format and WebP (used at upload time)."""
+        for size in COVER_SIZES:
+            for webp in (False, True):
+                self.get(filename, size, webp)
+
+    def invalidate(self, filename):
+        """Removes every derivative of a stored cover, e.g. when the cover is replaced or deleted."""
+        for size in COVER_SIZES:
+            for webp in (False, True):
+                self._remove(self.derivative_name(filename, size, webp))
+
+    def _generate(self, source_path, name, target_size, webp):
+        path = os.path.join(self.cache_folder, name)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with Image.open(source_path) as img:
+            source_format = img.format
+            img.thumbnail(target_size, Image.Resampling.LANCZOS)
+            if webp:
+                if img.mode not in ('RGB', 'RGBA'):
+                    img = img.convert('RGBA' if 'transparency' in img.info or img.mode in ('LA', 'PA') else 'RGB')
+                img.save(tmp_path, 'WEBP', quality=WEBP_QUALITY, method=4)
+            else:
+                img.save(tmp_path, source_format)
+        os.replace(tmp_path, path) # Atomic, so concurrent readers never see a partial file
+        self._add(name, os.path.getsize(path))
+
+    def _add(self, name, file_size):
+        with self._lock:
+            self._total_bytes += file_size - self._entries.pop(name, 0)
+            self._entries[name] = file_size
+            self._evict()
+
+    def _evict(self):
+        """Drops least-recently-used derivatives until the cache fits in max_bytes. Caller holds the lock."""
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            name, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(os.path.join(self.cache_folder, name))
+            except FileNotFoundError:
+                pass
+
+    def _remove(self, name):
+        with self._lock:
+            self._total_bytes -= self._entries.pop(name, 0)
+        # Removed even when not in this process's index: another worker may have generated it
+        try:
+            os.remove(os.path.join(self.cache_folder, name))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,102 @@
+import os
+import time
+import hashlib
+import threading
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+class MediaStore:
+    """
+    Content-addressed image store. Every stored file is named <sha256 of the uploaded bytes>.<ext>,
+    so uploading the same image twice resolves to the file that is already there and skips
+    decoding and resizing entirely.
+    Files are never deleted by the request handlers; sweep() removes files that no database row
+    references any more, once they are older than a grace period (which protects an upload that
+    has just reused a file but not committed its row yet).
+    """
+
+    def __init__(self, folder, extensions, grace_seconds=3600):
+        self.folder = folder
+        self.extensions = tuple(extensions)
+        self.grace_seconds = grace_seconds
+        os.makedirs(folder, exist_ok=True)
+
+    @staticmethod
+    def digest(stream):
+        """Hashes an upload stream in chunks, then rewinds it so it can still be decoded."""
+        sha = hashlib.sha256()
+        for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+            sha.update(chunk)
+        stream.seek(0)
+        return sha.hexdigest()
+
+    def find(self, digest):
+        """
+        Returns the stored filename for an upload digest, or None.
+        A hit refreshes the file's mtime so the sweeper's grace period starts over.
+        """
+        for ext in self.extensions:
+            filename = f"{digest}.{ext}"
+            path = os.path.join(self.folder, filename)
+            if os.path.isfile(path):
+                try:
+                    os.utime(path)
+                except FileNotFoundError: # Swept in the meantime
+                    return None
+                return filename
+        return None
+
+    def put(self, digest, ext, data):
+        """Writes processed image bytes under the upload digest. Returns the stored filename."""
+        filename = f"{digest}.{ext}"
+        path = os.path.join(self.folder, filename)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path) # Atomic, so readers never see a partial file
+        return filename
+
+    def sweep(self, reference_counts, on_remove=None):
+        """
+        Removes stored files that have no references and are older than the grace period.
+        reference_counts maps stored filename -> number of rows pointing at it.
+        on_remove(filename) is called for each removed file (e.g. to drop cached derivatives).
+        Returns the list of removed filenames.
+        """
+        cutoff = time.time() - self.grace_seconds
+        removed = []
+        for name in os.listdir(self.folder):
+            if reference_counts.get(name, 0) > 0 or name.endswith('.tmp'):
+                continue
+            path = os.path.join(self.folder, name)
+            try:
+                if not os.path.isfile(path) or os.path.getmtime(path) > cutoff:
+                    continue
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            removed.append(name)
+            if on_remove:
+                on_remove(name)
+        return removed
+
+    def start_sweeper(self, app, count_references, interval_seconds, on_remove=None):
+        """
+        Runs sweep() every interval_seconds in a daemon thread.
+        count_references() is called inside an app context and must return the reference counts.
+        """
+        def run():
+            while True:
+                time.sleep(interval_seconds)
+                try:
+                    with app.app_context():
+                        removed = self.sweep(count_references(), on_remove)
+                    if removed:
+                        app.logger.info(f"Media sweeper removed {len(removed)} orphaned file(s) from {self.folder}")
+                except Exception as e:
+                    app.logger.error(f"Media sweeper failed for {self.folder}: {e}")
+
+        thread = threading.Thread(target=run, name='media-sweeper', daemon=True)
+        thread.start()
+        return thread
@@ -1,5 +1,6 @@
 from database import db
 import datetime
+from sqlalchemy import event, update, select, delete, case
 
 class Catalog(db.Model): # RENAMED: from Book to Catalog
     __tablename__ = 'catalog_item' # RENAMED: from book to catalog_item
@@ -16,6 +17,9 @@ class Catalog(db.Model): # RENAMED: from Book to Catalog
 
     created_at = db.Column(db.DateTime, default=datetime.datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+    # NEW FIELD: position in the change feed, bumped on every insert/update (see assign_change_sequence);
+    # rows from before the change feed are numbered at startup by backfill_change_sequence
+    change_seq = db.Column(db.Integer, nullable=False, index=True)
 
     def __init__(self, title, author, isbn, price, stock_quantity=0, description=None, publisher=None, cover_image_filename=None): # MODIFIED: added publisher, default stock_quantity, cover_image_filename
         self.title = title
@@ -43,4 +47,144 @@ class Catalog(db.Model): # RENAMED: from Book to Catalog
         }
 
     def __repr__(self):
-        return f'<Catalog {self.title} by {self.author}>' # MODIFIED: Catalog instead of Book
\ No newline at end of file
+        return f'<Catalog {self.title} by {self.author}>' # MODIFIED: Catalog instead of Book
+
+
+# Columns read by the lean list path (plain tuples, no ORM objects), matching to_dict()
+CATALOG_COLUMNS = (
+    Catalog.id, Catalog.title, Catalog.author, Catalog.isbn, Catalog.price, Catalog.stock_quantity,
+    Catalog.description, Catalog.publisher, Catalog.cover_image_filename, Catalog.created_at, Catalog.updated_at
+)
+
+
+class CatalogTombstone(db.Model):
+    """Records a deleted catalog item so change feed consumers can drop it."""
+    __tablename__ = 'catalog_tombstone'
+
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, nullable=False)
+    change_seq = db.Column(db.Integer, nullable=False, index=True)
+    deleted_at = db.Column(db.DateTime, default=datetime.datetime.now, nullable=False)
+
+    def to_dict(self):
+        return {
+            'id': self.item_id,
+            'deleted_at': self.deleted_at.isoformat() if self.deleted_at else None
+        }
+
+
+class CatalogChangeCounter(db.Model):
+    """Single-row counter handing out change_seq values to items and tombstones."""
+    __tablename__ = 'catalog_change_counter'
+
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+
+class CatalogTombstoneHorizon(db.Model):
+    """
+    Single-row record of the highest change_seq among purged tombstones. A change feed cursor
+    below it may have missed deletions, so it can no longer be resumed.
+    """
+    __tablename__ = 'catalog_tombstone_horizon'
+
+    id = db.Column(db.Integer, primary_key=True)
+    purged_through = db.Column(db.Integer, nullable=False, default=0)
+
+
+TOMBSTONE_PURGE_CHUNK_SIZE = 1000 # Tombstones deleted per transaction, so a purge never holds the write lock for long
+
+
+def tombstone_horizon(session):
+    """Returns the highest purged tombstone change_seq (0 if none was ever purged)."""
+    horizon = session.execute(select(CatalogTombstoneHorizon.purged_through)
+                              .where(CatalogTombstoneHorizon.id == 1)).scalar()
+    return horizon or 0
+
+
+def purge_tombstones(session, older_than):
+    """
+    Deletes tombstones recorded before older_than, TOMBSTONE_PURGE_CHUNK_SIZE per transaction,
+    raising the horizon in the same transaction as each delete. Returns the number removed.
+    """
+    removed = 0
+    while True:
+        rows = session.execute(select(CatalogTombstone.id, CatalogTombstone.change_seq)
+                               .where(CatalogTombstone.deleted_at < older_than)
+                               .order_by(CatalogTombstone.change_seq)
+                               .limit(TOMBSTONE_PURGE_CHUNK_SIZE)).all()
+        if not rows:
+            session.rollback()
+            return removed
+        highest = max(seq for _, seq in rows)
+        session.execute(delete(CatalogTombstone).where(CatalogTombstone.id.in_([id_ for id_, _ in rows])))
+        result = session.execute(update(CatalogTombstoneHorizon)
+                                 .where(CatalogTombstoneHorizon.id == 1)
+                                 .values(purged_through=case((CatalogTombstoneHorizon.purged_through < highest, highest),
+                                                              else_=CatalogTombstoneHorizon.purged_through)))
+        if result.rowcount == 0:
+            session.execute(CatalogTombstoneHorizon.__table__.insert().values(id=1, purged_through=highest))
+        session.commit()
+        removed += len(rows)
+
+
+def _next_change_sequence(session, count):
+    """
+    Reserves count consecutive sequence numbers and returns the first one.
+    The UPDATE takes SQLite's write lock, so concurrent writers never get the same numbers.
+    """
+    result = session.execute(update(CatalogChangeCounter)
+                             .where(CatalogChangeCounter.id == 1)
+                             .values(value=CatalogChangeCounter.value + count))
+    if result.rowcount == 0:
+        session.execute(CatalogChangeCounter.__table__.insert().values(id=1, value=count))
+    last = session.execute(select(CatalogChangeCounter.value).where(CatalogChangeCounter.id == 1)).scalar_one()
+    return last - count + 1
+
+
+CHANGE_SEQ_BACKFILL_CHUNK_SIZE = 1000 # Unnumbered items stamped per transaction by backfill_change_sequence
+
+
+def backfill_change_sequence(session):
+    """
+    Gives every catalog item without a change_seq (rows written before the change feed existed,
+    or by inserts that bypass the ORM session) a fresh one, so the feed from since=0 is complete.
+    Works in chunks of CHANGE_SEQ_BACKFILL_CHUNK_SIZE ids; within a chunk an item gets
+    first + (id - lowest id), leaving harmless gaps instead of one UPDATE per row.
+    updated_at is kept as it is, so ETags and caches are not disturbed. Returns the number stamped.
+    """
+    stamped = 0
+    while True:
+        ids = session.scalars(select(Catalog.id).where(Catalog.change_seq.is_(None))
+                              .order_by(Catalog.id).limit(CHANGE_SEQ_BACKFILL_CHUNK_SIZE)).all()
+        if not ids:
+            session.rollback()
+            return stamped
+        first = _next_change_sequence(session, ids[-1] - ids[0] + 1)
+        session.execute(update(Catalog.__table__)
+                        .where(Catalog.id.in_(ids), Catalog.change_seq.is_(None))
+                        .values(change_seq=first + Catalog.id - ids[0], updated_at=Catalog.updated_at))
+        session.commit()
+        stamped += len(ids)
+
+
+@event.listens_for(db.session, 'before_flush')
+def assign_change_sequence(session, flush_context, instances):
+    """
+    Stamps every inserted or modified Catalog row with a fresh change_seq and writes a tombstone
+    for every deleted one, in the same transaction, so the change feed sees every write path.
+    """
+    changed = [obj for obj in session.new if isinstance(obj, Catalog)]
+    changed += [obj for obj in session.dirty if isinstance(obj, Catalog) and session.is_modified(obj)]
+    deleted = [obj for obj in session.deleted if isinstance(obj, Catalog)]
+    if not changed and not deleted:
+        return
+
+    with session.no_autoflush:
+        seq = _next_change_sequence(session, len(changed) + len(deleted))
+        for obj in changed:
+            obj.change_seq = seq
+            seq += 1
+        for obj in deleted:
+            session.add(CatalogTombstone(item_id=obj.id, change_seq=seq))
+            seq += 1
@@ -0,0 +1,64 @@
+import threading
+from collections import OrderedDict
+
+
+class FragmentCache:
+    """
+    Bounded in-process cache of pre-serialized JSON fragments, one per catalog item.
+    Each fragment is stored with the row's updated_at, so a fragment is only served while it
+    still matches the database (writes made by another worker are picked up too).
+    Least-recently-used fragments are evicted once the cached bytes exceed max_bytes.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._fragments = OrderedDict() # item id -> (updated_at, fragment bytes), oldest first
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, item_id, updated_at):
+        """Returns the cached fragment for item_id if it was built from this updated_at, else None."""
+        with self._lock:
+            entry = self._fragments.get(item_id)
+            if entry is None or entry[0] != updated_at:
+                self.misses += 1
+                return None
+            self._fragments.move_to_end(item_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, item_id, updated_at, fragment):
+        with self._lock:
+            previous = self._fragments.pop(item_id, None)
+            if previous is not None:
+                self._bytes -= len(previous[1])
+            if len(fragment) > self.max_bytes:
+                return
+            self._fragments[item_id] = (updated_at, fragment)
+            self._bytes += len(fragment)
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._fragments.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def invalidate(self, item_id):
+        with self._lock:
+            entry = self._fragments.pop(item_id, None)
+            if entry is not None:
+                self._bytes -= len(entry[1])
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._fragments),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            }
@@ -0,0 +1,99 @@
+"""
+Tests for the catalog change feed (GET /catalog/changes): completeness from since=0, including items
+written before they had a change_seq, and the resync-required answer for expired cursors.
+
+Run from server/catalog-service: python -m pytest tests
+"""
+import os
+import sys
+import datetime
+import tempfile
+
+_tmpdir = tempfile.mkdtemp(prefix='catalog_service_tests_')
+os.environ.update({
+    'CATALOG_DATABASE_URI': 'sqlite:///' + os.path.join(_tmpdir, 'books.db'),
+    'MEDIA_SWEEP_INTERVAL': '0',
+    'CATALOG_TOMBSTONE_PURGE_INTERVAL': '0',
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import MetaData
+from app import app, _backfill_change_sequence, purge_expired_tombstones
+from database import db
+from models import Catalog, CatalogTombstone
+
+
+@pytest.fixture
+def client():
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    yield app.test_client()
+
+
+def make_item(i):
+    return Catalog(f'Title {i}', 'Author', f'{9780000000000 + i}', 9.99)
+
+
+def feed(client, since=0):
+    response = client.get(f'/catalog/changes?since={since}&limit=1000')
+    return response.status_code, response.get_json()
+
+
+def test_items_without_change_seq_are_backfilled_into_the_feed(client):
+    with app.app_context():
+        # catalog_item as it was before change_seq was NOT NULL, holding a row that was never numbered
+        db.session.execute(db.text('DROP TABLE catalog_item'))
+        db.session.commit()
+        legacy = Catalog.__table__.to_metadata(MetaData())
+        legacy.c.change_seq.nullable = True
+        legacy.create(db.engine)
+        now = datetime.datetime.now()
+        db.session.execute(db.insert(legacy), [{'title': 'Legacy', 'author': 'Author', 'isbn': '9781111111111',
+                                                'price': 5.0, 'stock_quantity': 1, 'created_at': now,
+                                                'updated_at': now, 'change_seq': None}])
+        db.session.add(make_item(1))
+        db.session.commit()
+
+    status, body = feed(client)
+    assert status == 200
+    assert [change['item']['title'] for change in body['changes']] == ['Title 1']
+
+    _backfill_change_sequence()
+
+    status, body = feed(client)
+    assert status == 200
+    assert sorted(change['item']['title'] for change in body['changes']) == ['Legacy', 'Title 1']
+    seqs = [change['seq'] for change in body['changes']]
+    assert len(set(seqs)) == len(seqs)
+    with app.app_context():
+        legacy_item = Catalog.query.filter_by(title='Legacy').one()
+        assert legacy_item.updated_at == now # Backfill must not touch updated_at (ETags)
+
+
+def test_expired_cursor_requires_resync(client):
+    with app.app_context():
+        items = [make_item(i) for i in range(4)]
+        db.session.add_all(items)
+        db.session.commit()
+        for item in items[:2]:
+            db.session.delete(item)
+        db.session.commit()
+        old = datetime.datetime.now() - datetime.timedelta(seconds=app.config['CATALOG_TOMBSTONE_RETENTION_SECONDS'] + 60)
+        first = CatalogTombstone.query.order_by(CatalogTombstone.change_seq).first()
+        first.deleted_at = old
+        db.session.commit()
+        purged_seq = first.change_seq
+        assert purge_expired_tombstones() == 1
+
+    status, body = feed(client, since=purged_seq - 1)
+    assert status == 410
+    assert body['resync_required'] is True and body['oldest_cursor'] == purged_seq
+
+    status, body = feed(client, since=purged_seq)
+    assert status == 200
+
+    status, body = feed(client)
+    assert status == 200
+    assert sorted(change['item']['id'] for change in body['changes'] if change['type'] == 'upsert') == [3, 4]
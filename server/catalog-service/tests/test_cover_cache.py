@@ -0,0 +1,42 @@
+"""
+Tests for the cover derivative cache shared by several worker processes, each with its own LRU
+index over the same folder (simulated here with two CoverDerivativeCache instances).
+
+Run from server/catalog-service: python -m pytest tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from PIL import Image
+from cover_cache import CoverDerivativeCache
+
+
+@pytest.fixture
+def folders(tmp_path):
+    source, cache = tmp_path / 'covers', tmp_path / 'cache'
+    source.mkdir()
+    Image.new('RGB', (400, 600), 'red').save(source / 'cover.jpg')
+    return str(source), str(cache)
+
+
+def test_file_evicted_by_another_worker_is_regenerated(folders):
+    worker = CoverDerivativeCache(*folders, max_bytes=10 ** 9)
+    directory, name = worker.get('cover.jpg', 'thumb')
+    os.remove(os.path.join(directory, name)) # Another worker evicts it; this index still lists it
+
+    directory, name = worker.get('cover.jpg', 'thumb')
+    assert os.path.isfile(os.path.join(directory, name))
+
+
+def test_derivatives_are_shared_and_invalidated_across_workers(folders):
+    first, second, third = (CoverDerivativeCache(*folders, max_bytes=10 ** 9) for _ in range(3))
+    directory, name = first.get('cover.jpg', 'card', webp=True)
+
+    assert second.get('cover.jpg', 'card', webp=True) == (directory, name)
+    assert second._total_bytes == os.path.getsize(os.path.join(directory, name)) # Adopted, not regenerated
+
+    third.invalidate('cover.jpg') # Never served it, so it is not in its index
+    assert not os.path.exists(os.path.join(directory, name))
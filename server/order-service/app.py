@@ -1,9 +1,24 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, g, has_request_context
 from flask_cors import CORS
-from models import Order, OrderItem 
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from models import Order, OrderItem, ArchivedOrder, DailyOrderRollup, DailyBookRollup, ORDER_SUMMARY_COLUMNS
 from database import db, init_db
 from config import Config
 import datetime
+import base64
+import binascii
+from row_encoder import compile_row_encoder, dumps
+from catalog_client import CatalogClient, CatalogUnavailable
+from idempotency import idempotent
+import rollups
+import archive
+import shards
+import outbox
+import documents
+import click
+from models import allocate_id_sequence, SHARDED_TABLES
 
 
 app = Flask(__name__)
@@ -12,6 +27,66 @@ init_db(app)
 
 CORS(app, resources={r"/*": {"origins": Config.CORS_ORIGINS}})
 
+# Instrumentation: report how many SQL statements each request issued (off by default)
+if Config.SQL_QUERY_COUNT_HEADER:
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def _count_sql_query(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            g.sql_query_count = g.get('sql_query_count', 0) + 1
+
+    @app.after_request
+    def _add_sql_query_count(response):
+        response.headers['X-SQL-Query-Count'] = str(g.get('sql_query_count', 0))
+        return response
+
+def _check_legacy_id_routing():
+    """
+    Refuses to start with several shards while shard 0 still holds orders created before sharding
+    whose plain ids would be routed to another shard (and so answer 404): ORDER_LEGACY_MAX_ID must
+    cover them first. A database whose tables do not exist yet has no such orders.
+    """
+    shard_count = app.config['ORDER_SHARD_COUNT']
+    if shard_count <= 1:
+        return
+    with app.app_context():
+        try:
+            misrouted = shards.misrouted_legacy_id(db.session, Order, shard_count, app.config['ORDER_LEGACY_MAX_ID'])
+        except OperationalError:
+            misrouted = None
+        db.session.rollback()
+    if misrouted is not None:
+        raise RuntimeError(f"Order {misrouted} was created before sharding and would be routed to shard "
+                           f"{misrouted % shards.SHARD_SLOTS}: set ORDER_LEGACY_MAX_ID to the highest order/order item "
+                           f"id created before sharding (at least {misrouted}) before enabling {shard_count} shards")
+
+
+_check_legacy_id_routing()
+
+# Server-side prices and stock come from the catalog service, cached briefly per book
+catalog_client = CatalogClient(Config.CATALOG_SERVICE_URL, Config.CATALOG_PRICE_CACHE_TTL, Config.CATALOG_REQUEST_TIMEOUT,
+                               Config.CATALOG_PRICE_CACHE_MAX_ENTRIES)
+
+# Order events are written to an outbox with each order change and delivered in the background
+if Config.OUTBOX_DELIVERY == 'http':
+    event_sink = outbox.HttpEventSink(f"{Config.PAYMENT_SERVICE_URL}/payments/events")
+else:
+    event_sink = outbox.LocalQueueSink(Config.OUTBOX_LOCAL_QUEUE_SIZE)
+outbox_dispatcher = outbox.OutboxDispatcher(event_sink, Config.ORDER_SHARD_COUNT, Config.OUTBOX_BATCH_SIZE,
+                                            Config.OUTBOX_RETRY_BASE_SECONDS, Config.OUTBOX_RETRY_MAX_SECONDS,
+                                            retention_seconds=Config.OUTBOX_RETENTION_SECONDS)
+if Config.OUTBOX_DISPATCH_INTERVAL > 0:
+    outbox_dispatcher.start(app, Config.OUTBOX_DISPATCH_INTERVAL)
+
+ALLOWED_STATUSES = ['pending', 'processing', 'shipped', 'cancelled', 'delivered']
+
+ORDER_PAGE_DEFAULT_LIMIT = 50
+ORDER_PAGE_MAX_LIMIT = 500
+
+BULK_STATUS_MAX_UPDATES = 10000
+SQL_IN_CHUNK_SIZE = 500 # Ids per IN (...) list, well below SQLite's bound-parameter limit
+
+encode_order_summary_row = compile_row_encoder(ORDER_SUMMARY_COLUMNS)
+
 
 @app.route('/')
 def home():
@@ -20,6 +95,7 @@ def home():
 
 #-- Basic CRUD API --#
 @app.route('/orders', methods=['POST'])
+@idempotent # NEW: retries with the same Idempotency-Key header replay the first response
 def create_order():
     data = request.get_json()
     if not data:
@@ -35,68 +111,189 @@ def create_order():
     if not isinstance(items_data, list) or not items_data:
         return jsonify({"error": "Items must be a non-empty list"}), 400
 
+    # Validate every item before touching the database or the catalog service
+    requested_items = []
+    for item_data in items_data:
+        if not isinstance(item_data, dict) or not item_data.get('book_id') or not item_data.get('quantity'):
+            return jsonify({"error": "Each item must have book_id and quantity"}), 400
+        try:
+            book_id = int(item_data['book_id'])
+            quantity = int(item_data['quantity'])
+        except (ValueError, TypeError):
+            return jsonify({"error": "Invalid type for book_id or quantity in items"}), 400
+        if quantity <= 0:
+            return jsonify({"error": "Quantity must be positive for items"}), 400
+        requested_items.append((book_id, quantity))
+
+    # Prices are never taken from the client: resolve every book in one batch call
+    try:
+        catalog_items = catalog_client.get_items(book_id for book_id, _ in requested_items)
+    except CatalogUnavailable as e:
+        app.logger.error(f"Catalog lookup failed while creating order: {e}")
+        return jsonify({"error": "Catalog service is currently unavailable. Please try again later."}), 503
+
+    quantities_by_book = {}
+    for book_id, quantity in requested_items:
+        quantities_by_book[book_id] = quantities_by_book.get(book_id, 0) + quantity
+    unknown = sorted(book_id for book_id in quantities_by_book if book_id not in catalog_items)
+    if unknown:
+        return jsonify({"error": f"Unknown book_id(s): {', '.join(map(str, unknown))}"}), 400
+    out_of_stock = sorted(book_id for book_id, quantity in quantities_by_book.items()
+                          if quantity > catalog_items[book_id]['stock_quantity'])
+    if out_of_stock:
+        return jsonify({"error": f"Insufficient stock for book_id(s): {', '.join(map(str, out_of_stock))}"}), 409
+
+    item_rows = [{
+        'book_id': str(book_id),
+        'quantity': quantity,
+        'price_at_purchase': catalog_items[book_id]['price']
+    } for book_id, quantity in requested_items]
+
     new_order = Order(user_id=user_id, shipping_address=shipping_address)
+    new_order.total_amount = sum(row['quantity'] * row['price_at_purchase'] for row in item_rows)
     
-    # Use a transaction to ensure atomicity for order creation and its items
-    try:
-        db.session.add(new_order)
-        db.session.flush() # Flush to get the order.id before committing
+    # The order and its items are written to the customer's shard, with ids that encode that shard
+    shard = shards.shard_for_user(user_id, app.config['ORDER_SHARD_COUNT'])
+    with shards.use_shard(shard):
+        # Use a transaction to ensure atomicity for order creation and its items
+        try:
+            first_sequence = allocate_id_sequence(db.session, 1 + len(item_rows), app.config['ORDER_LEGACY_MAX_ID'])
+            new_order.id = shards.encode_id(first_sequence, shard)
+            db.session.add(new_order)
+            db.session.flush()
 
-        total_amount = 0.0
-        for item_data in items_data:
-            book_id = item_data.get('book_id')
-            quantity = item_data.get('quantity')
-            price_at_purchase = item_data.get('price_at_purchase')
+            # All items go in as one executemany INSERT
+            now = datetime.datetime.now()
+            for offset, row in enumerate(item_rows, start=1):
+                row.update(id=shards.encode_id(first_sequence + offset, shard), order_id=new_order.id,
+                           created_at=now, updated_at=now)
+            db.session.execute(db.insert(OrderItem), item_rows)
+            rollups.record_order_created(new_order, item_rows) # NEW: same transaction as the order
+            order_document = new_order.to_dict()
+            outbox.record_events([('order.created', new_order.id, order_document)])
+            documents.put({new_order.id: order_document}) # NEW: pre-rendered document for reads
 
-            if not book_id or not quantity or price_at_purchase is None:
-                db.session.rollback()
-                return jsonify({"error": "Each item must have book_id, quantity, and price_at_purchase"}), 400
-            
-            try:
-                quantity = int(quantity)
-                price_at_purchase = float(price_at_purchase)
-                if quantity <= 0 or price_at_purchase <= 0:
-                    db.session.rollback()
-                    return jsonify({"error": "Quantity and price_at_purchase must be positive for items"}), 400
-            except (ValueError, TypeError):
-                db.session.rollback()
-                return jsonify({"error": "Invalid type for quantity or price_at_purchase in items"}), 400
-
-            new_order_item = OrderItem(
-                order_id=new_order.id, # Link to the newly created order
-                book_id=book_id,
-                quantity=quantity,
-                price_at_purchase=price_at_purchase
-            )
-            db.session.add(new_order_item)
-            total_amount += (quantity * price_at_purchase)
-        
-        new_order.total_amount = total_amount # Set calculated total amount
-        db.session.commit()
-        return jsonify(new_order.to_dict()), 201
-    except Exception as e:
-        db.session.rollback()
-        app.logger.error(f"Error creating order: {e}")
-        return jsonify({"error": "Failed to create order", "details": str(e)}), 500
+            db.session.commit()
+            return jsonify(order_document), 201
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Error creating order: {e}")
+            return jsonify({"error": "Failed to create order", "details": str(e)}), 500
     
 
 
+def _encode_cursor(order_date, order_id):
+    return base64.urlsafe_b64encode(f"{order_date.isoformat()}|{order_id}".encode()).decode()
+
+
+def _decode_cursor(cursor):
+    """Returns (order_date, id) from a cursor produced by _encode_cursor. Raises ValueError."""
+    try:
+        order_date, order_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.datetime.fromisoformat(order_date), int(order_id)
+    except (UnicodeError, TypeError, binascii.Error) as e:
+        raise ValueError(str(e))
+
+
 @app.route('/orders', methods=['GET'])
 def get_all_orders():
-    # In a real app, you might want pagination and user-specific orders
-    orders = Order.query.all()
-    return jsonify([order.to_dict() for order in orders]), 200 
+    """
+    Lists orders, newest first, one page at a time.
+    Query parameters (all optional):
+      user_id - only this customer's orders
+      status  - only orders in this status
+      before  - cursor from the previous page's X-Next-Cursor header
+      limit   - page size (default ORDER_PAGE_DEFAULT_LIMIT, max ORDER_PAGE_MAX_LIMIT)
+      view    - 'full' (default, with nested items) or 'summary' (order columns only)
+    Pages are keyset-paginated on (order_date, id), which the (user_id, order_date, id) and
+    (user_id, status, order_date, id) indexes serve directly. When more orders follow, the
+    X-Next-Cursor header holds the value to pass as `before`.
+    With user_id the page is read from that customer's shard only; without it (admin listing) every
+    shard returns its own first page and the pages are merged (scatter-gather).
+    """
+    user_id = request.args.get('user_id')
+    status = request.args.get('status')
+    view = request.args.get('view', 'full')
+    if status is not None and status not in ALLOWED_STATUSES:
+        return jsonify({"error": f"Invalid status. Allowed statuses are: {', '.join(ALLOWED_STATUSES)}"}), 400
+    if view not in ('full', 'summary'):
+        return jsonify({"error": "Invalid view. Allowed views are: full, summary"}), 400
+    try:
+        limit = min(int(request.args.get('limit', ORDER_PAGE_DEFAULT_LIMIT)), ORDER_PAGE_MAX_LIMIT)
+        before = _decode_cursor(request.args['before']) if request.args.get('before') else None
+    except ValueError:
+        return jsonify({"error": "Invalid limit or before cursor"}), 400
+    if limit <= 0:
+        return jsonify({"error": "limit must be positive"}), 400
+
+    # The full view only needs the keys here: its bodies come from the stored order documents
+    columns = ORDER_SUMMARY_COLUMNS if view == 'summary' else (Order.order_date, Order.id)
+    query = db.select(*columns)
+    if user_id is not None:
+        query = query.where(Order.user_id == user_id)
+    if status is not None:
+        query = query.where(Order.status == status)
+    if before is not None:
+        query = query.where(db.tuple_(Order.order_date, Order.id) < before)
+    # One extra row tells us whether there is a next page
+    query = query.order_by(Order.order_date.desc(), Order.id.desc()).limit(limit + 1)
+    shard_count = app.config['ORDER_SHARD_COUNT']
+    rows = []
+    for shard in ([shards.shard_for_user(user_id, shard_count)] if user_id is not None else range(shard_count)):
+        with shards.use_shard(shard):
+            rows.extend(db.session.execute(query).all())
+    if user_id is None and shard_count > 1:
+        rows.sort(key=lambda row: (row.order_date, row.id), reverse=True)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if view == 'summary':
+        # Lean path: plain column tuples, without building ORM objects
+        body = dumps([encode_order_summary_row(row) for row in rows])
+    else:
+        # Stored documents for the whole page, one IN query per shard, joined as raw JSON text
+        stored = {}
+        order_ids_by_shard = {}
+        for row in rows:
+            shard = shards.shard_for_id(row.id, shard_count, app.config['ORDER_LEGACY_MAX_ID'])
+            order_ids_by_shard.setdefault(shard, []).append(row.id)
+        for shard, order_ids in order_ids_by_shard.items():
+            with shards.use_shard(shard):
+                stored.update(documents.load(order_ids))
+                missing = [order_id for order_id in order_ids if order_id not in stored]
+                if missing: # Orders without a document yet are rendered from their rows
+                    stored.update((order_id, dumps(document).decode('utf-8'))
+                                  for order_id, document in documents.render(missing).items())
+        body = '[' + ','.join(stored[row.id] for row in rows if row.id in stored) + ']'
+
+    response = Response(body, status=200, mimetype='application/json')
+    if has_more:
+        response.headers['X-Next-Cursor'] = _encode_cursor(rows[-1].order_date, rows[-1].id)
+    return response
 
 
 @app.route('/orders/<int:order_id>', methods=['GET'])
+@shards.on_order_shard
 def get_order(order_id):
-    order = Order.query.get(order_id)
+    # The stored document is served as is: one single-row fetch, no ORM objects or items query
+    stored = documents.load([order_id]).get(order_id)
+    if stored is not None:
+        return Response(stored, status=200, mimetype='application/json')
+
+    order = Order.query.get(order_id) # Orders without a document yet (see `flask check-order-documents`)
     if not order:
-        return jsonify({"error": "Order not found"}), 404
+        # NEW: old finished orders may have been moved to the archive database
+        archived_order = db.session.get(ArchivedOrder, order_id)
+        if not archived_order:
+            return jsonify({"error": "Order not found"}), 404
+        response = jsonify(archived_order.to_dict())
+        response.headers['X-Order-Archived'] = 'true'
+        return response, 200
     return jsonify(order.to_dict()), 200
 
 
 @app.route('/orders/<int:order_id>/status', methods=['PUT'])
+@shards.on_order_shard
 def update_order_status(order_id):
     order = Order.query.get(order_id)
     if not order:
@@ -108,13 +305,19 @@ def update_order_status(order_id):
         return jsonify({"error": "Status field is required"}), 400
     
     # Optional: Validate status against a predefined list
-    allowed_statuses = ['pending', 'processing', 'shipped', 'cancelled', 'delivered']
-    if new_status not in allowed_statuses:
-        return jsonify({"error": f"Invalid status. Allowed statuses are: {', '.join(allowed_statuses)}"}), 400
+    if new_status not in ALLOWED_STATUSES:
+        return jsonify({"error": f"Invalid status. Allowed statuses are: {', '.join(ALLOWED_STATUSES)}"}), 400
 
     try:
+        if new_status != order.status:
+            rollups.record_status_changes([(order.id, order.order_date, order.total_amount, order.status, new_status)])
+            outbox.record_events([('order.status_changed', order.id, {
+                'order_id': order.id, 'user_id': order.user_id, 'total_amount': order.total_amount,
+                'previous_status': order.status, 'status': new_status
+            })])
         order.status = new_status
         order.updated_at = datetime.datetime.now() # Manually update timestamp for status change
+        documents.refresh([order.id])
         db.session.commit()
         return jsonify(order.to_dict()), 200
     except Exception as e:
@@ -124,7 +327,133 @@ def update_order_status(order_id):
     
 
 
+def _chunks(values, size=SQL_IN_CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _apply_status_updates(order_ids, requested, results):
+    """
+    Applies requested[order_id] to order_ids (all on the current shard) and fills in their results.
+    Runs in the caller's transaction.
+    """
+    current = {} # order id -> (status, order_date, total_amount, user_id)
+    for chunk in _chunks(order_ids):
+        for order_id, status, order_date, total_amount, user_id in db.session.execute(
+                db.select(Order.id, Order.status, Order.order_date, Order.total_amount, Order.user_id)
+                .where(Order.id.in_(chunk))):
+            current[order_id] = (status, order_date, total_amount, user_id)
+
+    transitions = {} # (previous status, new status) -> order ids
+    for order_id in order_ids:
+        previous = current.get(order_id, (None,))[0]
+        if previous is None:
+            results[order_id] = {'order_id': order_id, 'status': 'not_found'}
+        elif previous == requested[order_id]:
+            results[order_id] = {'order_id': order_id, 'status': 'unchanged', 'order_status': previous}
+        else:
+            transitions.setdefault((previous, requested[order_id]), []).append(order_id)
+
+    now = datetime.datetime.now()
+    rollup_changes = []
+    for (previous, new_status), ids in transitions.items():
+        for chunk in _chunks(ids):
+            # Guarding on the previous status keeps the per-order results exact under concurrent updates
+            result = db.session.execute(db.update(Order)
+                                        .where(Order.id.in_(chunk), Order.status == previous)
+                                        .values(status=new_status, updated_at=now)
+                                        .execution_options(synchronize_session=False))
+            changed = set(chunk)
+            if result.rowcount != len(chunk):
+                changed = set(db.session.scalars(db.select(Order.id).where(
+                    Order.id.in_(chunk), Order.status == new_status, Order.updated_at == now)))
+            for order_id in chunk:
+                if order_id in changed:
+                    _, order_date, total_amount, _ = current[order_id]
+                    rollup_changes.append((order_id, order_date, total_amount, previous, new_status))
+                    results[order_id] = {'order_id': order_id, 'status': 'updated',
+                                         'previous_status': previous, 'order_status': new_status}
+                else:
+                    results[order_id] = {'order_id': order_id, 'status': 'conflict'}
+    rollups.record_status_changes(rollup_changes)
+    outbox.record_events([('order.status_changed', order_id, {
+        'order_id': order_id, 'user_id': current[order_id][3], 'total_amount': total_amount,
+        'previous_status': previous, 'status': new_status
+    }) for order_id, _, total_amount, previous, new_status in rollup_changes])
+    documents.refresh([change[0] for change in rollup_changes])
+
+
+@app.route('/orders/status', methods=['PUT'])
+def bulk_update_order_status():
+    """
+    Applies many status changes in one request and one transaction per shard, e.g. marking a warehouse wave as shipped.
+    Body: {"updates": [{"order_id": 1, "status": "shipped"}, ...]}
+      or: {"order_ids": [1, 2, 3], "status": "shipped"}
+    Orders are changed with set-based UPDATEs (one per previous/new status pair and chunk of ids),
+    and every changed row gets updated_at stamped.
+    Each order gets a result: 'updated', 'unchanged', 'not_found', 'invalid_status', 'conflict'
+    (its status was changed by someone else between the read and the update), or 'error' (its
+    shard's transaction failed while other shards committed).
+    """
+    data = request.get_json()
+    if not data or not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+
+    if 'updates' in data:
+        updates = data['updates']
+    else:
+        order_ids = data.get('order_ids')
+        if not isinstance(order_ids, list):
+            return jsonify({"error": "Provide 'updates' or 'order_ids' with 'status'"}), 400
+        updates = [{'order_id': order_id, 'status': data.get('status')} for order_id in order_ids]
+    if not isinstance(updates, list) or not updates:
+        return jsonify({"error": "'updates' must be a non-empty list"}), 400
+    if len(updates) > BULK_STATUS_MAX_UPDATES:
+        return jsonify({"error": f"At most {BULK_STATUS_MAX_UPDATES} orders can be updated per request"}), 400
+
+    requested = {} # order id -> new status, in request order
+    for update in updates:
+        try:
+            order_id = int(update['order_id'])
+        except (TypeError, KeyError, ValueError):
+            return jsonify({"error": "Each update must have an integer 'order_id'"}), 400
+        if order_id in requested:
+            return jsonify({"error": f"Order {order_id} appears more than once"}), 400
+        requested[order_id] = update.get('status')
+
+    results = {order_id: {'order_id': order_id, 'status': 'invalid_status'}
+               for order_id, new_status in requested.items() if new_status not in ALLOWED_STATUSES}
+    valid_ids = [order_id for order_id in requested if order_id not in results]
+
+    # Each shard is updated in its own transaction
+    shard_count = app.config['ORDER_SHARD_COUNT']
+    ids_by_shard = {}
+    for order_id in valid_ids:
+        shard = shards.shard_for_id(order_id, shard_count, app.config['ORDER_LEGACY_MAX_ID'])
+        ids_by_shard.setdefault(shard, []).append(order_id)
+    for shard, shard_ids in ids_by_shard.items():
+        with shards.use_shard(shard):
+            try:
+                _apply_status_updates(shard_ids, requested, results)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(f"Error bulk updating order statuses on shard {shard}: {e}")
+                if shard_count == 1:
+                    return jsonify({"error": "Failed to update order statuses", "details": str(e)}), 500
+                for order_id in shard_ids:
+                    results[order_id] = {'order_id': order_id, 'status': 'error'}
+
+    ordered_results = [results[order_id] for order_id in requested]
+    return jsonify({
+        "updated": sum(1 for result in ordered_results if result['status'] == 'updated'),
+        "results": ordered_results
+    }), 200
+
+
+
 @app.route('/orders/<int:order_id>', methods=['DELETE'])
+@shards.on_order_shard
 def delete_order(order_id):
     order = Order.query.get(order_id)
     if not order:
@@ -133,6 +462,8 @@ def delete_order(order_id):
     try:
         # Due to cascade="all, delete-orphan" in Order model relationship,
         # deleting the Order will automatically delete its associated OrderItems.
+        rollups.record_order_deleted(order)
+        documents.delete([order_id])
         db.session.delete(order)
         db.session.commit()
         return jsonify({"message": f"Order {order_id} and its items deleted successfully"}), 200
@@ -143,7 +474,166 @@ def delete_order(order_id):
     
 
 
+@app.cli.command('check-order-documents')
+@click.option('--repair', is_flag=True, help='Rewrite missing or stale documents and delete orphaned ones.')
+def check_order_documents_command(repair):
+    """Compares the stored order documents with the order rows, on every shard."""
+    for shard in range(app.config['ORDER_SHARD_COUNT']):
+        with shards.use_shard(shard):
+            counts = documents.check(repair=repair)
+        print(f"Shard {shard}: checked {counts['checked']} order(s), {counts['missing']} missing, "
+              f"{counts['stale']} stale, {counts['orphaned']} orphaned document(s)" + (" (repaired)" if repair else ""))
+
+
+@app.route('/orders/outbox/stats', methods=['GET'])
+def get_outbox_stats():
+    """Undelivered order events per shard, and where they are delivered to."""
+    return jsonify({'sink': event_sink.stats(), 'shards': outbox_dispatcher.pending_stats()}), 200
+
+
+@app.cli.command('dispatch-outbox')
+def dispatch_outbox_command():
+    """Delivers pending order events now, batch by batch, until none are due."""
+    total = 0
+    while True:
+        delivered = outbox_dispatcher.dispatch_once(log=print)
+        total += delivered
+        if delivered == 0:
+            break
+    print(f"Delivered {total} order event(s)")
+
+
+#-- Analytics (pre-aggregated daily rollups, see rollups.py) --#
+ANALYTICS_DEFAULT_DAYS = 30
+ANALYTICS_TOP_BOOKS_DEFAULT = 20
+
+
+def _read_all_shards(query):
+    """Runs a read-only query on every shard and returns all rows (scatter-gather)."""
+    rows = []
+    for shard in range(app.config['ORDER_SHARD_COUNT']):
+        with shards.use_shard(shard):
+            rows.extend(db.session.execute(query).all())
+    return rows
+
+
+def _parse_day_range():
+    """Reads ?from=YYYY-MM-DD&to=YYYY-MM-DD (inclusive), defaulting to the last ANALYTICS_DEFAULT_DAYS days."""
+    today = datetime.date.today()
+    start = request.args.get('from')
+    end = request.args.get('to')
+    end = datetime.date.fromisoformat(end) if end else today
+    start = datetime.date.fromisoformat(start) if start else end - datetime.timedelta(days=ANALYTICS_DEFAULT_DAYS - 1)
+    if start > end:
+        raise ValueError("'from' must not be after 'to'")
+    return start, end
+
+
+@app.route('/orders/analytics/daily', methods=['GET'])
+def get_daily_sales():
+    """
+    Orders and revenue per day in a date range, read from the daily rollup rows.
+    revenue and order_count exclude cancelled orders; by_status has the full breakdown.
+    """
+    try:
+        start, end = _parse_day_range()
+    except ValueError as e:
+        return jsonify({"error": f"Invalid date range: {e}"}), 400
+
+    rows = _read_all_shards(
+        db.select(DailyOrderRollup.day, DailyOrderRollup.status, DailyOrderRollup.order_count, DailyOrderRollup.revenue)
+        .where(DailyOrderRollup.day.between(start, end), DailyOrderRollup.order_count != 0)
+    )
+    days = {}
+    for day, status, order_count, revenue in sorted(rows):
+        entry = days.setdefault(day, {'day': day.isoformat(), 'order_count': 0, 'revenue': 0.0, 'by_status': {}})
+        by_status = entry['by_status'].setdefault(status, {'order_count': 0, 'revenue': 0.0})
+        by_status['order_count'] += order_count
+        by_status['revenue'] = round(by_status['revenue'] + revenue, 2)
+        if status not in rollups.NON_REVENUE_STATUSES:
+            entry['order_count'] += order_count
+            entry['revenue'] = round(entry['revenue'] + revenue, 2)
+    return jsonify({'from': start.isoformat(), 'to': end.isoformat(), 'days': list(days.values())}), 200
+
+
+@app.route('/orders/analytics/books', methods=['GET'])
+def get_book_sales():
+    """
+    Units sold and revenue per book over a date range (cancelled orders excluded).
+    Without book_id: the top books by units (?limit=, default 20). With ?book_id=: that book's daily series.
+    """
+    try:
+        start, end = _parse_day_range()
+        limit = int(request.args.get('limit', ANALYTICS_TOP_BOOKS_DEFAULT))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+    if limit <= 0:
+        return jsonify({"error": "limit must be positive"}), 400
+
+    in_range = DailyBookRollup.day.between(start, end)
+    book_id = request.args.get('book_id')
+    if book_id:
+        totals = {}
+        for day, units, revenue in _read_all_shards(
+                db.select(DailyBookRollup.day, DailyBookRollup.units, DailyBookRollup.revenue)
+                .where(in_range, DailyBookRollup.book_id == book_id, DailyBookRollup.units != 0)):
+            day_total = totals.setdefault(day, [0, 0.0])
+            day_total[0] += units
+            day_total[1] += revenue
+        days = [{'day': day.isoformat(), 'units': units, 'revenue': round(revenue, 2)}
+                for day, (units, revenue) in sorted(totals.items())]
+        return jsonify({'from': start.isoformat(), 'to': end.isoformat(), 'book_id': book_id, 'days': days}), 200
+
+    # Each shard sums its own rows; the top books can only be picked once the shard totals are added up
+    units = db.func.sum(DailyBookRollup.units)
+    query = (db.select(DailyBookRollup.book_id, units, db.func.sum(DailyBookRollup.revenue))
+             .where(in_range)
+             .group_by(DailyBookRollup.book_id))
+    if app.config['ORDER_SHARD_COUNT'] == 1:
+        query = query.having(units > 0).order_by(units.desc(), DailyBookRollup.book_id).limit(limit)
+    totals = {}
+    for book_id, book_units, revenue in _read_all_shards(query):
+        book_total = totals.setdefault(book_id, [0, 0.0])
+        book_total[0] += book_units
+        book_total[1] += revenue
+    top = sorted(((book_id, total) for book_id, total in totals.items() if total[0] > 0),
+                 key=lambda entry: (-entry[1][0], entry[0]))[:limit]
+    books = [{'book_id': book_id, 'units': book_units, 'revenue': round(revenue, 2)}
+             for book_id, (book_units, revenue) in top]
+    return jsonify({'from': start.isoformat(), 'to': end.isoformat(), 'books': books}), 200
+
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recomputes the daily sales rollup tables from orders and order_items, on every shard."""
+    for shard in range(app.config['ORDER_SHARD_COUNT']):
+        with shards.use_shard(shard):
+            counts = rollups.rebuild(shard, app.config['ORDER_SHARD_COUNT'], app.config['ORDER_LEGACY_MAX_ID'])
+        print(f"Rebuilt rollups on shard {shard}: {counts['daily_order_rollups']} order row(s), "
+              f"{counts['daily_book_rollups']} book row(s)")
+
+
+@app.cli.command('archive-orders')
+@click.option('--days', type=int, default=None, help='Archive orders older than this many days (default: ORDER_ARCHIVE_AFTER_DAYS).')
+@click.option('--vacuum', is_flag=True, help='Reclaim the freed space in the hot SQLite file afterwards.')
+def archive_orders_command(days, vacuum):
+    """Moves old delivered/cancelled orders to the archive database in chunked transactions."""
+    days = days if days is not None else app.config['ORDER_ARCHIVE_AFTER_DAYS']
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=days)
+    for shard in range(app.config['ORDER_SHARD_COUNT']):
+        with shards.use_shard(shard):
+            moved = archive.archive_orders(cutoff, app.config['ORDER_ARCHIVE_STATUSES'],
+                                           app.config['ORDER_ARCHIVE_CHUNK_SIZE'], log=print)
+        print(f"Archived {moved} order(s) placed before {cutoff.isoformat()} from shard {shard}")
+        engine = db.engines[shards.shard_bind_key(shard)]
+        if vacuum and engine.dialect.name == 'sqlite':
+            with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                conn.exec_driver_sql('VACUUM')
+            print(f"Vacuumed shard {shard}")
+
+
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        shards.create_shard_tables(db, SHARDED_TABLES, app.config['ORDER_SHARD_COUNT'])
     app.run(port=5004, debug=True)
\ No newline at end of file
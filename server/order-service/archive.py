@@ -0,0 +1,47 @@
+import datetime
+from database import db
+from models import Order, OrderItem, OrderDocument, ArchivedOrder, ArchivedOrderItem, ORDER_COLUMNS, ORDER_ITEM_COLUMNS
+
+
+def archive_orders(cutoff, statuses, chunk_size=500, log=None):
+    """
+    Moves orders placed before `cutoff` whose status is in `statuses`, with their items, from the hot
+    database to the archive bind, chunk_size orders at a time.
+    Each chunk is first written to the archive and committed, then deleted from the hot database and
+    committed, so an order is never missing from both. If a run stops between the two commits, the
+    next run rewrites the same archive rows (they are replaced by id) and finishes the delete.
+    Returns the number of orders moved.
+    """
+    moved = 0
+    while True:
+        ids = db.session.scalars(
+            db.select(Order.id)
+            .where(Order.status.in_(statuses), Order.order_date < cutoff)
+            .order_by(Order.id)
+            .limit(chunk_size)
+        ).all()
+        if not ids:
+            break
+
+        now = datetime.datetime.now()
+        orders = [dict(row._mapping, archived_at=now)
+                  for row in db.session.execute(db.select(*ORDER_COLUMNS).where(Order.id.in_(ids)))]
+        items = [dict(row._mapping)
+                 for row in db.session.execute(db.select(*ORDER_ITEM_COLUMNS).where(OrderItem.order_id.in_(ids)))]
+
+        db.session.execute(db.delete(ArchivedOrderItem).where(ArchivedOrderItem.order_id.in_(ids)))
+        db.session.execute(db.delete(ArchivedOrder).where(ArchivedOrder.id.in_(ids)))
+        db.session.execute(db.insert(ArchivedOrder), orders)
+        if items:
+            db.session.execute(db.insert(ArchivedOrderItem), items)
+        db.session.commit()
+
+        db.session.execute(db.delete(OrderItem).where(OrderItem.order_id.in_(ids)))
+        db.session.execute(db.delete(OrderDocument).where(OrderDocument.order_id.in_(ids)))
+        db.session.execute(db.delete(Order).where(Order.id.in_(ids)))
+        db.session.commit()
+
+        moved += len(ids)
+        if log:
+            log(f"Archived {moved} order(s) so far")
+    return moved
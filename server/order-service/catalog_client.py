@@ -0,0 +1,66 @@
+import time
+import threading
+import requests
+from collections import OrderedDict
+
+
+class CatalogUnavailable(Exception):
+    """Raised when the catalog service cannot be reached or answers with an error."""
+
+
+class CatalogClient:
+    """
+    Resolves current prices and stock for catalog items with one batch call to the catalog
+    service (POST /catalog/lookup), keeping results in a short-lived local cache so that a burst
+    of orders for the same books does not call the catalog service every time.
+    The cache holds at most max_entries books, least recently used first out, and expired
+    entries are dropped when they are looked up.
+    """
+
+    def __init__(self, base_url, cache_ttl_seconds=30, timeout_seconds=3, max_entries=10000):
+        self.base_url = base_url
+        self.cache_ttl_seconds = cache_ttl_seconds
+        self.timeout_seconds = timeout_seconds
+        self.max_entries = max_entries
+        self._session = requests.Session() # Reuses the HTTP connection between calls
+        self._lock = threading.Lock()
+        self._cache = OrderedDict() # book id -> (fetched_at, {'price': ..., 'stock_quantity': ...}), oldest use first
+
+    def get_items(self, book_ids):
+        """
+        Returns {book_id: {'price': float, 'stock_quantity': int, ...}} for the given integer ids.
+        Ids the catalog does not know are left out. Raises CatalogUnavailable.
+        """
+        now = time.monotonic()
+        found = {}
+        missing = []
+        with self._lock:
+            for book_id in set(book_ids):
+                cached = self._cache.get(book_id)
+                if cached and now - cached[0] < self.cache_ttl_seconds:
+                    self._cache.move_to_end(book_id)
+                    found[book_id] = cached[1]
+                else:
+                    if cached:
+                        del self._cache[book_id] # Expired
+                    missing.append(book_id)
+
+        if missing:
+            try:
+                resp = self._session.post(f"{self.base_url}/catalog/lookup", json={'ids': missing},
+                                          timeout=self.timeout_seconds)
+                resp.raise_for_status()
+                items = resp.json()['items']
+            except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                raise CatalogUnavailable(str(e))
+
+            fetched_at = time.monotonic()
+            with self._lock:
+                for key, item in items.items():
+                    book_id = int(key)
+                    self._cache[book_id] = (fetched_at, item)
+                    self._cache.move_to_end(book_id)
+                    found[book_id] = item
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+        return found
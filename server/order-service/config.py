@@ -1,8 +1,59 @@
 import os
 
+
+def _order_shard_binds(basedir, shard_count):
+    """Binds for order shards 1..N-1 (shard 0 is the default database)."""
+    return {
+        f'order_shard_{index}': os.environ.get(f'ORDER_SHARD_{index}_DATABASE_URI')
+                                or 'sqlite:///' + os.path.join(basedir, f'orders_shard_{index}.db')
+        for index in range(1, shard_count)
+    }
+
+
 class Config:
     BASEDIR = os.path.abspath(os.path.dirname(__file__))
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(BASEDIR, 'orders.db')
+    SQLALCHEMY_DATABASE_URI = os.environ.get('ORDER_DATABASE_URI') or 'sqlite:///' + os.path.join(BASEDIR, 'orders.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Old delivered/cancelled orders are moved here by `flask archive-orders` (see archive.py)
+    # Orders are spread over ORDER_SHARD_COUNT databases by a hash of user_id (see shards.py)
+    ORDER_SHARD_COUNT = int(os.environ.get('ORDER_SHARD_COUNT') or 1) # At most shards.SHARD_SLOTS
+    # Highest order/order item id (hot and archive tables) created before sharding was enabled. Those ids are
+    # plain auto-increment values on shard 0 and are routed there; new ids on every shard are allocated above
+    # it. Required before raising ORDER_SHARD_COUNT above 1 on an existing database: the service refuses to
+    # start while shard 0 holds pre-sharding ids that would be routed elsewhere.
+    ORDER_LEGACY_MAX_ID = int(os.environ.get('ORDER_LEGACY_MAX_ID') or 0)
+    SQLALCHEMY_BINDS = {
+        'archive': os.environ.get('ORDER_ARCHIVE_DATABASE_URI') or 'sqlite:///' + os.path.join(BASEDIR, 'orders_archive.db'),
+        **_order_shard_binds(BASEDIR, ORDER_SHARD_COUNT)
+    }
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'yetanothersecretkeythatiprobablyshouldnotusehere'
-    CORS_ORIGINS = ["http://localhost:3000"] # Adjust if your frontend runs on a different port/domain
\ No newline at end of file
+    CORS_ORIGINS = ["http://localhost:3000"] # Adjust if your frontend runs on a different port/domain
+
+    # Catalog service, used to resolve prices and stock when an order is created
+    CATALOG_SERVICE_URL = os.environ.get('CATALOG_SERVICE_URL') or 'http://127.0.0.1:5003'
+    CATALOG_PRICE_CACHE_TTL = int(os.environ.get('CATALOG_PRICE_CACHE_TTL') or 30) # seconds
+    CATALOG_PRICE_CACHE_MAX_ENTRIES = int(os.environ.get('CATALOG_PRICE_CACHE_MAX_ENTRIES') or 10000) # books, LRU
+    CATALOG_REQUEST_TIMEOUT = 3 # seconds
+
+    # Adds an X-SQL-Query-Count header to every response, e.g. to check for N+1 query patterns
+    SQL_QUERY_COUNT_HEADER = os.environ.get('SQL_QUERY_COUNT_HEADER', 'false').lower() == 'true'
+
+    # Idempotency-Key handling for POST requests
+    IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL') or 24 * 3600) # seconds a stored response is replayed
+    IDEMPOTENCY_WAIT_TIMEOUT = 10 # seconds a duplicate waits for the first request to finish
+    IDEMPOTENCY_IN_PROGRESS_TIMEOUT = 60 # seconds after which an unfinished request is considered abandoned
+
+    # Archival of finished orders
+    ORDER_ARCHIVE_AFTER_DAYS = int(os.environ.get('ORDER_ARCHIVE_AFTER_DAYS') or 365)
+    ORDER_ARCHIVE_STATUSES = ('delivered', 'cancelled') # Terminal statuses only
+    ORDER_ARCHIVE_CHUNK_SIZE = 500 # Orders moved per transaction
+
+    # Order events (transactional outbox, see outbox.py)
+    OUTBOX_DELIVERY = os.environ.get('OUTBOX_DELIVERY') or 'local' # 'http' (payment service) or 'local' (in-process queue)
+    PAYMENT_SERVICE_URL = os.environ.get('PAYMENT_SERVICE_URL') or 'http://127.0.0.1:5005'
+    OUTBOX_DISPATCH_INTERVAL = float(os.environ.get('OUTBOX_DISPATCH_INTERVAL') or 1.0) # seconds; 0 disables the dispatcher thread
+    OUTBOX_BATCH_SIZE = 100
+    OUTBOX_RETRY_BASE_SECONDS = 2 # Doubled after every failed attempt...
+    OUTBOX_RETRY_MAX_SECONDS = 300 # ...up to this
+    OUTBOX_RETENTION_SECONDS = int(os.environ.get('OUTBOX_RETENTION_SECONDS') or 24 * 3600) # Delivered events are kept this long
+    OUTBOX_LOCAL_QUEUE_SIZE = int(os.environ.get('OUTBOX_LOCAL_QUEUE_SIZE') or 10000) # 'local' delivery keeps the newest events only
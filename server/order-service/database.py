@@ -1,8 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy
 import os
 import sys
+from shards import ShardedSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': ShardedSession}) # Routes order tables to shards (see shards.py)
 
 def init_db(app):
     db.init_app(app)
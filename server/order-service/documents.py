@@ -0,0 +1,108 @@
+import json
+import datetime
+from sqlalchemy.dialects import postgresql, sqlite
+from database import db
+from models import Order, OrderItem, OrderDocument, ORDER_COLUMNS, ORDER_ITEM_COLUMNS
+from row_encoder import compile_row_encoder, dumps
+
+SQL_IN_CHUNK_SIZE = 500
+
+encode_order_row = compile_row_encoder(ORDER_COLUMNS)
+encode_order_item_row = compile_row_encoder(ORDER_ITEM_COLUMNS)
+
+
+def _chunks(values, size=SQL_IN_CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def render(order_ids):
+    """
+    Builds {order_id: document dict} for orders on the current shard from two column queries
+    (orders, then their items), in the same shape as Order.to_dict(). Missing orders are left out.
+    """
+    documents = {}
+    for chunk in _chunks(list(order_ids)):
+        for row in db.session.execute(db.select(*ORDER_COLUMNS).where(Order.id.in_(chunk))):
+            document = encode_order_row(row)
+            document['items'] = []
+            documents[row.id] = document
+        for row in db.session.execute(db.select(*ORDER_ITEM_COLUMNS)
+                                      .where(OrderItem.order_id.in_(chunk))
+                                      .order_by(OrderItem.id)):
+            if row.order_id in documents:
+                documents[row.order_id]['items'].append(encode_order_item_row(row))
+    return documents
+
+
+def put(documents):
+    """Stores {order_id: document dict} on the current shard with one executemany upsert, in the caller's transaction."""
+    if not documents:
+        return
+    now = datetime.datetime.now()
+    insert = postgresql.insert if db.session.get_bind().dialect.name == 'postgresql' else sqlite.insert
+    stmt = insert(OrderDocument.__table__)
+    stmt = stmt.on_conflict_do_update(index_elements=['order_id'],
+                                      set_={'document': stmt.excluded.document, 'updated_at': stmt.excluded.updated_at})
+    db.session.execute(stmt, [{'order_id': order_id, 'document': dumps(document).decode('utf-8'), 'updated_at': now}
+                              for order_id, document in documents.items()])
+
+
+def refresh(order_ids):
+    """Re-renders and stores the documents of the given orders from their current rows (after a status change)."""
+    put(render(order_ids))
+
+
+def delete(order_ids):
+    for chunk in _chunks(list(order_ids)):
+        db.session.execute(db.delete(OrderDocument).where(OrderDocument.order_id.in_(chunk)))
+
+
+def load(order_ids):
+    """Returns {order_id: stored JSON text} for the given orders on the current shard."""
+    stored = {}
+    for chunk in _chunks(list(order_ids)):
+        stored.update(db.session.execute(
+            db.select(OrderDocument.order_id, OrderDocument.document).where(OrderDocument.order_id.in_(chunk))).all())
+    return stored
+
+
+def check(repair=False, chunk_size=SQL_IN_CHUNK_SIZE):
+    """
+    Compares every stored document on the current shard with a fresh rendering of its order.
+    Counts documents that are missing, stale (differ from the rows) or orphaned (no order any more);
+    with repair=True they are rewritten or deleted, one committed chunk at a time.
+    """
+    counts = {'checked': 0, 'missing': 0, 'stale': 0, 'orphaned': 0}
+    last_id = None
+    while True:
+        query = db.select(Order.id).order_by(Order.id).limit(chunk_size)
+        if last_id is not None:
+            query = query.where(Order.id > last_id)
+        order_ids = db.session.scalars(query).all()
+        if not order_ids:
+            break
+        last_id = order_ids[-1]
+        expected = render(order_ids)
+        stored = load(order_ids)
+        wrong = {}
+        for order_id, document in expected.items():
+            if order_id not in stored:
+                counts['missing'] += 1
+                wrong[order_id] = document
+            elif json.loads(stored[order_id]) != document:
+                counts['stale'] += 1
+                wrong[order_id] = document
+        counts['checked'] += len(order_ids)
+        if repair and wrong:
+            put(wrong)
+            db.session.commit()
+
+    orphaned = db.session.scalars(db.select(OrderDocument.order_id).where(
+        ~db.exists().where(Order.id == OrderDocument.order_id))).all()
+    counts['orphaned'] = len(orphaned)
+    if repair and orphaned:
+        delete(orphaned)
+        db.session.commit()
+    db.session.rollback()
+    return counts
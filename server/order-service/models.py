@@ -1,8 +1,16 @@
 from database import db
+from shards import SHARD_SLOTS
 import datetime
 
 class Order(db.Model):
     __tablename__ = 'orders' # Using 'orders' plural for table name
+    __table_args__ = (
+        # Keyset pagination for "my orders" pages, optionally filtered by status
+        db.Index('ix_orders_user_date_id', 'user_id', 'order_date', 'id'),
+        db.Index('ix_orders_user_status_date_id', 'user_id', 'status', 'order_date', 'id'),
+        db.Index('ix_orders_date_id', 'order_date', 'id'), # Admin-wide listing
+        {'sqlite_autoincrement': True}, # Never reuse the id of an order that was archived or deleted
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.String(255), nullable=False) # Storing user_id from user-service
@@ -16,7 +24,10 @@ class Order(db.Model):
 
     # Relationship to OrderItem: 'cascade="all, delete-orphan"' means if an Order is deleted,
     # all its associated OrderItems are also deleted.
-    items = db.relationship('OrderItem', backref='order', lazy=True, cascade="all, delete-orphan")
+    # lazy='selectin': items for every Order loaded by a query come from one extra
+    # SELECT ... WHERE order_id IN (...), instead of one SELECT per order in to_dict()
+    items = db.relationship('OrderItem', backref='order', lazy='selectin', cascade="all, delete-orphan",
+                            order_by='OrderItem.id')
 
     def __init__(self, user_id, shipping_address):
         self.user_id = user_id
@@ -44,9 +55,10 @@ class Order(db.Model):
 
 class OrderItem(db.Model):
     __tablename__ = 'order_items' # Using 'order_items' plural
+    __table_args__ = {'sqlite_autoincrement': True}
 
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False) # Foreign Key to Order
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False, index=True) # Foreign Key to Order
     book_id = db.Column(db.String(255), nullable=False) # Storing book_id from catalog-service
     quantity = db.Column(db.Integer, nullable=False)
     price_at_purchase = db.Column(db.Float, nullable=False) # Price at the time of order
@@ -72,4 +84,157 @@ class OrderItem(db.Model):
         }
 
     def __repr__(self):
-        return f'<OrderItem {self.id} for Order {self.order_id} - Book {self.book_id}>'
\ No newline at end of file
+        return f'<OrderItem {self.id} for Order {self.order_id} - Book {self.book_id}>'
+
+
+class ArchivedOrder(db.Model):
+    """
+    An order moved out of the hot database by archive.py. Lives in the 'archive' bind and keeps
+    the original id, so GET /orders/<id> can fall back to it and return the same document.
+    """
+    __bind_key__ = 'archive'
+    __tablename__ = 'archived_orders'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(255), nullable=False, index=True)
+    order_date = db.Column(db.DateTime, nullable=False)
+    total_amount = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(50), nullable=False)
+    shipping_address = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.datetime.now, nullable=False)
+
+    items = db.relationship('ArchivedOrderItem', lazy='selectin', order_by='ArchivedOrderItem.id')
+
+    to_dict = Order.to_dict # Same document shape as a hot order
+
+
+class ArchivedOrderItem(db.Model):
+    __bind_key__ = 'archive'
+    __tablename__ = 'archived_order_items'
+
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('archived_orders.id'), nullable=False, index=True)
+    book_id = db.Column(db.String(255), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    price_at_purchase = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+
+    to_dict = OrderItem.to_dict
+
+
+class DailyOrderRollup(db.Model):
+    """Orders and revenue per order day and status, kept up to date by rollups.py."""
+    __tablename__ = 'daily_order_rollups'
+
+    day = db.Column(db.Date, primary_key=True) # Date part of Order.order_date
+    status = db.Column(db.String(50), primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+
+
+class DailyBookRollup(db.Model):
+    """Units sold and revenue per order day and book, excluding cancelled orders (see rollups.py)."""
+    __tablename__ = 'daily_book_rollups'
+
+    day = db.Column(db.Date, primary_key=True)
+    book_id = db.Column(db.String(255), primary_key=True)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+
+
+class OrderIdCounter(db.Model):
+    """Single-row counter, one per shard, handing out the sequence part of order and item ids."""
+    __tablename__ = 'order_id_counter'
+
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+
+def allocate_id_sequence(session, count, legacy_max_id=0):
+    """
+    Reserves count consecutive id sequence numbers on the current shard and returns the first one
+    (ids are built from them with shards.encode_id()).
+    The UPDATE takes SQLite's write lock, so concurrent writers never get the same numbers.
+    A new counter starts above every id already stored on this shard, hot or archived, and above
+    legacy_max_id (ORDER_LEGACY_MAX_ID), so new ids on any shard never collide with or route like
+    orders created before sharding.
+    """
+    result = session.execute(db.update(OrderIdCounter)
+                             .where(OrderIdCounter.id == 1)
+                             .values(value=OrderIdCounter.value + count))
+    if result.rowcount == 0:
+        highest = max([legacy_max_id] + [session.scalar(db.select(db.func.max(model.id))) or 0
+                                         for model in (Order, OrderItem, ArchivedOrder, ArchivedOrderItem)])
+        session.execute(OrderIdCounter.__table__.insert().values(id=1, value=highest // SHARD_SLOTS + count))
+    last = session.execute(db.select(OrderIdCounter.value).where(OrderIdCounter.id == 1)).scalar_one()
+    return last - count + 1
+
+
+class OrderDocument(db.Model):
+    """
+    Pre-rendered JSON of an order (the Order.to_dict() shape, with items), kept up to date by
+    documents.py on every order write so reads are a single-row fetch with no ORM objects or joins.
+    """
+    __tablename__ = 'order_documents'
+
+    order_id = db.Column(db.Integer, primary_key=True)
+    document = db.Column(db.Text, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.now, nullable=False)
+
+
+class OutboxEvent(db.Model):
+    """
+    An order event waiting to be delivered to other services (see outbox.py). Written in the same
+    transaction as the order change it describes, so an event exists if and only if the change committed.
+    """
+    __tablename__ = 'outbox_events'
+    __table_args__ = (
+        db.Index('ix_outbox_events_pending', 'delivered_at', 'next_attempt_at', 'id'), # Dispatcher's scan
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.String(36), nullable=False, unique=True) # Lets consumers drop redeliveries
+    event_type = db.Column(db.String(50), nullable=False) # 'order.created', 'order.status_changed'
+    order_id = db.Column(db.Integer, nullable=False)
+    payload = db.Column(db.Text, nullable=False) # JSON
+    created_at = db.Column(db.DateTime, default=datetime.datetime.now, nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.datetime.now, nullable=False)
+    delivered_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+
+
+# Tables that exist once per shard; everything else lives in the default database or its own bind
+SHARDED_TABLES = (
+    Order.__table__, OrderItem.__table__, OrderIdCounter.__table__,
+    DailyOrderRollup.__table__, DailyBookRollup.__table__, OutboxEvent.__table__, OrderDocument.__table__
+)
+
+
+# Columns read by the lean list path (plain tuples, no ORM objects), matching to_dict()
+ORDER_COLUMNS = (
+    Order.id, Order.user_id, Order.order_date, Order.total_amount, Order.status, Order.shipping_address,
+    Order.created_at, Order.updated_at
+)
+ORDER_SUMMARY_COLUMNS = (Order.id, Order.user_id, Order.order_date, Order.total_amount, Order.status)
+ORDER_ITEM_COLUMNS = (
+    OrderItem.id, OrderItem.order_id, OrderItem.book_id, OrderItem.quantity, OrderItem.price_at_purchase,
+    OrderItem.created_at, OrderItem.updated_at
+)
+
+
+class IdempotencyRecord(db.Model):
+    """Stored response for a POST made with an Idempotency-Key header (see idempotency.py)."""
+    __tablename__ = 'idempotency_keys'
+
+    key = db.Column(db.String(320), primary_key=True) # "<method> <path> <client key>"
+    request_fingerprint = db.Column(db.String(64), nullable=False) # sha256 of the request body
+    state = db.Column(db.String(20), nullable=False) # 'in_progress' or 'completed'
+    status_code = db.Column(db.Integer)
+    response_body = db.Column(db.Text)
+    response_headers = db.Column(db.Text) # JSON [[name, value], ...] of the REPLAYED_HEADERS that were set
+    created_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
@@ -0,0 +1,230 @@
+import json
+import time
+import uuid
+import datetime
+import threading
+from collections import deque
+import requests
+from database import db
+from models import OutboxEvent
+import shards
+
+PURGE_INTERVAL_SECONDS = 300
+PURGE_CHUNK_SIZE = 1000 # Delivered rows deleted per transaction, so a purge never holds the write lock for long
+
+
+def record_events(events):
+    """
+    Adds outbox rows for (event_type, order_id, payload) tuples to the caller's transaction,
+    on the current shard, with one executemany INSERT. The caller commits them together with
+    the order change, so the write path never waits for another service.
+    """
+    if not events:
+        return
+    now = datetime.datetime.now()
+    db.session.execute(db.insert(OutboxEvent), [{
+        'event_id': str(uuid.uuid4()),
+        'event_type': event_type,
+        'order_id': order_id,
+        'payload': json.dumps(payload),
+        'created_at': now,
+        'next_attempt_at': now,
+        'attempts': 0
+    } for event_type, order_id, payload in events])
+
+
+class HttpEventSink:
+    """Delivers a batch of events with one POST to the payment service (POST /payments/events)."""
+
+    def __init__(self, url, timeout_seconds=5):
+        self.url = url
+        self.timeout_seconds = timeout_seconds
+        self._session = requests.Session() # Reuses the HTTP connection between batches
+
+    def deliver(self, events):
+        resp = self._session.post(self.url, json={'events': events}, timeout=self.timeout_seconds)
+        resp.raise_for_status()
+
+    def stats(self):
+        return {'type': 'http', 'url': self.url}
+
+
+class LocalQueueSink:
+    """
+    In-process stand-in for a message broker: delivered events are kept in a bounded buffer that
+    in-process consumers read with drain(). Nothing has to consume it: once maxsize events are
+    buffered the oldest are dropped (and counted), so delivery always succeeds and the outbox
+    never backs up because of this sink.
+    """
+
+    def __init__(self, maxsize=10000):
+        self._lock = threading.Lock()
+        self._events = deque(maxlen=maxsize)
+        self.dropped = 0
+
+    def deliver(self, events):
+        with self._lock:
+            self.dropped += max(0, len(self._events) + len(events) - self._events.maxlen) # Oldest fall out
+            self._events.extend(events)
+
+    def drain(self, limit=None):
+        """Removes and returns up to limit buffered events (all of them by default), oldest first."""
+        with self._lock:
+            count = len(self._events) if limit is None else min(limit, len(self._events))
+            return [self._events.popleft() for _ in range(count)]
+
+    def stats(self):
+        with self._lock:
+            return {'type': 'local', 'queued': len(self._events), 'max_queued': self._events.maxlen,
+                    'dropped': self.dropped}
+
+
+class OutboxDispatcher:
+    """
+    Delivers outbox events in batches, oldest first, on every shard. At-least-once delivery:
+    an event is marked delivered only after the sink accepted its batch, so a crash or a failed
+    batch leads to redelivery (consumers de-duplicate on event_id). Failed batches are retried
+    with exponential backoff, capped at retry_max_seconds.
+    Each batch is leased (next_attempt_at moved lease_seconds ahead) before it is sent, so
+    dispatchers in several worker processes do not send the same batch at the same time.
+    """
+
+    def __init__(self, sink, shard_count, batch_size=100, retry_base_seconds=2, retry_max_seconds=300,
+                 lease_seconds=30, retention_seconds=24 * 3600):
+        self.sink = sink
+        self.shard_count = shard_count
+        self.batch_size = batch_size
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.lease_seconds = lease_seconds
+        self.retention_seconds = retention_seconds
+        self._last_purge = 0.0
+
+    def dispatch_once(self, log=None):
+        """Sends at most one batch per shard. Returns the number of events delivered."""
+        purge = time.monotonic() - self._last_purge >= PURGE_INTERVAL_SECONDS
+        if purge:
+            self._last_purge = time.monotonic()
+        delivered = 0
+        for shard in range(self.shard_count):
+            with shards.use_shard(shard):
+                delivered += self._dispatch_batch(log)
+                if purge:
+                    self._purge_delivered()
+        return delivered
+
+    def _claim_batch(self, now):
+        rows = db.session.execute(
+            db.select(OutboxEvent.id, OutboxEvent.event_id, OutboxEvent.event_type, OutboxEvent.order_id,
+                      OutboxEvent.payload, OutboxEvent.created_at, OutboxEvent.attempts)
+            .where(OutboxEvent.delivered_at.is_(None), OutboxEvent.next_attempt_at <= now)
+            .order_by(OutboxEvent.id)
+            .limit(self.batch_size)
+        ).all()
+        if not rows:
+            db.session.rollback()
+            return []
+        ids = [row.id for row in rows]
+        lease_until = now + datetime.timedelta(seconds=self.lease_seconds)
+        result = db.session.execute(db.update(OutboxEvent)
+                                    .where(OutboxEvent.id.in_(ids), OutboxEvent.delivered_at.is_(None),
+                                           OutboxEvent.next_attempt_at <= now)
+                                    .values(next_attempt_at=lease_until)
+                                    .execution_options(synchronize_session=False))
+        if result.rowcount != len(ids): # Another dispatcher leased some of them first
+            ours = set(db.session.scalars(db.select(OutboxEvent.id).where(
+                OutboxEvent.id.in_(ids), OutboxEvent.next_attempt_at == lease_until)))
+            rows = [row for row in rows if row.id in ours]
+        db.session.commit()
+        return rows
+
+    def _dispatch_batch(self, log):
+        now = datetime.datetime.now()
+        rows = self._claim_batch(now)
+        if not rows:
+            return 0
+
+        events = [{
+            'event_id': row.event_id,
+            'event_type': row.event_type,
+            'order_id': row.order_id,
+            'payload': json.loads(row.payload),
+            'created_at': row.created_at.isoformat()
+        } for row in rows]
+        try:
+            self.sink.deliver(events)
+        except Exception as e:
+            error = str(e)[:500]
+            db.session.execute(db.update(OutboxEvent), [{
+                'id': row.id,
+                'attempts': row.attempts + 1,
+                'next_attempt_at': now + datetime.timedelta(
+                    seconds=min(self.retry_base_seconds * 2 ** row.attempts, self.retry_max_seconds)),
+                'last_error': error
+            } for row in rows])
+            db.session.commit()
+            if log:
+                log(f"Outbox delivery of {len(rows)} event(s) on shard {shards.current_shard()} failed: {error}")
+            return 0
+
+        db.session.execute(db.update(OutboxEvent)
+                           .where(OutboxEvent.id.in_([row.id for row in rows]))
+                           .values(delivered_at=datetime.datetime.now(), attempts=OutboxEvent.attempts + 1,
+                                   last_error=None)
+                           .execution_options(synchronize_session=False))
+        db.session.commit()
+        return len(rows)
+
+    def _purge_delivered(self):
+        """
+        Deletes delivered events older than the retention period on the current shard,
+        PURGE_CHUNK_SIZE rows per transaction.
+        """
+        cutoff = datetime.datetime.now() - datetime.timedelta(seconds=self.retention_seconds)
+        while True:
+            ids = db.session.scalars(db.select(OutboxEvent.id)
+                                     .where(OutboxEvent.delivered_at < cutoff)
+                                     .limit(PURGE_CHUNK_SIZE)).all()
+            if not ids:
+                db.session.rollback()
+                return
+            db.session.execute(db.delete(OutboxEvent).where(OutboxEvent.id.in_(ids)))
+            db.session.commit()
+
+    def pending_stats(self):
+        """Per-shard count and age of undelivered events."""
+        stats = []
+        now = datetime.datetime.now()
+        for shard in range(self.shard_count):
+            with shards.use_shard(shard):
+                pending, oldest, failing = db.session.execute(
+                    db.select(db.func.count(OutboxEvent.id), db.func.min(OutboxEvent.created_at),
+                              db.func.count(OutboxEvent.last_error))
+                    .where(OutboxEvent.delivered_at.is_(None))
+                ).one()
+            stats.append({
+                'shard': shard,
+                'pending': pending,
+                'failing': failing,
+                'oldest_pending_seconds': round((now - oldest).total_seconds(), 1) if oldest else None
+            })
+        return stats
+
+    def start(self, app, interval_seconds):
+        """
+        Runs dispatch_once() every interval_seconds in a daemon thread, and back to back while
+        full batches keep coming.
+        """
+        def run():
+            while True:
+                time.sleep(interval_seconds)
+                try:
+                    with app.app_context():
+                        while self.dispatch_once(log=app.logger.warning) >= self.batch_size:
+                            pass
+                except Exception as e:
+                    app.logger.error(f"Outbox dispatcher failed: {e}")
+
+        thread = threading.Thread(target=run, name='outbox-dispatcher', daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,136 @@
+import datetime
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from database import db
+from shards import ids_in_shard
+from models import Order, OrderItem, ArchivedOrder, ArchivedOrderItem, DailyOrderRollup, DailyBookRollup
+
+# Orders in these statuses count towards their status row but not towards revenue or units sold
+NON_REVENUE_STATUSES = ('cancelled',)
+
+SQL_IN_CHUNK_SIZE = 500
+
+
+def _apply_deltas(model, key_columns, deltas):
+    """
+    Adds deltas ({key tuple: [value, ...]}) to the rollup rows with one executemany upsert,
+    creating rows that do not exist yet. Value columns are every non-key column of the model.
+    """
+    if not deltas:
+        return
+    value_columns = [column.key for column in model.__table__.columns if column.key not in key_columns]
+    rows = [dict(zip(key_columns, key), **dict(zip(value_columns, values))) for key, values in deltas.items()]
+    insert = postgresql.insert if db.session.get_bind().dialect.name == 'postgresql' else sqlite.insert
+    stmt = insert(model.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=key_columns,
+        set_={name: model.__table__.c[name] + stmt.excluded[name] for name in value_columns}
+    )
+    db.session.execute(stmt, rows)
+
+
+def _add(deltas, key, *values):
+    current = deltas.setdefault(key, [0] * len(values))
+    for index, value in enumerate(values):
+        current[index] += value
+
+
+def _add_items(book_deltas, day, items, sign):
+    for book_id, quantity, price in items:
+        _add(book_deltas, (day, book_id), sign * quantity, sign * quantity * price)
+
+
+def record_order_created(order, item_rows):
+    """Adds a new order (flushed, with its item rows as dicts) to the rollups, in the caller's transaction."""
+    day = order.order_date.date()
+    _apply_deltas(DailyOrderRollup, ('day', 'status'), {(day, order.status): [1, order.total_amount]})
+    if order.status not in NON_REVENUE_STATUSES:
+        book_deltas = {}
+        _add_items(book_deltas, day, ((row['book_id'], row['quantity'], row['price_at_purchase']) for row in item_rows), 1)
+        _apply_deltas(DailyBookRollup, ('day', 'book_id'), book_deltas)
+
+
+def record_order_deleted(order):
+    """Removes an order (with its items still loaded) from the rollups, in the caller's transaction."""
+    day = order.order_date.date()
+    _apply_deltas(DailyOrderRollup, ('day', 'status'), {(day, order.status): [-1, -order.total_amount]})
+    if order.status not in NON_REVENUE_STATUSES:
+        book_deltas = {}
+        _add_items(book_deltas, day, ((item.book_id, item.quantity, item.price_at_purchase) for item in order.items), -1)
+        _apply_deltas(DailyBookRollup, ('day', 'book_id'), book_deltas)
+
+
+def record_status_changes(changes):
+    """
+    Moves orders between status rows, in the caller's transaction.
+    changes is a list of (order_id, order_date, total_amount, previous_status, new_status).
+    Units per book only change when an order moves into or out of a non-revenue status; the items
+    of those orders are loaded with chunked IN queries.
+    """
+    order_deltas = {}
+    item_signs = {} # order id -> (day, +1 / -1)
+    for order_id, order_date, total_amount, previous, new_status in changes:
+        day = order_date.date()
+        _add(order_deltas, (day, previous), -1, -total_amount)
+        _add(order_deltas, (day, new_status), 1, total_amount)
+        was_counted = previous not in NON_REVENUE_STATUSES
+        is_counted = new_status not in NON_REVENUE_STATUSES
+        if was_counted != is_counted:
+            item_signs[order_id] = (day, 1 if is_counted else -1)
+    _apply_deltas(DailyOrderRollup, ('day', 'status'), order_deltas)
+
+    book_deltas = {}
+    order_ids = list(item_signs)
+    for start in range(0, len(order_ids), SQL_IN_CHUNK_SIZE):
+        rows = db.session.execute(
+            db.select(OrderItem.order_id, OrderItem.book_id, OrderItem.quantity, OrderItem.price_at_purchase)
+            .where(OrderItem.order_id.in_(order_ids[start:start + SQL_IN_CHUNK_SIZE]))
+        )
+        for order_id, book_id, quantity, price in rows:
+            day, sign = item_signs[order_id]
+            _add_items(book_deltas, day, [(book_id, quantity, price)], sign)
+    _apply_deltas(DailyBookRollup, ('day', 'book_id'), book_deltas)
+
+
+def rebuild(shard=0, shard_count=1, legacy_max_id=0):
+    """
+    Recomputes both rollup tables of the current shard from orders and order_items with GROUP BY queries,
+    including this shard's archived orders (archive.py), which still count as past sales.
+    Use it after a bulk import, or to correct drift. Commits. Returns the number of rows written per table.
+    """
+    def as_date(value): # func.date() gives a string on SQLite and a date on PostgreSQL
+        return value if not isinstance(value, str) else datetime.date.fromisoformat(value)
+
+    order_totals = {}
+    book_totals = {}
+    for order_model, item_model in ((Order, OrderItem), (ArchivedOrder, ArchivedOrderItem)):
+        day = func.date(order_model.order_date)
+        # The archive is shared by all shards: only count the orders whose ids belong to this one
+        in_shard = ids_in_shard(order_model.id, shard, shard_count, legacy_max_id) if order_model is ArchivedOrder else True
+        for d, status, count, revenue in db.session.execute(
+                db.select(day, order_model.status, func.count(order_model.id), func.sum(order_model.total_amount))
+                .where(in_shard)
+                .group_by(day, order_model.status)):
+            _add(order_totals, (as_date(d), status), count, revenue)
+        for d, book_id, units, revenue in db.session.execute(
+                db.select(day, item_model.book_id, func.sum(item_model.quantity),
+                          func.sum(item_model.quantity * item_model.price_at_purchase))
+                .join(order_model, order_model.id == item_model.order_id)
+                .where(order_model.status.not_in(NON_REVENUE_STATUSES), in_shard)
+                .group_by(day, item_model.book_id)):
+            _add(book_totals, (as_date(d), book_id), units, revenue)
+
+    db.session.execute(db.delete(DailyOrderRollup))
+    db.session.execute(db.delete(DailyBookRollup))
+    if order_totals:
+        db.session.execute(db.insert(DailyOrderRollup), [
+            {'day': d, 'status': status, 'order_count': count, 'revenue': revenue}
+            for (d, status), (count, revenue) in order_totals.items()
+        ])
+    if book_totals:
+        db.session.execute(db.insert(DailyBookRollup), [
+            {'day': d, 'book_id': book_id, 'units': units, 'revenue': revenue}
+            for (d, book_id), (units, revenue) in book_totals.items()
+        ])
+    db.session.commit()
+    return {'daily_order_rollups': len(order_totals), 'daily_book_rollups': len(book_totals)}
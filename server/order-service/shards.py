@@ -0,0 +1,101 @@
+import zlib
+import functools
+import contextlib
+import contextvars
+from flask import current_app
+from flask_sqlalchemy.session import Session
+from sqlalchemy import select, func
+
+# Order and order item ids are <sequence> * SHARD_SLOTS + <shard index>, so every id names its shard
+SHARD_SLOTS = 64
+
+_current_shard = contextvars.ContextVar('current_order_shard', default=0)
+
+
+def shard_bind_key(index):
+    """Shard 0 is the default database (SQLALCHEMY_DATABASE_URI); shard i > 0 is the bind 'order_shard_<i>'."""
+    return None if index == 0 else f'order_shard_{index}'
+
+
+def shard_for_user(user_id, shard_count):
+    """crc32 rather than hash(), which is salted per process: every worker must route a customer the same way."""
+    return zlib.crc32(str(user_id).encode('utf-8')) % shard_count
+
+
+def shard_for_id(object_id, shard_count, legacy_max_id=0):
+    """
+    The shard an order or order item id belongs to.
+    Ids up to legacy_max_id (ORDER_LEGACY_MAX_ID: plain auto-increment ids created before sharding,
+    which all live on shard 0) resolve to shard 0, and so do ids that name a shard that is not configured.
+    """
+    if object_id <= legacy_max_id:
+        return 0
+    shard = object_id % SHARD_SLOTS
+    return shard if shard < shard_count else 0
+
+
+def ids_in_shard(column, shard, shard_count, legacy_max_id=0):
+    """SQL condition matching the ids shard_for_id() assigns to `shard`, e.g. for tables shared by all shards."""
+    if shard != 0:
+        return (column % SHARD_SLOTS == shard) & (column > legacy_max_id)
+    return (column % SHARD_SLOTS == 0) | (column % SHARD_SLOTS >= shard_count) | (column <= legacy_max_id)
+
+
+def misrouted_legacy_id(session, model, shard_count, legacy_max_id):
+    """
+    Returns the highest id of `model` in shard 0's database that shard_for_id() would send to another
+    shard, or None. Every id written on shard 0 since sharding encodes shard 0, so such an id can only
+    be a pre-sharding id above legacy_max_id.
+    """
+    residue = model.id % SHARD_SLOTS
+    return session.scalar(select(func.max(model.id))
+                          .where(model.id > legacy_max_id, residue >= 1, residue < shard_count))
+
+
+def encode_id(sequence, shard):
+    return sequence * SHARD_SLOTS + shard
+
+
+def current_shard():
+    return _current_shard.get()
+
+
+@contextlib.contextmanager
+def use_shard(index):
+    """Routes db.session statements for the sharded tables to shard `index` inside the block."""
+    token = _current_shard.set(index)
+    try:
+        yield
+    finally:
+        _current_shard.reset(token)
+
+
+def on_order_shard(view):
+    """Runs a view that takes an `order_id` argument on the shard that order id belongs to."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with use_shard(shard_for_id(kwargs['order_id'], current_app.config['ORDER_SHARD_COUNT'],
+                                    current_app.config['ORDER_LEGACY_MAX_ID'])):
+            return view(*args, **kwargs)
+    return wrapper
+
+
+class ShardedSession(Session):
+    """
+    db.session class that sends statements for models without a bind_key (orders, items, rollups)
+    to the shard selected with use_shard(). Models with their own bind ('archive') are unaffected,
+    and outside use_shard() everything goes to shard 0, the default database.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        shard = _current_shard.get()
+        if bind is None and shard and engine is self._db.engines[None]:
+            return self._db.engines[shard_bind_key(shard)]
+        return engine
+
+
+def create_shard_tables(db, tables, shard_count):
+    """db.create_all() only covers the default database (shard 0); this creates `tables` on the other shards."""
+    for index in range(1, shard_count):
+        db.metadata.create_all(bind=db.engines[shard_bind_key(index)], tables=tables)
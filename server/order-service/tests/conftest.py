@@ -0,0 +1,29 @@
+"""
+Shared setup for the order service tests: a throwaway database for every run, set before app.py
+is imported (it reads its configuration at import time), and a client fixture on empty tables.
+"""
+import os
+import sys
+import tempfile
+
+_tmpdir = tempfile.mkdtemp(prefix='order_service_tests_')
+os.environ.update({
+    'ORDER_DATABASE_URI': 'sqlite:///' + os.path.join(_tmpdir, 'orders.db'),
+    'ORDER_ARCHIVE_DATABASE_URI': 'sqlite:///' + os.path.join(_tmpdir, 'orders_archive.db'),
+    'ORDER_SHARD_COUNT': '1',
+    'SQL_QUERY_COUNT_HEADER': 'true',
+    'OUTBOX_DISPATCH_INTERVAL': '0',
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from app import app
+from database import db
+
+
+@pytest.fixture
+def client():
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    yield app.test_client()
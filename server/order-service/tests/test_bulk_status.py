@@ -0,0 +1,53 @@
+"""
+Tests for the bulk order status endpoint (PUT /orders/status): request validation and per-order results.
+
+Run from server/order-service: python -m pytest tests
+"""
+import pytest
+from app import app
+from database import db
+from models import Order
+
+
+def seed(order_count):
+    with app.app_context():
+        orders = [Order('user-1', '1 Test Street') for _ in range(order_count)]
+        db.session.add_all(orders)
+        db.session.commit()
+        return [order.id for order in orders]
+
+
+@pytest.mark.parametrize('body', [
+    [{'order_id': 1, 'status': 'shipped'}],
+    'shipped',
+    42,
+])
+def test_non_object_body_is_rejected(client, body):
+    response = client.put('/orders/status', json=body)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+@pytest.mark.parametrize('body', [
+    {'updates': 'shipped'},
+    {'updates': [['not', 'an', 'object']]},
+    {'updates': [{'status': 'shipped'}]},
+    {'order_ids': 'all', 'status': 'shipped'},
+])
+def test_malformed_updates_are_rejected(client, body):
+    assert client.put('/orders/status', json=body).status_code == 400
+
+
+def test_updates_are_applied_per_order(client):
+    shipped, unknown_status = seed(2)
+    response = client.put('/orders/status', json={'updates': [
+        {'order_id': shipped, 'status': 'shipped'},
+        {'order_id': unknown_status, 'status': 'teleported'},
+        {'order_id': 999999, 'status': 'shipped'},
+    ]})
+    assert response.status_code == 200
+    results = {result['order_id']: result['status'] for result in response.get_json()['results']}
+    assert results == {shipped: 'updated', unknown_status: 'invalid_status', 999999: 'not_found'}
+    with app.app_context():
+        assert db.session.get(Order, shipped).status == 'shipped'
+        assert db.session.get(Order, unknown_status).status == 'pending'
@@ -0,0 +1,69 @@
+"""
+Query-count regression tests for the order read endpoints (N+1 guard).
+Every endpoint is hit with N and with 10N orders (and with few and many items per order) and must
+issue the same number of SQL statements, as reported by the X-SQL-Query-Count header.
+
+Run from server/order-service: python -m pytest tests
+"""
+import pytest
+from app import app
+from database import db
+from models import Order, OrderItem, OrderDocument
+import documents
+
+USER_ID = 'user-1'
+N = 20
+
+
+def seed(order_count, items_per_order=3, with_documents=False):
+    """Inserts order_count orders for USER_ID. Returns their ids."""
+    with app.app_context():
+        orders = [Order(USER_ID, '1 Test Street') for _ in range(order_count)]
+        db.session.add_all(orders)
+        db.session.flush()
+        db.session.add_all([OrderItem(order.id, str(book), 1, 9.5)
+                            for order in orders for book in range(items_per_order)])
+        order_ids = [order.id for order in orders]
+        if with_documents:
+            documents.refresh(order_ids)
+        db.session.commit()
+        return order_ids
+
+
+def query_count(client, url):
+    response = client.get(url)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return int(response.headers['X-SQL-Query-Count']), response
+
+
+@pytest.mark.parametrize('view', ['full', 'summary'])
+@pytest.mark.parametrize('with_documents', [False, True])
+def test_order_list_query_count_is_constant(client, view, with_documents):
+    url = f'/orders?user_id={USER_ID}&limit=500&view={view}'
+    seed(N, with_documents=with_documents)
+    small, response = query_count(client, url)
+    assert len(response.get_json()) == N
+
+    seed(9 * N, with_documents=with_documents)
+    large, response = query_count(client, url)
+    assert len(response.get_json()) == 10 * N
+    assert large == small
+
+
+@pytest.mark.parametrize('with_documents', [False, True])
+def test_order_detail_query_count_is_constant(client, with_documents):
+    few_items = seed(1, items_per_order=2, with_documents=with_documents)[0]
+    many_items = seed(1, items_per_order=40, with_documents=with_documents)[0]
+    small, response = query_count(client, f'/orders/{few_items}')
+    assert len(response.get_json()['items']) == 2
+    large, response = query_count(client, f'/orders/{many_items}')
+    assert len(response.get_json()['items']) == 40
+    assert large == small
+
+
+def test_order_detail_without_document_loads_items_in_one_query(client):
+    order_id = seed(1, items_per_order=10)[0]
+    with app.app_context():
+        assert db.session.get(OrderDocument, order_id) is None
+    count, _ = query_count(client, f'/orders/{order_id}')
+    assert count == 3 # document lookup, order, items (selectin)
@@ -1,11 +1,21 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
-from models import Payment
+from models import Payment, OrderEvent, PAYMENT_COLUMNS
 from database import db, init_db # Import db and init_db
 from config import Config
 import datetime
+import json
+import io
+import codecs
+import csv
+import base64
+import binascii
 import uuid # For generating unique transaction IDs
-import random # For simulating payment success/failure
+from row_encoder import compile_row_encoder, dumps
+from idempotency import idempotent
+from settlement import SettlementWorkerPool, load_processor, callback_allowed
+import reconciliation
+import click
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -13,12 +23,38 @@ init_db(app) # Initialize db with the app first
 
 CORS(app, resources={r"/*": {"origins": Config.CORS_ORIGINS}})
 
+encode_payment_row = compile_row_encoder(PAYMENT_COLUMNS)
+
+# Payments are settled against the processor in background workers (see settlement.py)
+settlement_pool = SettlementWorkerPool(app, load_processor(app.config), Config.SETTLEMENT_WORKERS,
+                                       Config.SETTLEMENT_POLL_INTERVAL, Config.SETTLEMENT_LEASE_SECONDS,
+                                       Config.SETTLEMENT_MAX_ATTEMPTS,
+                                       callback_allowed_hosts=Config.SETTLEMENT_CALLBACK_ALLOWED_HOSTS)
+if Config.SETTLEMENT_WORKERS > 0:
+    settlement_pool.start()
+
+SETTLEMENT_POLL_AFTER_SECONDS = 1 # Retry-After hint for clients polling an unsettled payment
+
+PAYMENT_PAGE_DEFAULT_LIMIT = 50
+PAYMENT_PAGE_MAX_LIMIT = 500
+PAYMENT_STATUSES = ['pending', 'processing', 'completed', 'failed', 'refunded', 'disputed']
+
+EXPORT_CHUNK_SIZE = 1000 # Rows fetched per query by the streaming export
+EXPORT_CSV_FIELDS = [column.key for column in PAYMENT_COLUMNS]
+
+RECONCILIATION_CHUNK_SIZE = 1000 # Settlement lines matched per query
+RECONCILIATION_REPORT_MAX_ENTRIES = 1000 # Mismatches listed in the endpoint's response (all are counted)
+
+LOOKUP_MAX_ORDER_IDS = 1000
+SQL_IN_CHUNK_SIZE = 500 # Ids per IN (...) list, well below SQLite's bound-parameter limit
+
 @app.route('/')
 def home():
     return jsonify({"message": "Payment Service is running!", "status": "OK"})
 
 
 @app.route('/payments', methods=['POST'])
+@idempotent # NEW: retries with the same Idempotency-Key header replay the first response
 def initiate_payment():
     data = request.get_json()
     if not data:
@@ -29,6 +65,7 @@ def initiate_payment():
     amount = data.get('amount')
     currency = data.get('currency')
     payment_method = data.get('payment_method')
+    callback_url = data.get('callback_url') # Optional webhook, called once the payment is settled
 
     if not all([order_id, user_id, amount, currency, payment_method]):
         return jsonify({"error": "Missing order_id, user_id, amount, currency, or payment_method"}), 400
@@ -39,13 +76,16 @@ def initiate_payment():
             return jsonify({"error": "Amount must be positive"}), 400
     except (ValueError, TypeError):
         return jsonify({"error": "Invalid amount type"}), 400
+    if not isinstance(currency, str):
+        return jsonify({"error": "Invalid currency"}), 400
+    currency = currency.upper() # Stored upper case, e.g. 'USD'
+    if callback_url is not None and not callback_allowed(callback_url, settlement_pool.callback_allowed_hosts):
+        return jsonify({"error": "callback_url must be an http(s) URL on an allowed host"}), 400
 
     # Simulate a transaction ID from a payment gateway
     transaction_id = str(uuid.uuid4())
 
-    # Simulate payment status (e.g., 80% success rate)
-    simulated_status = 'completed' if random.random() < 0.8 else 'failed'
-
+    # NEW: the payment is only recorded here; a settlement worker charges it and sets the final status
     try:
         new_payment = Payment(
             order_id=order_id,
@@ -54,23 +94,182 @@ def initiate_payment():
             currency=currency,
             payment_method=payment_method,
             transaction_id=transaction_id,
-            status=simulated_status # Set the simulated status
+            status='pending',
+            callback_url=callback_url
         )
         db.session.add(new_payment)
         db.session.commit()
-        return jsonify(new_payment.to_dict()), 201
+        payment = new_payment.to_dict()
+        settlement_pool.submit(new_payment.id)
+        response = jsonify(payment)
+        response.headers['Location'] = f"/payments/{new_payment.id}/status"
+        return response, 202
     except Exception as e:
         db.session.rollback()
         app.logger.error(f"Error initiating payment: {e}")
         return jsonify({"error": "Failed to initiate payment", "details": str(e)}), 500
 
 
+@app.route('/payments/events', methods=['POST'])
+def receive_order_events():
+    """
+    Receives a batch of order events from the order service's outbox dispatcher:
+    {"events": [{"event_id", "event_type", "order_id", "payload", "created_at"}, ...]}
+    Events already received (same event_id) are skipped, so redelivered batches are harmless.
+    """
+    data = request.get_json()
+    events = data.get('events') if data else None
+    if not isinstance(events, list):
+        return jsonify({"error": "'events' must be a list"}), 400
+    try:
+        by_id = {str(event['event_id']): event for event in events}
+    except (TypeError, KeyError):
+        return jsonify({"error": "Each event must have an event_id"}), 400
+
+    try:
+        known = set(db.session.scalars(db.select(OrderEvent.event_id).where(OrderEvent.event_id.in_(list(by_id)))))
+        new_rows = [{
+            'event_id': event_id,
+            'event_type': event['event_type'],
+            'order_id': str(event['order_id']),
+            'payload': json.dumps(event.get('payload')),
+            'created_at': datetime.datetime.fromisoformat(event['created_at']),
+            'received_at': datetime.datetime.now()
+        } for event_id, event in by_id.items() if event_id not in known]
+    except (TypeError, KeyError, ValueError) as e:
+        return jsonify({"error": f"Invalid event: {e}"}), 400
+
+    try:
+        if new_rows:
+            db.session.execute(db.insert(OrderEvent), new_rows)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback() # e.g. a concurrent redelivery; the sender retries the batch
+        app.logger.error(f"Error storing order events: {e}")
+        return jsonify({"error": "Failed to store order events", "details": str(e)}), 500
+    return jsonify({"accepted": len(new_rows), "duplicates": len(by_id) - len(new_rows)}), 200
+
+
+
+
+def _encode_cursor(payment_date, payment_id):
+    return base64.urlsafe_b64encode(f"{payment_date.isoformat()}|{payment_id}".encode()).decode()
+
+
+def _decode_cursor(cursor):
+    """Returns (payment_date, id) from a cursor produced by _encode_cursor. Raises ValueError."""
+    try:
+        payment_date, payment_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.datetime.fromisoformat(payment_date), int(payment_id)
+    except (UnicodeError, TypeError, binascii.Error) as e:
+        raise ValueError(str(e))
+
+
+def _payment_filters(args):
+    """
+    Builds the WHERE conditions shared by the listing and the export from query parameters:
+    user_id, status, currency, from (inclusive) and to (exclusive), both ISO dates or datetimes
+    on payment_date. Raises ValueError.
+    """
+    conditions = []
+    if args.get('user_id'):
+        conditions.append(Payment.user_id == args['user_id'])
+    if args.get('status'):
+        if args['status'] not in PAYMENT_STATUSES:
+            raise ValueError(f"Invalid status. Allowed statuses are: {', '.join(PAYMENT_STATUSES)}")
+        conditions.append(Payment.status == args['status'])
+    if args.get('currency'):
+        # Compared case-insensitively: payments recorded before currencies were normalized may be lower case
+        conditions.append(db.func.upper(Payment.currency) == args['currency'].upper())
+    if args.get('from'):
+        conditions.append(Payment.payment_date >= datetime.datetime.fromisoformat(args['from']))
+    if args.get('to'):
+        conditions.append(Payment.payment_date < datetime.datetime.fromisoformat(args['to']))
+    return conditions
 
 
 @app.route('/payments', methods=['GET'])
 def get_all_payments():
-    payments = Payment.query.all()
-    return jsonify([payment.to_dict() for payment in payments]), 200
+    """
+    Lists payments, newest first, one page at a time.
+    Filters (all optional): user_id, status, currency, from, to (see _payment_filters).
+    Paging: limit (default PAYMENT_PAGE_DEFAULT_LIMIT, max PAYMENT_PAGE_MAX_LIMIT) and before, the
+    cursor from the previous page's X-Next-Cursor header. Pages are keyset-paginated on
+    (payment_date, id), so deep pages cost the same as the first one.
+    """
+    try:
+        conditions = _payment_filters(request.args)
+        limit = min(int(request.args.get('limit', PAYMENT_PAGE_DEFAULT_LIMIT)), PAYMENT_PAGE_MAX_LIMIT)
+        before = _decode_cursor(request.args['before']) if request.args.get('before') else None
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+    if limit <= 0:
+        return jsonify({"error": "limit must be positive"}), 400
+
+    query = db.select(*PAYMENT_COLUMNS).where(*conditions)
+    if before is not None:
+        query = query.where(db.tuple_(Payment.payment_date, Payment.id) < before)
+    # One extra row tells us whether there is a next page
+    rows = db.session.execute(query.order_by(Payment.payment_date.desc(), Payment.id.desc()).limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    # Lean path: plain column tuples, no ORM objects or identity map
+    response = Response(dumps([encode_payment_row(row) for row in rows]), status=200, mimetype='application/json')
+    if has_more:
+        response.headers['X-Next-Cursor'] = _encode_cursor(rows[-1].payment_date, rows[-1].id)
+    return response
+
+
+@app.route('/payments/export', methods=['GET'])
+def export_payments():
+    """
+    Streams payments as NDJSON (default) or CSV (?format=csv), oldest first, with the same filters
+    as the listing. Rows are read in keyset chunks of EXPORT_CHUNK_SIZE, each its own short query,
+    so memory stays flat and no read transaction is held open for the whole export.
+    """
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({"error": "Invalid format. Allowed formats are: ndjson, csv"}), 400
+    try:
+        conditions = _payment_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+
+    def iterate_rows():
+        last = None
+        while True:
+            query = db.select(*PAYMENT_COLUMNS).where(*conditions)
+            if last is not None:
+                query = query.where(db.tuple_(Payment.payment_date, Payment.id) > last)
+            rows = db.session.execute(query.order_by(Payment.payment_date, Payment.id).limit(EXPORT_CHUNK_SIZE)).all()
+            db.session.rollback() # End the read transaction between chunks
+            yield from rows
+            if len(rows) < EXPORT_CHUNK_SIZE:
+                return
+            last = (rows[-1].payment_date, rows[-1].id)
+
+    def generate_ndjson():
+        for row in iterate_rows():
+            yield dumps(encode_payment_row(row)) + b'\n'
+
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_CSV_FIELDS)
+        writer.writeheader()
+        for row in iterate_rows():
+            writer.writerow(encode_payment_row(row))
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    if export_format == 'csv':
+        response = Response(stream_with_context(generate_csv()), mimetype='text/csv')
+        response.headers['Content-Disposition'] = 'attachment; filename=payments.csv'
+    else:
+        response = Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+    return response
 
 
 
@@ -85,17 +284,129 @@ def get_payment(payment_id):
 
 
 
+@app.route('/payments/<int:payment_id>/status', methods=['GET'])
+def get_payment_status(payment_id):
+    """
+    Cheap settlement status for polling clients. While the payment is still pending or processing,
+    a Retry-After header says when to ask again.
+    """
+    row = db.session.execute(db.select(Payment.id, Payment.status, Payment.failure_reason, Payment.settled_at)
+                             .where(Payment.id == payment_id)).first()
+    if not row:
+        return jsonify({"error": "Payment not found"}), 404
+    response = jsonify({
+        'id': row.id,
+        'status': row.status,
+        'failure_reason': row.failure_reason,
+        'settled_at': row.settled_at.isoformat() if row.settled_at else None
+    })
+    if row.status in ('pending', 'processing'):
+        response.headers['Retry-After'] = str(SETTLEMENT_POLL_AFTER_SECONDS)
+    return response, 200
+
+
+@app.cli.command('settle-payments')
+def settle_payments_command():
+    """Settles every pending payment now, one at a time (e.g. with SETTLEMENT_WORKERS=0)."""
+    settled = 0
+    while True:
+        pending = settlement_pool.find_pending(limit=100)
+        if not pending:
+            break
+        settled += sum(1 for payment_id in pending if settlement_pool.settle(payment_id))
+    print(f"Settled {settled} payment(s)")
+
+
+@app.route('/payments/reconciliation', methods=['POST'])
+def reconcile_payments():
+    """
+    Reconciles payments against a processor settlement CSV (see reconciliation.py), uploaded as the
+    multipart field 'file' or sent as a text/csv body. ?dry_run=true reports without changing anything.
+    The upload is parsed as a stream; the response has the summary counts and the first
+    RECONCILIATION_REPORT_MAX_ENTRIES mismatches (use `flask reconcile-payments` for a full report file).
+    """
+    if 'file' in request.files:
+        stream = request.files['file'].stream
+    elif request.mimetype == 'text/csv':
+        stream = request.stream
+    else:
+        return jsonify({"error": "Upload the settlement file as multipart field 'file' or as a text/csv body"}), 400
+    dry_run = request.args.get('dry_run', 'false').lower() == 'true'
+
+    mismatches = []
+    def collect(entry):
+        if len(mismatches) < RECONCILIATION_REPORT_MAX_ENTRIES:
+            mismatches.append(entry)
+
+    try:
+        # Decoded line by line: io.TextIOWrapper needs readable(), which SpooledTemporaryFile lacks before 3.11
+        summary = reconciliation.reconcile(codecs.iterdecode(stream, 'utf-8'),
+                                           RECONCILIATION_CHUNK_SIZE, dry_run, collect)
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        db.session.rollback()
+        return jsonify({"error": f"Invalid settlement file: {e}"}), 400
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error reconciling payments: {e}")
+        return jsonify({"error": "Failed to reconcile payments", "details": str(e)}), 500
+    return jsonify({"summary": summary, "mismatches": mismatches,
+                    "mismatches_truncated": len(mismatches) == RECONCILIATION_REPORT_MAX_ENTRIES}), 200
+
+
+@app.cli.command('reconcile-payments')
+@click.argument('settlement_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--report', 'report_path', type=click.Path(dir_okay=False), help='Write every mismatch to this CSV file.')
+@click.option('--dry-run', is_flag=True, help='Report without changing any payment.')
+def reconcile_payments_command(settlement_file, report_path, dry_run):
+    """Reconciles payments against a processor settlement CSV file."""
+    with open(settlement_file, newline='', encoding='utf-8') as lines:
+        if report_path:
+            with open(report_path, 'w', newline='', encoding='utf-8') as report_file:
+                writer = csv.DictWriter(report_file, fieldnames=reconciliation.REPORT_FIELDS)
+                writer.writeheader()
+                summary = reconciliation.reconcile(lines, RECONCILIATION_CHUNK_SIZE, dry_run, writer.writerow)
+        else:
+            summary = reconciliation.reconcile(lines, RECONCILIATION_CHUNK_SIZE, dry_run)
+    print(', '.join(f"{key}: {value}" for key, value in summary.items()))
+
+
 # Corrected route decorator for get_payments_by_order
 @app.route('/payments/order/<string:order_id>', methods=['GET'])
 def get_payments_by_order(order_id): # Corrected to take order_id from URL
     """
     Retrieves all payments associated with a given order_id.
     """
-    payments = Payment.query.filter_by(order_id=order_id).all()
+    # Served by the order_id index; lean path without ORM objects
+    payments = [encode_payment_row(row) for row in db.session.execute(
+        db.select(*PAYMENT_COLUMNS).where(Payment.order_id == order_id).order_by(Payment.id))]
     if not payments:
         # It's better to return 404 if no payments are found for a specific order ID
         return jsonify({"error": f"No payments found for order_id: {order_id}"}), 404
-    return jsonify([payment.to_dict() for payment in payments]), 200
+    return Response(dumps(payments), status=200, mimetype='application/json')
+
+
+@app.route('/payments/lookup', methods=['POST'])
+def lookup_payments_by_orders():
+    """
+    Batch lookup of payments for many orders (e.g. an order-history page showing payment state).
+    Expects JSON: {"order_ids": ["1", "2", ...]}. Returns {"payments": {"<order_id>": [payment, ...]}}
+    with an entry (possibly empty) for every requested order, from one IN query per 500 ids.
+    """
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get('order_ids'), list):
+        return jsonify({"error": "Expected JSON body with an 'order_ids' list"}), 400
+    order_ids = sorted({str(order_id) for order_id in data['order_ids']})
+    if len(order_ids) > LOOKUP_MAX_ORDER_IDS:
+        return jsonify({"error": f"At most {LOOKUP_MAX_ORDER_IDS} order ids can be looked up at once"}), 400
+
+    payments = {order_id: [] for order_id in order_ids}
+    for start in range(0, len(order_ids), SQL_IN_CHUNK_SIZE):
+        rows = db.session.execute(db.select(*PAYMENT_COLUMNS)
+                                  .where(Payment.order_id.in_(order_ids[start:start + SQL_IN_CHUNK_SIZE]))
+                                  .order_by(Payment.id))
+        for row in rows:
+            payments[row.order_id].append(encode_payment_row(row))
+    return Response(dumps({"payments": payments}), status=200, mimetype='application/json')
 
 
 
@@ -111,7 +422,7 @@ def update_payment_status(payment_id):
     if not new_status:
         return jsonify({"error": "Status field is required"}), 400
     
-    allowed_statuses = ['pending', 'completed', 'failed', 'refunded', 'disputed']
+    allowed_statuses = ['pending', 'processing', 'completed', 'failed', 'refunded', 'disputed']
     if new_status not in allowed_statuses:
         return jsonify({"error": f"Invalid status. Allowed statuses are: {', '.join(allowed_statuses)}"}), 400
 
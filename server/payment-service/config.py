@@ -6,3 +6,23 @@ class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'herecomesanotherdreadfulsecretkeythatidonotseemtoditch'
     CORS_ORIGINS = ["http://localhost:3000"] # Adjust if your frontend runs on a different port/domain
+
+    # Idempotency-Key handling for POST requests
+    IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL') or 24 * 3600) # seconds a stored response is replayed
+    IDEMPOTENCY_WAIT_TIMEOUT = 10 # seconds a duplicate waits for the first request to finish
+    IDEMPOTENCY_IN_PROGRESS_TIMEOUT = 60 # seconds after which an unfinished request is considered abandoned
+
+    # Asynchronous settlement (see settlement.py)
+    PAYMENT_PROCESSOR = os.environ.get('PAYMENT_PROCESSOR') or 'simulator' # or 'package.module:ClassName'
+    SETTLEMENT_WORKERS = int(os.environ.get('SETTLEMENT_WORKERS') or 4) # 0 disables the worker threads
+    SETTLEMENT_POLL_INTERVAL = 1.0 # seconds between scans for pending payments when idle
+    SETTLEMENT_LEASE_SECONDS = 60 # a payment 'processing' for longer is handed to another worker
+    SETTLEMENT_MAX_ATTEMPTS = 3 # attempts when the processor is unavailable, before failing the payment
+    # Hosts a payment's callback_url may point at (comma-separated, e.g. 'shop.example.com,order-service');
+    # empty (the default) rejects every callback_url, since webhooks are sent from inside the network
+    SETTLEMENT_CALLBACK_ALLOWED_HOSTS = [host.strip().lower() for host in
+                                         (os.environ.get('SETTLEMENT_CALLBACK_ALLOWED_HOSTS') or '').split(',')
+                                         if host.strip()]
+    SIMULATOR_LATENCY_MS = int(os.environ.get('SIMULATOR_LATENCY_MS') or 200)
+    SIMULATOR_JITTER_MS = int(os.environ.get('SIMULATOR_JITTER_MS') or 100)
+    SIMULATOR_FAILURE_RATE = float(os.environ.get('SIMULATOR_FAILURE_RATE') or 0.2)
@@ -0,0 +1,156 @@
+import time
+import json
+import hashlib
+import datetime
+import functools
+from flask import request, jsonify, make_response, current_app, Response
+from sqlalchemy.exc import IntegrityError
+from database import db
+from models import IdempotencyRecord
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+WAIT_POLL_SECONDS = 0.05
+PURGE_INTERVAL_SECONDS = 60
+# Response headers stored with the body and sent again on replay (e.g. Location is a client's polling handle)
+REPLAYED_HEADERS = ('Content-Type', 'Location', 'Retry-After')
+
+_last_purge = 0.0
+
+
+def idempotent(view):
+    """
+    Makes a POST endpoint safe to retry. When the request carries an Idempotency-Key header,
+    the first request with that key runs the view and its response is stored; later requests
+    with the same key (and the same body) get the stored response back without running the view.
+    A duplicate that arrives while the first request is still running waits for it to finish.
+    The status code, body and REPLAYED_HEADERS are stored; expired keys are treated as unused.
+    Server errors (5xx) are not stored, so the client can retry those for real.
+    Requests without the header behave exactly as before.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > 200:
+            return jsonify({"error": f"{IDEMPOTENCY_HEADER} must be at most 200 characters"}), 400
+
+        _purge_expired()
+        scoped_key = f"{request.method} {request.path} {key}"
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+
+        record, claimed = _claim(scoped_key, fingerprint)
+        if not claimed:
+            if record.request_fingerprint != fingerprint:
+                return jsonify({"error": f"{IDEMPOTENCY_HEADER} was already used with a different request body"}), 422
+            record = _wait_for_completion(scoped_key)
+            if record is None:
+                return jsonify({"error": f"A request with this {IDEMPOTENCY_HEADER} is still in progress"}), 409
+            return _replay(record)
+
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            _release(scoped_key)
+            raise
+        if response.status_code >= 500:
+            _release(scoped_key)
+        else:
+            _complete(scoped_key, response)
+        return response
+
+    return wrapper
+
+
+def _claim(scoped_key, fingerprint):
+    """
+    Inserts an in-progress record for the key. Returns (record, True) if this request owns the key,
+    or (existing record, False) if another request already claimed it.
+    In-progress records older than IDEMPOTENCY_IN_PROGRESS_TIMEOUT (a crashed request) are taken over.
+    """
+    now = datetime.datetime.now()
+    ttl = datetime.timedelta(seconds=current_app.config['IDEMPOTENCY_KEY_TTL'])
+    db.session.add(IdempotencyRecord(key=scoped_key, request_fingerprint=fingerprint, state='in_progress',
+                                     created_at=now, expires_at=now + ttl))
+    try:
+        db.session.commit()
+        return None, True
+    except IntegrityError:
+        db.session.rollback()
+
+    existing = db.session.get(IdempotencyRecord, scoped_key)
+    if existing is None: # Purged or released in the meantime: try once more
+        return _claim(scoped_key, fingerprint)
+    if existing.expires_at < now: # Expired but not purged yet: the key is free again
+        db.session.execute(db.delete(IdempotencyRecord)
+                           .where(IdempotencyRecord.key == scoped_key,
+                                  IdempotencyRecord.expires_at == existing.expires_at))
+        db.session.commit()
+        return _claim(scoped_key, fingerprint)
+
+    stale_before = now - datetime.timedelta(seconds=current_app.config['IDEMPOTENCY_IN_PROGRESS_TIMEOUT'])
+    if existing.state == 'in_progress' and existing.created_at < stale_before:
+        # Conditional UPDATE so only one of several concurrent retries takes the key over
+        result = db.session.execute(db.update(IdempotencyRecord)
+                                    .where(IdempotencyRecord.key == scoped_key,
+                                           IdempotencyRecord.created_at == existing.created_at)
+                                    .values(request_fingerprint=fingerprint, created_at=now, expires_at=now + ttl))
+        db.session.commit()
+        if result.rowcount == 1:
+            return None, True
+        db.session.expire_all()
+        existing = db.session.get(IdempotencyRecord, scoped_key)
+        if existing is None:
+            return _claim(scoped_key, fingerprint)
+    return existing, False
+
+
+def _wait_for_completion(scoped_key):
+    """Polls until the owning request stores its response. Returns the record, or None on timeout/release."""
+    deadline = time.monotonic() + current_app.config['IDEMPOTENCY_WAIT_TIMEOUT']
+    while True:
+        db.session.rollback() # End the read transaction so the next read sees new commits
+        record = db.session.get(IdempotencyRecord, scoped_key)
+        if record is None:
+            return None
+        if record.state == 'completed':
+            return record
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(WAIT_POLL_SECONDS)
+
+
+def _complete(scoped_key, response):
+    db.session.rollback() # Discard anything the view left uncommitted
+    db.session.execute(db.update(IdempotencyRecord)
+                       .where(IdempotencyRecord.key == scoped_key)
+                       .values(state='completed', status_code=response.status_code,
+                               response_body=response.get_data(as_text=True),
+                               response_headers=json.dumps([[name, value] for name, value in response.headers
+                                                            if name in REPLAYED_HEADERS])))
+    db.session.commit()
+
+
+def _release(scoped_key):
+    db.session.rollback()
+    db.session.execute(db.delete(IdempotencyRecord).where(IdempotencyRecord.key == scoped_key))
+    db.session.commit()
+
+
+def _replay(record):
+    response = Response(record.response_body, status=record.status_code, mimetype='application/json')
+    for name, value in json.loads(record.response_headers or '[]'):
+        response.headers[name] = value
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _purge_expired():
+    """Deletes expired keys, at most once every PURGE_INTERVAL_SECONDS per process."""
+    global _last_purge
+    if time.monotonic() - _last_purge < PURGE_INTERVAL_SECONDS:
+        return
+    _last_purge = time.monotonic()
+    db.session.execute(db.delete(IdempotencyRecord)
+                       .where(IdempotencyRecord.expires_at < datetime.datetime.now()))
+    db.session.commit()
@@ -3,21 +3,35 @@ import datetime
 
 class Payment(db.Model):
     __tablename__ = 'payments'
+    __table_args__ = (
+        db.Index('ix_payments_status_date', 'status', 'payment_date'), # Status listings and reconciliation
+        # Keyset pagination on (payment_date, id), overall and per customer
+        db.Index('ix_payments_date_id', 'payment_date', 'id'),
+        db.Index('ix_payments_user_date_id', 'user_id', 'payment_date', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.String(255), nullable=False) # ID from Order Service
-    user_id = db.Column(db.String(255), nullable=False)  # ID from User Service
+    order_id = db.Column(db.String(255), nullable=False, index=True) # ID from Order Service
+    user_id = db.Column(db.String(255), nullable=False, index=True)  # ID from User Service
     amount = db.Column(db.Float, nullable=False)
     currency = db.Column(db.String(10), nullable=False) # e.g., 'USD', 'EUR'
     payment_method = db.Column(db.String(50), nullable=False) # e.g., 'credit_card', 'paypal'
     transaction_id = db.Column(db.String(255), unique=True, nullable=False) # Simulated gateway transaction ID
-    status = db.Column(db.String(50), default='pending', nullable=False) # e.g., 'pending', 'completed', 'failed', 'refunded'
+    status = db.Column(db.String(50), default='pending', nullable=False) # e.g., 'pending', 'processing', 'completed', 'failed', 'refunded'
     payment_date = db.Column(db.DateTime, default=datetime.datetime.now, nullable=False)
 
+    # Asynchronous settlement (see settlement.py)
+    callback_url = db.Column(db.String(2048)) # Optional webhook notified once the payment is settled
+    failure_reason = db.Column(db.String(255))
+    settlement_attempts = db.Column(db.Integer, default=0, nullable=False)
+    settlement_started_at = db.Column(db.DateTime) # Lease of the worker settling it
+    settled_at = db.Column(db.DateTime)
+
     created_at = db.Column(db.DateTime, default=datetime.datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
 
-    def __init__(self, order_id, user_id, amount, currency, payment_method, transaction_id, status='pending'):
+    def __init__(self, order_id, user_id, amount, currency, payment_method, transaction_id, status='pending',
+                 callback_url=None):
         self.order_id = order_id
         self.user_id = user_id
         self.amount = amount
@@ -25,6 +39,7 @@ class Payment(db.Model):
         self.payment_method = payment_method
         self.transaction_id = transaction_id
         self.status = status
+        self.callback_url = callback_url
 
     def to_dict(self):
         return {
@@ -37,9 +52,48 @@ class Payment(db.Model):
             'transaction_id': self.transaction_id,
             'status': self.status,
             'payment_date': self.payment_date.isoformat() if self.payment_date else None,
+            'failure_reason': self.failure_reason,
+            'settled_at': self.settled_at.isoformat() if self.settled_at else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
     def __repr__(self):
         return f'<Payment {self.id} for Order {self.order_id} - Status: {self.status}>'
+
+
+# Columns read by the lean list path (plain tuples, no ORM objects), matching to_dict()
+PAYMENT_COLUMNS = (
+    Payment.id, Payment.order_id, Payment.user_id, Payment.amount, Payment.currency, Payment.payment_method,
+    Payment.transaction_id, Payment.status, Payment.payment_date, Payment.failure_reason, Payment.settled_at,
+    Payment.created_at, Payment.updated_at
+)
+
+
+class IdempotencyRecord(db.Model):
+    """Stored response for a POST made with an Idempotency-Key header (see idempotency.py)."""
+    __tablename__ = 'idempotency_keys'
+
+    key = db.Column(db.String(320), primary_key=True) # "<method> <path> <client key>"
+    request_fingerprint = db.Column(db.String(64), nullable=False) # sha256 of the request body
+    state = db.Column(db.String(20), nullable=False) # 'in_progress' or 'completed'
+    status_code = db.Column(db.Integer)
+    response_body = db.Column(db.Text)
+    response_headers = db.Column(db.Text) # JSON [[name, value], ...] of the REPLAYED_HEADERS that were set
+    created_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class OrderEvent(db.Model):
+    """
+    An order event received from the order service's outbox (POST /payments/events).
+    Delivery is at-least-once, so event_id is the primary key and redeliveries are dropped.
+    """
+    __tablename__ = 'order_events'
+
+    event_id = db.Column(db.String(36), primary_key=True)
+    event_type = db.Column(db.String(50), nullable=False)
+    order_id = db.Column(db.String(255), nullable=False, index=True)
+    payload = db.Column(db.Text, nullable=False) # JSON
+    created_at = db.Column(db.DateTime, nullable=False) # When the order service recorded it
+    received_at = db.Column(db.DateTime, default=datetime.datetime.now, nullable=False)
@@ -0,0 +1,101 @@
+import csv
+import datetime
+import itertools
+from database import db
+from models import Payment
+
+# Statuses a settlement file can move a payment to
+RECONCILABLE_STATUSES = ('completed', 'refunded', 'disputed')
+AMOUNT_TOLERANCE = 0.005
+
+REPORT_FIELDS = ['line', 'transaction_id', 'issue', 'payment_id', 'payment_status', 'file_status',
+                 'payment_amount', 'file_amount', 'payment_currency', 'file_currency']
+
+
+def reconcile(lines, chunk_size=1000, dry_run=False, on_mismatch=None):
+    """
+    Reconciles payments against a processor settlement file.
+    `lines` is any iterable of CSV text lines (an open file, a request stream) with a header row containing
+    at least transaction_id and status, and optionally amount and currency.
+    The file is read chunk_size lines at a time; each chunk is matched with one indexed IN query on
+    transaction_id, and its status corrections are applied with one UPDATE per target status and committed
+    (nothing is written with dry_run=True). Memory use depends on chunk_size, not on the file size.
+    on_mismatch(entry) is called for every line that needs attention (a dict with REPORT_FIELDS keys):
+      missing_payment   - no payment with that transaction_id
+      invalid_status    - the file status is not one of RECONCILABLE_STATUSES
+      amount_mismatch / currency_mismatch - reported only, never corrected
+      status_corrected  - the payment status was changed to the file status
+                          (status_would_correct with dry_run=True, when nothing is changed)
+    Returns summary counts ('would_correct' instead of 'corrected' with dry_run=True). Raises ValueError if the header is missing required columns.
+    """
+    reader = csv.DictReader(lines)
+    if not reader.fieldnames or not {'transaction_id', 'status'} <= set(reader.fieldnames):
+        raise ValueError("Settlement file must have a header with transaction_id and status columns")
+
+    corrected_key = 'would_correct' if dry_run else 'corrected'
+    corrected_issue = 'status_would_correct' if dry_run else 'status_corrected'
+    summary = {'lines': 0, 'matched': 0, corrected_key: 0, 'missing_payment': 0, 'invalid_status': 0,
+               'amount_mismatch': 0, 'currency_mismatch': 0}
+
+    def report(issue, line_number, line, payment=None):
+        summary[issue] = summary.get(issue, 0) + 1
+        if on_mismatch:
+            on_mismatch({
+                'line': line_number,
+                'transaction_id': line.get('transaction_id'),
+                'issue': issue,
+                'payment_id': payment.id if payment else None,
+                'payment_status': payment.status if payment else None,
+                'file_status': line.get('status'),
+                'payment_amount': payment.amount if payment else None,
+                'file_amount': line.get('amount'),
+                'payment_currency': payment.currency if payment else None,
+                'file_currency': line.get('currency'),
+            })
+
+    numbered = enumerate(reader, start=2) # Line 1 is the header
+    while True:
+        chunk = list(itertools.islice(numbered, chunk_size))
+        if not chunk:
+            break
+        summary['lines'] += len(chunk)
+        transaction_ids = list({(line.get('transaction_id') or '').strip() for _, line in chunk})
+        payments = {row.transaction_id: row for row in db.session.execute(
+            db.select(Payment.id, Payment.transaction_id, Payment.status, Payment.amount, Payment.currency)
+            .where(Payment.transaction_id.in_(transaction_ids)))}
+
+        corrections = {} # new status -> payment ids
+        for line_number, line in chunk:
+            payment = payments.get((line.get('transaction_id') or '').strip())
+            if payment is None:
+                report('missing_payment', line_number, line)
+                continue
+            summary['matched'] += 1
+            file_status = (line.get('status') or '').strip().lower()
+            if line.get('amount'):
+                try:
+                    if abs(float(line['amount']) - payment.amount) > AMOUNT_TOLERANCE:
+                        report('amount_mismatch', line_number, line, payment)
+                except ValueError:
+                    report('amount_mismatch', line_number, line, payment)
+            if line.get('currency') and line['currency'].strip().upper() != payment.currency.upper():
+                report('currency_mismatch', line_number, line, payment)
+            if file_status not in RECONCILABLE_STATUSES:
+                report('invalid_status', line_number, line, payment)
+            elif file_status != payment.status:
+                corrections.setdefault(file_status, []).append(payment.id)
+                report(corrected_issue, line_number, line, payment)
+
+        if corrections and not dry_run:
+            now = datetime.datetime.now()
+            for status, payment_ids in corrections.items():
+                db.session.execute(db.update(Payment)
+                                   .where(Payment.id.in_(payment_ids))
+                                   .values(status=status, updated_at=now)
+                                   .execution_options(synchronize_session=False))
+            db.session.commit()
+        else:
+            db.session.rollback() # End the chunk's read transaction
+        summary[corrected_key] += sum(len(payment_ids) for payment_ids in corrections.values())
+    summary['dry_run'] = dry_run
+    return summary
@@ -0,0 +1,36 @@
+import json
+from sqlalchemy import DateTime
+
+try:
+    import orjson # Optional: several times faster than the stdlib encoder
+except ImportError:
+    orjson = None
+
+
+def compile_row_encoder(columns):
+    """
+    Builds a function that turns a result row selected as `select(*columns)` into a JSON-ready dict,
+    keyed by column name, with DateTime values rendered like Model.to_dict() does (isoformat / None).
+    The column names and DateTime positions are worked out once here, so encoding a row is a
+    dict(zip()) plus one isoformat() per DateTime column, without attribute instrumentation.
+    """
+    keys = tuple(column.key for column in columns)
+    datetime_fields = tuple((column.key, index) for index, column in enumerate(columns)
+                            if isinstance(column.type, DateTime))
+
+    def encode(row):
+        values = dict(zip(keys, row))
+        for key, index in datetime_fields:
+            value = row[index]
+            if value is not None:
+                values[key] = value.isoformat()
+        return values
+
+    return encode
+
+
+def dumps(obj):
+    """Serializes to compact JSON bytes, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
@@ -0,0 +1,221 @@
+import time
+import queue
+import random
+import datetime
+import importlib
+import threading
+import requests
+from urllib.parse import urlsplit
+from database import db
+from models import Payment
+
+
+class ProcessorUnavailable(Exception):
+    """Raised by a processor for transient errors: the payment is retried instead of failed."""
+
+
+class SimulatedProcessor:
+    """
+    Local stand-in for a payment processor. Every charge takes latency_ms (+/- jitter_ms) and is
+    declined with probability failure_rate. A real processor only needs the same charge() method.
+    """
+
+    def __init__(self, latency_ms=200, jitter_ms=100, failure_rate=0.2):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self._random = random.Random()
+
+    def charge(self, payment):
+        """
+        Charges a payment dict (Payment.to_dict()). Returns (status, failure_reason) with status
+        'completed' or 'failed'. payment['transaction_id'] is the idempotency key to pass to a real
+        processor, since a payment whose worker died mid-charge is charged again.
+        """
+        delay_ms = self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)
+        time.sleep(max(delay_ms, 0) / 1000)
+        if self._random.random() < self.failure_rate:
+            return 'failed', 'Declined by processor (simulated)'
+        return 'completed', None
+
+
+def callback_allowed(url, allowed_hosts):
+    """
+    True if url is an http(s) URL whose host is in allowed_hosts (SETTLEMENT_CALLBACK_ALLOWED_HOSTS).
+    Webhooks are sent from inside the network, so arbitrary hosts would let a client reach internal
+    services or cloud metadata endpoints.
+    """
+    if not isinstance(url, str):
+        return False
+    try:
+        parts = urlsplit(url)
+        host = parts.hostname
+        parts.port # Raises ValueError for a malformed port
+    except ValueError:
+        return False
+    return parts.scheme in ('http', 'https') and host is not None and host.lower() in allowed_hosts
+
+
+def load_processor(config):
+    """
+    Builds the processor named by PAYMENT_PROCESSOR: 'simulator', or 'package.module:ClassName' for
+    a real integration (constructed without arguments).
+    """
+    name = config['PAYMENT_PROCESSOR']
+    if name == 'simulator':
+        return SimulatedProcessor(config['SIMULATOR_LATENCY_MS'], config['SIMULATOR_JITTER_MS'],
+                                  config['SIMULATOR_FAILURE_RATE'])
+    module_name, _, class_name = name.partition(':')
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+class SettlementWorkerPool:
+    """
+    Settles pending payments in background worker threads, so POST /payments never waits for the processor.
+    New payment ids are handed to the workers through an in-process queue; idle workers also scan the
+    database every poll_interval seconds, which picks up payments from other processes and payments
+    whose worker died (their 'processing' lease is older than lease_seconds).
+    A payment is claimed with a conditional UPDATE (pending -> processing), so each is charged by one worker.
+    The result is written only while that claim still holds (same status and settlement_started_at), so a
+    worker whose charge outlived its lease cannot overwrite the outcome of the worker that took over.
+    Once settled, the payment's callback_url (if any, and only if its host is in callback_allowed_hosts)
+    receives the payment as JSON, from a separate webhook thread so retries never hold up settlement.
+    """
+
+    def __init__(self, app, processor, workers=4, poll_interval=1.0, lease_seconds=60, max_attempts=3,
+                 callback_timeout=3, callback_attempts=3, callback_allowed_hosts=()):
+        self.app = app
+        self.processor = processor
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.callback_timeout = callback_timeout
+        self.callback_attempts = callback_attempts
+        self.callback_allowed_hosts = frozenset(host.lower() for host in callback_allowed_hosts)
+        self._queue = queue.Queue()
+        self._webhooks = queue.Queue()
+        self._webhook_thread = None
+        self._http = requests.Session()
+
+    def start(self):
+        for index in range(self.workers):
+            threading.Thread(target=self._run, name=f'settlement-worker-{index}', daemon=True).start()
+        self._webhook_thread = threading.Thread(target=self._run_webhooks, name='settlement-webhooks', daemon=True)
+        self._webhook_thread.start()
+
+    def submit(self, payment_id):
+        """Hands a newly created payment to the workers (called after its row is committed)."""
+        self._queue.put(payment_id)
+
+    def _run(self):
+        while True:
+            try:
+                payment_id = self._queue.get(timeout=self.poll_interval)
+            except queue.Empty:
+                payment_id = None
+            try:
+                with self.app.app_context():
+                    if payment_id is not None:
+                        self.settle(payment_id)
+                    else:
+                        for pending_id in self.find_pending(limit=self.workers * 4):
+                            self._queue.put(pending_id)
+            except Exception as e:
+                self.app.logger.error(f"Settlement worker failed: {e}")
+
+    def find_pending(self, limit):
+        """
+        Releases expired leases and returns the ids of the oldest pending payments.
+        Reads first and only writes when a lease has actually expired, so idle workers polling an
+        idle database never take its write lock.
+        """
+        expired_before = datetime.datetime.now() - datetime.timedelta(seconds=self.lease_seconds)
+        expired = db.session.scalars(db.select(Payment.id)
+                                     .where(Payment.status == 'processing',
+                                            Payment.settlement_started_at < expired_before)).all()
+        if expired:
+            # Same conditions again, so a payment settled since the read keeps its status
+            db.session.execute(db.update(Payment)
+                               .where(Payment.id.in_(expired), Payment.status == 'processing',
+                                      Payment.settlement_started_at < expired_before)
+                               .values(status='pending')
+                               .execution_options(synchronize_session=False))
+            db.session.commit()
+        pending = db.session.scalars(db.select(Payment.id).where(Payment.status == 'pending')
+                                     .order_by(Payment.id).limit(limit)).all()
+        db.session.rollback() # End the read transaction
+        return pending
+
+    def settle(self, payment_id):
+        """
+        Claims and settles one payment. Returns False if it was not pending (e.g. another worker took it)
+        or its lease expired during the charge and another worker claimed it again.
+        """
+        now = datetime.datetime.now()
+        claimed = db.session.execute(db.update(Payment)
+                                     .where(Payment.id == payment_id, Payment.status == 'pending')
+                                     .values(status='processing', settlement_started_at=now,
+                                             settlement_attempts=Payment.settlement_attempts + 1)
+                                     .execution_options(synchronize_session=False))
+        db.session.commit()
+        if claimed.rowcount != 1:
+            return False
+
+        payment = db.session.get(Payment, payment_id)
+        try:
+            status, failure_reason = self.processor.charge(payment.to_dict())
+        except Exception as e:
+            if isinstance(e, ProcessorUnavailable) and payment.settlement_attempts < self.max_attempts:
+                # Picked up again by the next scan
+                self._finish(payment_id, now, status='pending')
+                return True
+            status, failure_reason = 'failed', str(e)[:255]
+
+        settled_at = datetime.datetime.now()
+        if not self._finish(payment_id, now, status=status, failure_reason=failure_reason,
+                            settled_at=settled_at, updated_at=settled_at):
+            self.app.logger.warning(f"Payment {payment_id} result '{status}' dropped: its settlement lease "
+                                    f"expired during the charge and the payment was claimed again")
+            return False
+        payment = db.session.get(Payment, payment_id)
+        if payment.callback_url:
+            if self._webhook_thread is not None:
+                self._webhooks.put((payment.callback_url, payment.to_dict()))
+            else: # Not started (e.g. the settle-payments command): deliver inline
+                self._notify(payment.callback_url, payment.to_dict())
+        return True
+
+    def _finish(self, payment_id, claimed_at, **values):
+        """Writes values if the claim made at claimed_at still holds. Returns False if it was lost."""
+        result = db.session.execute(db.update(Payment)
+                                    .where(Payment.id == payment_id, Payment.status == 'processing',
+                                           Payment.settlement_started_at == claimed_at)
+                                    .values(**values)
+                                    .execution_options(synchronize_session=False))
+        db.session.commit()
+        return result.rowcount == 1
+
+    def _run_webhooks(self):
+        while True:
+            url, payment = self._webhooks.get()
+            try:
+                self._notify(url, payment)
+            except Exception as e:
+                self.app.logger.error(f"Payment {payment['id']} webhook failed: {e}")
+
+    def _notify(self, url, payment):
+        """POSTs the settled payment to its webhook, retrying with backoff; polling remains the fallback."""
+        if not callback_allowed(url, self.callback_allowed_hosts): # e.g. stored before the allow-list changed
+            self.app.logger.warning(f"Payment {payment['id']} webhook to {url} skipped: host is not allowed")
+            return
+        for attempt in range(self.callback_attempts):
+            try:
+                # Redirects are not followed: they could lead to a host outside the allow-list
+                resp = self._http.post(url, json=payment, timeout=self.callback_timeout, allow_redirects=False)
+                if resp.status_code < 500:
+                    return
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(2 ** attempt)
+        self.app.logger.warning(f"Payment {payment['id']} webhook to {url} failed after {self.callback_attempts} attempt(s)")
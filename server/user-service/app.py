@@ -1,14 +1,20 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response
 from flask_cors import CORS
-from models import User, db # Import User model and db instance
+from models import User, db, USER_COLUMNS # Import User model and db instance
 from database import init_db # Import init_db function
 from config import Config # Import configuration
 import string
 import random
+import secrets
 import os
-from werkzeug.utils import secure_filename
-import uuid
+import io
+import re
+import multiprocessing
+from sqlalchemy.exc import IntegrityError
 from PIL import Image # For image processing
+from media_store import MediaStore
+from password_hasher import PasswordHasher, HasherBusy
+from row_encoder import compile_row_encoder, dumps
 # Corrected Import: For password reset tokens and verification
 from itsdangerous import URLSafeTimedSerializer as Serializer, SignatureExpired, BadTimeSignature 
 import datetime # For timestamps
@@ -19,11 +25,36 @@ init_db(app)
 
 # Constants for file uploads and image processing
 ALLOWED_ROLES = ['admin', 'store', 'sales', 'customer']
+BULK_USER_ROLES = ['store', 'sales'] # Roles that may be provisioned in bulk
+BULK_USER_MAX_ROWS = 5000
+BULK_USER_INSERT_BATCH_SIZE = 500 # Rows per INSERT transaction
+SQL_IN_CHUNK_SIZE = 500
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 UPLOAD_FOLDER = Config.UPLOAD_FOLDER
 os.makedirs(UPLOAD_FOLDER, exist_ok=True) # Ensure upload directory exists
 
 TARGET_PROFILE_PIC_SIZE = (200, 200) # Max width, max height
+MAX_IMAGE_PIXELS = Config.MAX_IMAGE_PIXELS
+IMAGE_REDUCING_GAP = 2.0 # Final LANCZOS pass only ever shrinks by at most this factor
+IMAGE_FORMAT_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif'} # Decoded format -> stored extension
+PROFILE_PIC_URL_PREFIX = '/static/profile_pics/'
+
+# Stored pictures are named after the SHA-256 of the uploaded bytes, so a name never changes content
+CONTENT_HASHED_NAME = re.compile(r'^([0-9a-f]{64})\.')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Let Pillow's own decompression-bomb guard agree with our limit
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# Password hashing/verification runs in worker processes; User.set_password/check_password use it
+password_hasher = PasswordHasher(Config.PASSWORD_HASH_METHOD, Config.PASSWORD_SALT_LENGTH,
+                                 Config.PASSWORD_HASH_WORKERS, Config.PASSWORD_HASH_MAX_PENDING,
+                                 Config.PASSWORD_HASH_TIMEOUT)
+app.extensions['password_hasher'] = password_hasher
+PASSWORD_HASH_RETRY_AFTER = 1 # Seconds, sent with 503 when the hashing queue is full
+
+# Content-addressed picture storage; orphaned files are removed by the background sweeper
+media_store = MediaStore(UPLOAD_FOLDER, IMAGE_FORMAT_EXTENSIONS.values(), Config.MEDIA_SWEEP_GRACE_SECONDS)
 
 def allowed_file(filename):
     """Checks if a file's extension is allowed."""
@@ -32,20 +63,67 @@ def allowed_file(filename):
 
 
 
-def process_profile_picture(filepath):
+def process_profile_picture(file):
     """
-    Resizes an image saved at filepath to TARGET_PROFILE_PIC_SIZE.
-    Saves the resized image, overwriting the original.
-    Returns the original filepath (as the file is processed in place).
+    Decodes an uploaded profile picture directly from the upload stream, shrinks it to fit
+    TARGET_PROFILE_PIC_SIZE and stores it in the media store under the SHA-256 of the
+    uploaded bytes. An upload that is already stored is not decoded again.
+    Rejects images whose header declares more than MAX_IMAGE_PIXELS before decoding,
+    and decodes JPEGs at a reduced scale instead of at full resolution.
+    Raises ValueError if the upload is not a readable, supported image or is too large.
+    Returns the URL path of the stored picture.
     """
+    digest = media_store.digest(file.stream)
+    existing = media_store.find(digest)
+    if existing:
+        return PROFILE_PIC_URL_PREFIX + existing
+
     try:
-        img = Image.open(filepath)
-        img.thumbnail(TARGET_PROFILE_PIC_SIZE, Image.Resampling.LANCZOS) 
-        img.save(filepath) 
-        return filepath
-    except Exception as e:
-        app.logger.error(f"Error processing image {filepath}: {e}")
-        return filepath # Return original path, indicating processing failed.
+        img = Image.open(file.stream)
+    except (Image.UnidentifiedImageError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Invalid or oversized image: {e}")
+
+    with img:
+        image_format = img.format
+        if image_format not in IMAGE_FORMAT_EXTENSIONS:
+            raise ValueError(f"Unsupported image format: {image_format}")
+
+        width, height = img.size # Header only, nothing decoded yet
+        if width * height > MAX_IMAGE_PIXELS:
+            raise ValueError(f"Image is too large ({width}x{height}), limit is {MAX_IMAGE_PIXELS} pixels")
+
+        # JPEG only: decode at 1/2, 1/4 or 1/8 scale, keeping headroom for the final resample
+        img.draft(img.mode, (int(TARGET_PROFILE_PIC_SIZE[0] * IMAGE_REDUCING_GAP),
+                             int(TARGET_PROFILE_PIC_SIZE[1] * IMAGE_REDUCING_GAP)))
+        try:
+            img.thumbnail(TARGET_PROFILE_PIC_SIZE, Image.Resampling.LANCZOS, reducing_gap=IMAGE_REDUCING_GAP)
+            buffer = io.BytesIO()
+            img.save(buffer, image_format)
+        except (OSError, SyntaxError) as e: # Truncated or corrupt image data
+            raise ValueError(f"Invalid image data: {e}")
+
+    filename = media_store.put(digest, IMAGE_FORMAT_EXTENSIONS[image_format], buffer.getvalue())
+    return PROFILE_PIC_URL_PREFIX + filename
+
+
+def profile_pic_reference_counts():
+    """Returns stored picture filename -> number of users using it (for the media sweeper)."""
+    rows = db.session.query(User.profile_pic, db.func.count(User.id)) \
+        .filter(User.profile_pic.startswith(PROFILE_PIC_URL_PREFIX)) \
+        .group_by(User.profile_pic).all()
+    return {profile_pic[len(PROFILE_PIC_URL_PREFIX):]: count for profile_pic, count in rows}
+
+
+# Password hashing workers re-import this module when the app is run with `python app.py`; they must not sweep
+if Config.MEDIA_SWEEP_INTERVAL > 0 and multiprocessing.parent_process() is None:
+    media_store.start_sweeper(app, profile_pic_reference_counts, Config.MEDIA_SWEEP_INTERVAL)
+
+
+@app.cli.command('sweep-media')
+def sweep_media_command():
+    """Removes stored profile pictures that no user references any more."""
+    removed = media_store.sweep(profile_pic_reference_counts())
+    print(f"Removed {len(removed)} orphaned profile picture(s)")
     
 
 
@@ -56,9 +134,24 @@ def generate_random_password(length=12):
     return password 
 
 
+def generate_provisioning_password():
+    """Password for a bulk-provisioned account without one; returned once, so it comes from secrets."""
+    return secrets.token_urlsafe(12)
+
+
 CORS(app, resources={r"/*": {"origins": Config.CORS_ORIGINS}})
 
 
+@app.errorhandler(HasherBusy)
+def password_hasher_busy(e):
+    """Sheds load when the password hashing queue is full instead of queueing without bound."""
+    response = jsonify({"error": "Server is busy, please retry", "details": str(e)})
+    response.headers['Retry-After'] = str(PASSWORD_HASH_RETRY_AFTER)
+    return response, 503
+
+encode_user_row = compile_row_encoder(USER_COLUMNS)
+
+
 @app.route('/')
 def home():
     """Root endpoint for the User Service."""
@@ -95,13 +188,10 @@ def create_user():
     if 'profile_pic' in request.files and request.files['profile_pic'].filename != '':
         file = request.files['profile_pic']
         if file and allowed_file(file.filename):
-            filename_orig = secure_filename(file.filename)
-            unique_filename = str(uuid.uuid4()) + '_' + filename_orig
-            file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
             try:
-                file.save(file_path)
-                processed_file_path = process_profile_picture(file_path)
-                profile_pic_path = f"/static/profile_pics/{os.path.basename(processed_file_path)}"
+                profile_pic_path = process_profile_picture(file)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
             except Exception as e:
                 app.logger.error(f"Error during profile picture save/process for create_user: {e}")
                 return jsonify({"error": "Failed to save or process profile picture"}), 500
@@ -137,6 +227,9 @@ def create_user():
             user_dict['generated_password'] = password
 
         return jsonify(user_dict), 201
+    except HasherBusy:
+        db.session.rollback()
+        raise
     except Exception as e:
         db.session.rollback()
         app.logger.error(f"Error creating user: {e}")
@@ -144,14 +237,132 @@ def create_user():
     
 
     
+def _chunks(values, size=SQL_IN_CHUNK_SIZE):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _existing_values(column, values):
+    """Returns the subset of values already present in column, with one IN query per chunk."""
+    existing = set()
+    for chunk in _chunks(list(values)):
+        existing.update(db.session.scalars(db.select(column).where(column.in_(chunk))))
+    return existing
+
+
+@app.route('/users/bulk', methods=['POST'])
+def bulk_create_users():
+    """
+    Provisions many store/sales accounts in one request, e.g. when onboarding a corporate customer.
+    Body: {"users": [{"username": ..., "email": ..., "password"?, "first_name"?, "last_name"?, "role"?}, ...]}
+    role defaults to 'sales'; a random password is generated for rows without one.
+    Usernames and emails are checked for the whole batch with chunked IN queries, passwords are hashed
+    across the password hasher's worker processes, and rows are inserted BULK_USER_INSERT_BATCH_SIZE
+    per transaction.
+    Each row gets a result, in request order: 'created' (with the user and any generated_password),
+    'invalid', 'duplicate' (repeats an earlier row of the request), 'username_exists' or 'email_exists'.
+    """
+    data = request.get_json(silent=True)
+    rows = data.get('users') if isinstance(data, dict) else None
+    if not isinstance(rows, list) or not rows:
+        return jsonify({"error": "'users' must be a non-empty list"}), 400
+    if len(rows) > BULK_USER_MAX_ROWS:
+        return jsonify({"error": f"At most {BULK_USER_MAX_ROWS} users can be created per request"}), 400
+
+    results = [None] * len(rows)
+    pending = [] # indexes of rows still to be created
+    seen_usernames, seen_emails = set(), set()
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict) or not row.get('username') or not row.get('email'):
+            results[index] = {'index': index, 'status': 'invalid', 'error': "Missing username or email"}
+        elif not isinstance(row['username'], str) or not isinstance(row['email'], str):
+            results[index] = {'index': index, 'status': 'invalid', 'error': "username and email must be strings"}
+        elif row.get('password') is not None and (not isinstance(row['password'], str) or not row['password']):
+            results[index] = {'index': index, 'status': 'invalid', 'error': "password must be a non-empty string"}
+        elif any(row.get(field) is not None and not isinstance(row[field], str) for field in ('first_name', 'last_name')):
+            results[index] = {'index': index, 'status': 'invalid', 'error': "first_name and last_name must be strings"}
+        elif row.get('role', 'sales') not in BULK_USER_ROLES:
+            results[index] = {'index': index, 'status': 'invalid',
+                              'error': f"Invalid role. Allowed roles are: {', '.join(BULK_USER_ROLES)}"}
+        elif row['username'] in seen_usernames or row['email'] in seen_emails:
+            results[index] = {'index': index, 'status': 'duplicate'}
+        else:
+            seen_usernames.add(row['username'])
+            seen_emails.add(row['email'])
+            pending.append(index)
+
+    def drop_existing(indexes):
+        """Marks rows whose username or email is already taken and returns the remaining indexes."""
+        taken_usernames = _existing_values(User.username, [rows[i]['username'] for i in indexes])
+        taken_emails = _existing_values(User.email, [rows[i]['email'] for i in indexes])
+        remaining = []
+        for index in indexes:
+            if rows[index]['username'] in taken_usernames:
+                results[index] = {'index': index, 'status': 'username_exists'}
+            elif rows[index]['email'] in taken_emails:
+                results[index] = {'index': index, 'status': 'email_exists'}
+            else:
+                remaining.append(index)
+        return remaining
+
+    pending = drop_existing(pending)
+    db.session.rollback() # Don't hold the read transaction open while hashing
+
+    generated = {index: generate_provisioning_password() for index in pending if not rows[index].get('password')}
+    hashes = dict(zip(pending, password_hasher.hash_many(
+        [generated.get(index) or rows[index]['password'] for index in pending])))
+
+    for batch in _chunks(pending, BULK_USER_INSERT_BATCH_SIZE):
+        for attempt in range(2):
+            now = datetime.datetime.now()
+            values = [{
+                'username': rows[index]['username'],
+                'email': rows[index]['email'],
+                'password_hash': hashes[index],
+                'first_name': rows[index].get('first_name'),
+                'last_name': rows[index].get('last_name'),
+                'role': rows[index].get('role', 'sales'),
+                'created_at': now,
+                'updated_at': now,
+            } for index in batch]
+            try:
+                created = db.session.execute(
+                    db.insert(User).returning(*USER_COLUMNS, sort_by_parameter_order=True), values).all()
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                if isinstance(e, IntegrityError) and attempt == 0:
+                    # Someone registered one of these names since the check: drop those rows and retry once
+                    batch = drop_existing(batch)
+                    db.session.rollback()
+                    if batch:
+                        continue
+                    break
+                app.logger.error(f"Error bulk creating users: {e}")
+                return jsonify({"error": "Failed to create users", "details": str(e),
+                                "created": sum(1 for result in results if result and result['status'] == 'created'),
+                                "results": [result for result in results if result]}), 500
+            for index, user_row in zip(batch, created):
+                results[index] = {'index': index, 'status': 'created', 'user': encode_user_row(user_row)}
+                if index in generated:
+                    results[index]['generated_password'] = generated[index]
+            break
+
+    return jsonify({
+        "created": sum(1 for result in results if result['status'] == 'created'),
+        "results": results
+    }), 200
+
+
 @app.route('/users', methods=['GET'])
 def get_all_users():
     """
     Retrieves all users.
+    Reads plain column tuples (no ORM objects, no identity map) and encodes them directly.
     Returns: JSON list of all users (excluding password_hash).
     """
-    users = User.query.all()
-    return jsonify([user.to_dict() for user in users]), 200
+    rows = db.session.execute(db.select(*USER_COLUMNS).order_by(User.id))
+    return Response(dumps([encode_user_row(row) for row in rows]), status=200, mimetype='application/json')
 
 
 @app.route('/users/<int:user_id>', methods=['GET'])
@@ -204,21 +415,15 @@ def update_user(user_id):
                 return jsonify({"error": f"Invalid role. Allowed roles are: {', '.join(ALLOWED_ROLES)}"}), 400
             user.role = new_role
 
+        # A replaced picture is left to the media sweeper
         if 'profile_pic' in request.files and request.files['profile_pic'].filename != '':
             file = request.files['profile_pic']
             if file and allowed_file(file.filename):
-                filename_orig = secure_filename(file.filename)
-                unique_filename = str(uuid.uuid4()) + '_' + filename_orig
-                file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
                 try:
-                    # Delete old profile picture if it exists
-                    if user.profile_pic and \
-                       os.path.exists(os.path.join(app.root_path, user.profile_pic.lstrip('/'))):
-                        os.remove(os.path.join(app.root_path, user.profile_pic.lstrip('/')))
-
-                    file.save(file_path)
-                    processed_file_path = process_profile_picture(file_path)
-                    user.profile_pic = f"/static/profile_pics/{os.path.basename(processed_file_path)}"
+                    user.profile_pic = process_profile_picture(file)
+                except ValueError as e:
+                    db.session.rollback()
+                    return jsonify({"error": str(e)}), 400
                 except Exception as e:
                     app.logger.error(f"Error during profile picture save/process for update_user: {e}")
                     return jsonify({"error": "Failed to save or process profile picture"}), 500
@@ -265,6 +470,9 @@ def change_user_password(user_id):
         user.updated_at = datetime.datetime.now() # Update timestamp
         db.session.commit()
         return jsonify({"message": "Password updated successfully"}), 200
+    except HasherBusy:
+        db.session.rollback()
+        raise
     except Exception as e:
         db.session.rollback()
         app.logger.error(f"Error changing password for user {user_id}: {e}")
@@ -282,11 +490,8 @@ def delete_user(user_id):
         return jsonify({"error": "User not found"}), 404
 
     try:
-        # Delete associated profile picture file if it exists
-        if user.profile_pic and \
-           os.path.exists(os.path.join(app.root_path, user.profile_pic.lstrip('/'))):
-            os.remove(os.path.join(app.root_path, user.profile_pic.lstrip('/')))
-
+        # The profile picture file is shared by content, so it is removed by the media sweeper
+        # once no user references it any more
         db.session.delete(user)
         db.session.commit()
         return jsonify({"message": f"User {user_id} deleted successfully"}), 200
@@ -314,6 +519,14 @@ def login_user_service():
     user = User.query.filter((User.username == username_or_email) | (User.email == username_or_email)).first()
 
     if user and user.check_password(password):
+        try:
+            if user.password_needs_rehash():
+                # Hash parameters changed since this hash was made: upgrade it while we have the password
+                user.set_password(password)
+                db.session.commit()
+        except Exception as e: # The login itself already succeeded
+            db.session.rollback()
+            app.logger.error(f"Error upgrading password hash for user {user.id}: {e}")
         # Return user data (excluding password hash)
         return jsonify(user.to_dict()), 200
     else:
@@ -374,6 +587,9 @@ def reset_password_with_token():
         user.updated_at = datetime.datetime.now() # Update timestamp
         db.session.commit()
         return jsonify({"message": "Password has been reset successfully."}), 200
+    except HasherBusy:
+        db.session.rollback()
+        raise
     except Exception as e:
         db.session.rollback()
         app.logger.error(f"Error resetting password for user {user.id}: {e}")
@@ -413,8 +629,31 @@ def verify_user_email(user_id):
 
 @app.route('/static/profile_pics/<filename>')
 def serve_profile_pic(filename):
-    """Serves static profile picture files."""
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    """
+    Serves static profile picture files.
+    Content-hashed pictures get a strong ETag equal to their name and an immutable one-year
+    max-age; Range and If-None-Match/If-Modified-Since 304s are handled by send_from_directory.
+    With STATIC_FILE_OFFLOAD = 'x-accel' the body is left to nginx via X-Accel-Redirect;
+    with 'sendfile' Flask's USE_X_SENDFILE hands the path to the front server instead.
+    """
+    content_hashed = CONTENT_HASHED_NAME.match(filename) is not None
+    if Config.STATIC_FILE_OFFLOAD == 'x-accel':
+        if not os.path.isfile(os.path.join(UPLOAD_FOLDER, filename)):
+            return jsonify({"error": "Profile picture not found"}), 404
+        response = Response(status=200)
+        response.headers['X-Accel-Redirect'] = f"{Config.STATIC_FILE_OFFLOAD_PREFIX}/profile_pics/{filename}"
+        del response.headers['Content-Type'] # Let nginx pick it from the file extension
+        if content_hashed:
+            response.set_etag(filename)
+            response.make_conditional(request)
+    else:
+        response = send_from_directory(UPLOAD_FOLDER, filename, etag=filename if content_hashed else True,
+                                       max_age=IMMUTABLE_MAX_AGE if content_hashed else None)
+    if content_hashed:
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    return response
 
 
 
@@ -17,5 +17,30 @@ class Config:
     # Expiry time for email verification tokens (e.g., 24 hours = 86400 seconds)
     EMAIL_VERIFICATION_TOKEN_EXPIRATION = 86400
 
+    # Password hashing, passed to werkzeug's generate_password_hash, e.g. 'scrypt:32768:8:1' or
+    # 'pbkdf2:sha256:600000'. Stored hashes made with other parameters are upgraded on the next login.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'scrypt:32768:8:1'
+    PASSWORD_SALT_LENGTH = int(os.environ.get('PASSWORD_SALT_LENGTH') or 16)
+    # Worker processes that hash and verify passwords off the request threads (0 hashes inline)
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS') or 2)
+    # Jobs allowed to be queued or running at once; beyond that requests get 503 instead of piling up
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING') or 64)
+    PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT') or 10)
+
     # Upload folder for profile pictures
-    UPLOAD_FOLDER = os.path.join(BASEDIR, 'static', 'profile_pics')
\ No newline at end of file
+    UPLOAD_FOLDER = os.path.join(BASEDIR, 'static', 'profile_pics')
+
+    # Uploads whose header declares more pixels than this are rejected before any decoding
+    MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS') or 50_000_000)
+
+    # Hand image bodies to the front web server instead of streaming them from Python:
+    # '' (serve directly), 'x-accel' (nginx X-Accel-Redirect) or 'sendfile' (X-Sendfile)
+    STATIC_FILE_OFFLOAD = os.environ.get('STATIC_FILE_OFFLOAD', '')
+    # nginx `internal` location mapped onto the static folder, used in x-accel mode
+    STATIC_FILE_OFFLOAD_PREFIX = os.environ.get('STATIC_FILE_OFFLOAD_PREFIX', '/protected')
+    USE_X_SENDFILE = STATIC_FILE_OFFLOAD == 'sendfile'
+
+    # Background removal of profile pictures no user references (0 disables the sweeper)
+    MEDIA_SWEEP_INTERVAL = int(os.environ.get('MEDIA_SWEEP_INTERVAL') or 3600)
+    # Unreferenced files younger than this are kept, so in-flight uploads can still claim them
+    MEDIA_SWEEP_GRACE_SECONDS = int(os.environ.get('MEDIA_SWEEP_GRACE_SECONDS') or 3600)
@@ -11,7 +11,7 @@ class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False) # Store hashed password
+    password_hash = db.Column(db.String(255), nullable=False) # Store hashed password (scrypt hashes exceed 128 chars)
 
     first_name = db.Column(db.String(80), nullable=True)
     last_name = db.Column(db.String(80), nullable=True)
@@ -33,13 +33,22 @@ class User(db.Model):
         # is_verified defaults to False
 
     def set_password(self, password):
-        """Hashes the password and stores it."""
-        self.password_hash = generate_password_hash(password)
+        """Hashes the password (in the app's password hasher pool, when registered) and stores it."""
+        hasher = current_app.extensions.get('password_hasher')
+        self.password_hash = hasher.hash(password) if hasher else generate_password_hash(password)
 
     def check_password(self, password):
         """Checks if the provided password matches the stored hash."""
+        hasher = current_app.extensions.get('password_hasher')
+        if hasher:
+            return hasher.verify(self.password_hash, password)
         return check_password_hash(self.password_hash, password)
 
+    def password_needs_rehash(self):
+        """True if the stored hash was made with other parameters than the configured ones."""
+        hasher = current_app.extensions.get('password_hasher')
+        return bool(hasher) and hasher.needs_rehash(self.password_hash)
+
     def get_reset_token(self, expires_sec=1800):
         """
         Generates a URL-safe, time-limited token for password reset.
@@ -81,4 +90,12 @@ class User(db.Model):
         }
 
     def __repr__(self):
-        return f'<User {self.username}>'
\ No newline at end of file
+        return f'<User {self.username}>'
+
+
+# Columns read by the lean list path (plain tuples, no ORM objects), matching to_dict()
+# (password_hash is deliberately not selected)
+USER_COLUMNS = (
+    User.id, User.username, User.email, User.first_name, User.last_name, User.role, User.profile_pic,
+    User.is_verified, User.created_at, User.updated_at
+)
@@ -0,0 +1,132 @@
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import generate_password_hash, check_password_hash
+
+BATCH_HASH_SIZE = 8 # Passwords per worker job in hash_many(), so a login never waits behind a long job
+
+
+def _hash_batch(passwords, method, salt_length):
+    return [generate_password_hash(password, method, salt_length) for password in passwords]
+
+
+class HasherBusy(Exception):
+    """Raised when too many hash/verify jobs are already queued, or a job did not finish in time."""
+
+
+class PasswordHasher:
+    """
+    Runs werkzeug's password hashing and verification in a pool of worker processes, so a burst
+    of logins burns CPU outside the request threads instead of holding the GIL and stalling every
+    other route. At most max_pending jobs may be queued or running at once; beyond that, hash()
+    and verify() raise HasherBusy straight away rather than letting requests pile up.
+    With workers=0 everything runs inline on the calling thread.
+    method and salt_length are passed to generate_password_hash; needs_rehash() tells whether a
+    stored hash was made with different parameters.
+    """
+
+    def __init__(self, method, salt_length=16, workers=2, max_pending=64, timeout_seconds=10):
+        self.method = method
+        self.salt_length = salt_length
+        self.workers = workers
+        self.timeout_seconds = timeout_seconds
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._method_prefix = None
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def hash_many(self, passwords):
+        """
+        Hashes a batch of passwords across the worker processes, in input order.
+        Keeps at most one small job per worker in flight, waiting for queue slots instead of
+        failing, so a large batch shares the pool with logins rather than filling the queue.
+        """
+        passwords = list(passwords)
+        batches = [passwords[i:i + BATCH_HASH_SIZE] for i in range(0, len(passwords), BATCH_HASH_SIZE)]
+        if self.workers <= 0:
+            return [pwhash for batch in batches for pwhash in _hash_batch(batch, self.method, self.salt_length)]
+
+        hashes = []
+        in_flight = [] # futures in batch order
+        try:
+            for batch in batches:
+                if len(in_flight) >= self.workers:
+                    hashes.extend(self._collect(in_flight.pop(0)))
+                if not self._slots.acquire(timeout=self.timeout_seconds):
+                    raise HasherBusy("Password hashing queue stayed full")
+                in_flight.append(self._submit(_hash_batch, batch, self.method, self.salt_length))
+            while in_flight:
+                hashes.extend(self._collect(in_flight.pop(0)))
+        finally:
+            for future in in_flight: # Only left over after an error; their slots free up once they end
+                future.cancel()
+        return hashes
+
+    def _collect(self, future):
+        """Waits for a hash_many() job."""
+        try:
+            return future.result(timeout=self.timeout_seconds * BATCH_HASH_SIZE)
+        except FutureTimeoutError:
+            future.cancel()
+            raise HasherBusy("Password hashing timed out")
+        except BrokenProcessPool:
+            self._reset_pool()
+            raise
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True if pwhash was not made with the configured method, method parameters and salt length."""
+        if self._method_prefix is None:
+            # werkzeug fills in defaults (e.g. 'scrypt' -> 'scrypt:32768:8:1'), so read the stored form back
+            self._method_prefix = self.hash('').split('$', 1)[0]
+        method, salt = (pwhash.split('$') + ['', ''])[:2] # "method$salt$hash"
+        return method != self._method_prefix or len(salt) != self.salt_length
+
+    def _run(self, func, *args):
+        if self.workers <= 0:
+            return func(*args)
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy("Too many password hashing jobs queued")
+        future = self._submit(func, *args)
+        try:
+            return future.result(timeout=self.timeout_seconds)
+        except FutureTimeoutError:
+            # The slot stays taken until the job really ends, so max_pending keeps bounding the pool's queue
+            future.cancel()
+            raise HasherBusy("Password hashing timed out")
+        except BrokenProcessPool: # A worker died: start a fresh pool for the next job
+            self._reset_pool()
+            raise
+
+    def _submit(self, func, *args):
+        """
+        Submits a job for a queue slot the caller has acquired. The slot is released when the job
+        finishes, fails or is cancelled - not when the caller stops waiting for it.
+        """
+        try:
+            future = self._get_pool().submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # Spawned, not forked: the web process already runs threads (e.g. the media sweeper)
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def _reset_pool(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)